@@ -21,12 +21,17 @@ def create_app(config_name="default"):
     app.config.from_object(config[config_name])
     config[config_name].init_app(app)
 
+    configure_json(app)
     configure_models(app)
     registering_blueprints(app)
     configure_extensions(app)
     configure_auth_providers(app)
     configure_errors(app)
     configure_logging(app)
+    configure_audit_log(app)
+    configure_api_auth(app)
+    configure_completion_history(app)
+    configure_policy_rendering(app)
     set_config_options(app)
 
     """
@@ -77,6 +82,13 @@ def configure_auth_providers(app):
         app.is_microsoft_auth_configured = True
 
 
+def configure_json(app):
+    from app.utils.json_provider import AppJSONProvider
+
+    app.json = AppJSONProvider.from_config(app)
+    return
+
+
 def configure_models(app):
     from app import models
 
@@ -89,6 +101,35 @@ def configure_models(app):
     return
 
 
+def configure_audit_log(app):
+    from app.utils.audit_log import AuditLogWriter
+
+    app.audit_log = AuditLogWriter.from_config(app)
+    return
+
+
+def configure_api_auth(app):
+    from app.utils.api_auth import TokenCache, UserActivity
+
+    app.token_cache = TokenCache.from_config(app)
+    app.user_activity = UserActivity.from_config(app)
+    return
+
+
+def configure_completion_history(app):
+    from app.utils.completion_history import CompletionRecorder
+
+    app.completion_history = CompletionRecorder.from_config(app)
+    return
+
+
+def configure_policy_rendering(app):
+    from app.utils.policy_render import PolicyRenderer
+
+    app.policy_renderer = PolicyRenderer.from_config(app)
+    return
+
+
 def configure_extensions(app):
     db.init_app(app)
     mail.init_app(app)
@@ -12,6 +12,7 @@ from flask_login import current_user
 from app.utils.decorators import login_required
 from app.email import send_email
 from app.utils.authorizer import Authorizer
+from app.utils.search_index import SearchIndex
 from app.utils import misc
 import arrow
 
@@ -407,15 +408,77 @@ def get_labels_for_tenant(tid):
     return jsonify(data)
 
 
+@api.route("/tenants/<string:tid>/search", methods=["GET"])
+@login_required
+def search_tenant(tid):
+    """
+    full-text search over the controls, subcontrols, evidence, policies,
+    vendors and risks the user may read. ?kind=evidence,policy limits the
+    kinds, ?offset= returns the next page
+    """
+    result = Authorizer(current_user).can_user_search_tenant(tid)
+    if not (text := request.args.get("q", "").strip()):
+        abort(400, "Query is required")
+    kinds = [kind for kind in request.args.get("kind", "").split(",") if kind]
+    if any(kind not in SearchIndex.KINDS for kind in kinds):
+        abort(400, "Invalid kind")
+    return jsonify(
+        SearchIndex().search(
+            result["extra"]["tenant"].id,
+            text,
+            result["extra"]["scope"],
+            kinds=kinds,
+            limit=request.args.get("limit", 20, type=int),
+            offset=request.args.get("offset", 0, type=int),
+        )
+    )
+
+
+def get_log_filters():
+    return {
+        key: request.args.get(key)
+        for key in ["namespace", "level", "action", "user_id"]
+        if request.args.get(key)
+    }
+
+
 @api.route("/logs")
 @login_required
 def get_logs():
+    """
+    returns a list of the latest logs. Pass ?cursor= (empty for the first
+    page) to get {"logs": [...], "next_cursor": ...} pages instead
+    """
     Authorizer(current_user).can_user_manage_platform()
+    if "cursor" in request.args:
+        return jsonify(
+            models.Logs.page(
+                cursor=request.args.get("cursor"),
+                limit=request.args.get("limit", 100, type=int),
+                **get_log_filters(),
+            )
+        )
     return jsonify(models.Logs.get(as_dict=True, limit=500))
 
 
+@api.route("/logs/writer")
+@login_required
+def get_log_writer_stats():
+    Authorizer(current_user).can_user_manage_platform()
+    return jsonify(current_app.audit_log.stats())
+
+
 @api.route("/tenants/<string:id>/logs")
 @login_required
 def get_logs_for_tenant(id):
     result = Authorizer(current_user).can_user_access_tenant(id)
+    if "cursor" in request.args:
+        return jsonify(
+            models.Logs.page(
+                tenant_id=result["extra"]["tenant"].id,
+                cursor=request.args.get("cursor"),
+                limit=request.args.get("limit", 100, type=int),
+                **get_log_filters(),
+            )
+        )
     return jsonify(result["extra"]["tenant"].get_logs(as_dict=True, limit=500))
@@ -2,7 +2,6 @@ from flask import (
     jsonify,
     request,
     abort,
-    send_file,
 )
 from . import api
 from app import models, db
@@ -10,8 +9,8 @@ from flask_login import current_user
 from app.utils.authorizer import Authorizer
 from app.utils.decorators import login_required
 from app.utils.gcs_helper import GCS
+from app.utils.file_handler import FileStorageHandler
 from werkzeug.utils import secure_filename
-from io import BytesIO
 
 
 @api.route("/assessments/<string:id>/manage", methods=["GET"])
@@ -179,13 +178,13 @@ def get_file_for_assessment_item(qid, id):
     # TODO - update to file_handler.py
     gcs = GCS(root_path=result["extra"]["assessment"].tenant_id)
     blob = gcs.get_file(item.response)
-    content_type = blob.content_type
+    blob.reload()
 
-    return send_file(
-        BytesIO(blob.download_as_bytes()),
+    return FileStorageHandler.range_response(
+        blob.size,
+        lambda start, end: FileStorageHandler.stream_gcs_blob(blob, start, end),
         download_name=item.response,
-        mimetype=content_type,
-        as_attachment=True,
+        mimetype=blob.content_type or "application/octet-stream",
     )
 
 
@@ -199,6 +198,18 @@ def get_files_for_vendor(id):
     return jsonify(data)
 
 
+@api.route("/vendors/<string:vid>/files/<string:fid>/download", methods=["GET"])
+@login_required
+def download_file_for_vendor(vid, fid):
+    result = Authorizer(current_user).can_user_access_vendor(vid)
+    vendor_file = (
+        result["extra"]["vendor"]
+        .files.filter(models.VendorFile.id == fid)
+        .first_or_404()
+    )
+    return vendor_file.send_file()
+
+
 @api.route("/vendors/<string:id>/files", methods=["POST"])
 @login_required
 def upload_file_for_vendor(id):
@@ -209,10 +220,34 @@ def upload_file_for_vendor(id):
         abort(422, "File not found")
     file = request.files["file"]
     filename = secure_filename(file.filename)
-    vendor_file = vendor.create_file(filename, file)
+    vendor_file = vendor.create_file(filename, file, owner_id=current_user.id)
     return jsonify(vendor_file.as_dict())
 
 
+@api.route("/vendors/<string:id>/files/uploads", methods=["POST"])
+@login_required
+def create_file_upload_for_vendor(id):
+    """
+    first phase of a direct upload, see /uploads/<id>/finalize
+    """
+    result = Authorizer(current_user).can_user_access_vendor(id)
+    data = request.get_json()
+    upload = models.UploadSession.create(
+        "vendor_file",
+        result["extra"]["vendor"],
+        name=secure_filename(data.get("name") or data.get("file_name") or ""),
+        file_name=data.get("file_name"),
+        size=data.get("size"),
+        checksum=data.get("checksum"),
+        sha256=data.get("sha256"),
+        content_type=data.get("content_type"),
+        description=data.get("description"),
+        owner_id=current_user.id,
+    )
+    origin = request.headers.get("Origin")
+    return jsonify(upload.as_dict(upload=upload.get_upload(origin=origin)))
+
+
 @api.route("/items/<string:id>/messages", methods=["POST"])
 @login_required
 def create_message_for_item(id):
@@ -1,6 +1,7 @@
 from flask import (
     jsonify,
     request,
+    current_app,
 )
 from . import api
 from app.models import *
@@ -115,7 +116,7 @@ def get_vendor_categories(id):
 def get_vendor_assessments(id):
     result = Authorizer(current_user).can_user_access_vendor(id)
     vendor = result["extra"]["vendor"]
-    return jsonify([assessment.as_dict() for assessment in vendor.get_assessments()])
+    return jsonify(Assessment.serialize(vendor.get_assessments()))
 
 
 @api.route("/vendors/<string:id>/bus", methods=["GET"])
@@ -130,10 +131,8 @@ def get_vendor_business_units(id):
 @login_required
 def get_vendors_for_tenant(id):
     result = Authorizer(current_user).can_user_access_tenant(id)
-    vendors = Vendor.query.filter(
-        Vendor.tenant_id == result["extra"]["tenant"].id
-    ).all()
-    return jsonify([vendor.as_dict() for vendor in vendors])
+    vendors = Vendor.query.filter(Vendor.tenant_id == result["extra"]["tenant"].id)
+    return current_app.json.stream(vendor.as_dict() for vendor in vendors)
 
 
 @api.route("/tenants/<string:id>/applications", methods=["GET"])
@@ -142,8 +141,10 @@ def get_apps_for_tenant(id):
     result = Authorizer(current_user).can_user_access_tenant(id)
     applications = VendorApp.query.filter(
         VendorApp.tenant_id == result["extra"]["tenant"].id
-    ).all()
-    return jsonify([application.as_dict() for application in applications])
+    )
+    return current_app.json.stream(
+        application.as_dict() for application in applications
+    )
 
 
 @api.route("/tenants/<string:id>/assessments", methods=["GET"])
@@ -153,17 +154,17 @@ def get_assessments_for_tenant(id):
     assessments = Assessment.query.filter(
         Assessment.tenant_id == result["extra"]["tenant"].id
     ).all()
-    return jsonify([assessment.as_dict() for assessment in assessments])
+    return jsonify(Assessment.serialize(assessments))
 
 
 @api.route("/tenants/<string:id>/risks", methods=["GET"])
 @login_required
 def get_risks_for_tenant(id):
     result = Authorizer(current_user).can_user_access_tenant(id)
-    data = []
-    for risk in RiskRegister.query.filter(RiskRegister.tenant_id == id).all():
-        data.append(risk.as_dict())
-    return jsonify(data)
+    risks = RiskRegister.query.filter(
+        RiskRegister.tenant_id == result["extra"]["tenant"].id
+    )
+    return current_app.json.stream(risk.as_dict() for risk in risks)
 
 
 @api.route("/vendors/<string:id>/notes", methods=["PUT"])
@@ -4,17 +4,20 @@ from flask import (
     current_app,
     abort,
     render_template,
-    Response,
 )
 from . import api
 from app import models, db
 from flask_login import current_user
 from app.utils.decorators import login_required
 from app.utils.misc import project_creation, get_users_from_text
-from sqlalchemy import func
 from app.email import send_email
 from app.utils.reports import Report
 from app.utils.authorizer import Authorizer
+from app.utils.control_stats import ControlStats
+from app.utils.resp_matrix import ResponsibilityMatrix
+from app.utils.evidence_index import EvidenceIndex
+from app.utils.membership import MembershipDirectory
+from sqlalchemy.orm import undefer, undefer_group
 import arrow
 
 
@@ -83,10 +86,8 @@ def update_assessment_submission(qid):
 @login_required
 def get_assessments(tid):
     result = Authorizer(current_user).can_user_access_tenant(tid)
-    data = []
-    for assessment in result["extra"]["tenant"].get_assessments_for_user(current_user):
-        data.append(assessment.as_dict())
-    return jsonify(data)
+    assessments = result["extra"]["tenant"].get_assessments_for_user(current_user)
+    return jsonify(models.Assessment.serialize(assessments))
 
 
 @api.route("/tenants/<string:tid>/forms", methods=["GET"])
@@ -225,55 +226,24 @@ def get_findings_for_project(pid):
 @login_required
 def get_resp_matrix_summary_for_project(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
-    data = {"total": 0, "owners": [], "operators": []}
-    _query = result["extra"]["project"].subcontrols(as_query=True)
-    data["total"] = _query.count()
-    for record in (
-        _query.with_entities(
-            models.ProjectSubControl.operator_id,
-            func.count(models.ProjectSubControl.operator_id),
-        )
-        .group_by(models.ProjectSubControl.operator_id)
-        .all()
-    ):
-        if record[0]:
-            if user := models.User.query.get(record[0]):
-                data["operators"].append(
-                    {"email": user.email, "user_id": user.id, "subcontrols": record[1]}
-                )
-    for record in (
-        _query.with_entities(
-            models.ProjectSubControl.owner_id,
-            func.count(models.ProjectSubControl.owner_id),
-        )
-        .group_by(models.ProjectSubControl.owner_id)
-        .all()
-    ):
-        if record[0]:
-            if user := models.User.query.get(record[0]):
-                data["owners"].append(
-                    {"email": user.email, "user_id": user.id, "subcontrols": record[1]}
-                )
-    return jsonify(data)
+    return jsonify(ResponsibilityMatrix(result["extra"]["project"]).get_summary())
 
 
 @api.route("/projects/<string:pid>/matrix/users/<string:uid>", methods=["GET"])
 @login_required
 def get_resp_matrix_for_user(pid, uid):
     result = Authorizer(current_user).can_user_access_project(pid)
-    if uid == 0:
+    # 0 lists the subcontrols without an owner or operator
+    if uid == "0":
         uid = None
-    data = {"owner": [], "operator": []}
-    _query = result["extra"]["project"].subcontrols(as_query=True)
-    data["owner"] = [
-        x.as_dict()
-        for x in _query.filter(models.ProjectSubControl.owner_id == uid).all()
-    ]
-    data["operator"] = [
-        x.as_dict()
-        for x in _query.filter(models.ProjectSubControl.operator_id == uid).all()
-    ]
-    return jsonify(data)
+    return jsonify(
+        ResponsibilityMatrix(result["extra"]["project"]).get_assignments(
+            uid,
+            expand=request.args.get(
+                "expand", False, type=lambda v: v.lower() in ("1", "true")
+            ),
+        )
+    )
 
 
 @api.route("/projects/<string:pid>/members")
@@ -281,14 +251,7 @@ def get_resp_matrix_for_user(pid, uid):
 def get_members_for_project(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
     project = result["extra"]["project"]
-    users = []
-    for user in project.tenant.get_members():
-        record = {"id": user["id"], "email": user["email"], "member": False}
-        if member := project.has_member(user["email"]):
-            record["member"] = True
-            record["access_level"] = member.access_level
-        users.append(record)
-    return jsonify(users)
+    return jsonify(MembershipDirectory(project.tenant).get_project_members(project))
 
 
 @api.route("/projects/<string:pid>/members", methods=["POST"])
@@ -343,7 +306,10 @@ def create_control_for_tenant(tid):
 def get_policies_for_tenant(tid):
     result = Authorizer(current_user).can_user_read_tenant(tid)
     data = []
-    for policy in result["extra"]["tenant"].policies.all():
+    # the editor uses the content of the listed policies
+    for policy in (
+        result["extra"]["tenant"].policies.options(undefer_group("body")).all()
+    ):
         data.append(policy.as_dict())
     return jsonify(data)
 
@@ -371,6 +337,20 @@ def reload_tenant_frameworks(tid):
     return jsonify({"message": "ok"})
 
 
+@api.route("/tenants/<string:tid>/controls/<string:cid>", methods=["PUT"])
+@login_required
+def update_control_for_tenant(tid, cid):
+    result = Authorizer(current_user).can_user_manage_tenant(tid)
+    Authorizer(current_user).can_user_read_control(cid)
+    control = result["extra"]["tenant"].customize_control(models.Control.query.get(cid))
+    payload = request.get_json() or {}
+    for field in ["name", "description", "guidance", "references"]:
+        if field in payload:
+            setattr(control, field, payload[field])
+    db.session.commit()
+    return jsonify(control.as_dict())
+
+
 @api.route("/tenants/<string:tid>/load-policies", methods=["PUT"])
 @login_required
 def reload_tenant_policies(tid):
@@ -451,13 +431,7 @@ def get_evidence(eid):
 @login_required
 def get_file_for_evidence(id):
     result = Authorizer(current_user).can_user_read_evidence(id)
-    evidence = result["extra"]["evidence"]
-    file_bytes = evidence.get_file(as_blob=True)
-    return Response(
-        file_bytes,
-        mimetype="application/octet-stream",
-        headers={"Content-Disposition": f"attachment; filename={evidence.file_name}"},
-    )
+    return result["extra"]["evidence"].send_file()
 
 
 @api.route("/evidence/<string:eid>", methods=["PUT"])
@@ -520,12 +494,12 @@ def get_control(cid):
 @api.route("/tenants/<string:tid>/projects", methods=["GET"])
 @login_required
 def get_projects_in_tenant(tid):
-    data = []
     result = Authorizer(current_user).can_user_access_tenant(tid)
     exclude = request.args.get("exclude-timely", False)
-    for record in current_user.get_projects(result["extra"]["tenant"].id):
-        data.append(record.as_dict(with_summary=True, exclude_timely=exclude))
-    return jsonify(data)
+    projects = current_user.get_projects(result["extra"]["tenant"].id)
+    return current_app.json.stream(
+        record.as_dict(with_summary=True, exclude_timely=exclude) for record in projects
+    )
 
 
 @api.route("/tenants/<string:tid>/projects", methods=["POST"])
@@ -576,14 +550,14 @@ def update_settings_in_project(pid):
 @login_required
 def get_project_completion_history(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
-    return jsonify(result["extra"]["project"].generate_last_30_days())
+    days = request.args.get("days", 30, type=int)
+    return jsonify(result["extra"]["project"].get_completion_history(days=days))
 
 
 @api.route("/projects/<string:pid>/controls", methods=["GET"])
 @login_required
 def get_controls_for_project(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
-    data = []
     view = request.args.get("view")
     if view == "all":
         view = None
@@ -591,28 +565,7 @@ def get_controls_for_project(pid):
     if stats:
         stats = True
 
-    # controls = result["extra"]["project"].get_controls()
-    for control in result["extra"]["project"].controls.all():
-        record = control.as_dict()
-        if view:
-            if view == "with-evidence" and record["progress_evidence"] > 0:
-                data.append(record)
-            elif view == "missing-evidence" and record["progress_evidence"] == 0:
-                data.append(record)
-            elif view == "not-implemented" and record["progress_implemented"] == 0:
-                data.append(record)
-            elif view == "implemented" and record["progress_implemented"] == 100:
-                data.append(record)
-            elif view == "applicable" and record["is_applicable"]:
-                data.append(record)
-            elif view == "not-applicable" and not record["is_applicable"]:
-                data.append(record)
-            elif view == "complete" and record["is_complete"]:
-                data.append(record)
-            elif view == "not-complete" and not record["is_complete"]:
-                data.append(record)
-        else:
-            data.append(record)
+    data = ControlStats(result["extra"]["project"]).get_controls(view=view)
     return jsonify(data)
 
 
@@ -676,10 +629,14 @@ def create_risk_from_feedback(cid, fid):
 @login_required
 def get_policies_for_project(pid):
     result = Authorizer(current_user).can_user_access_project(pid)
-    data = []
-    for policy in result["extra"]["project"].policies.all():
-        data.append(policy.as_dict())
-    return jsonify(data)
+    return jsonify(
+        models.ProjectPolicy.catalog(
+            pid,
+            content=request.args.get(
+                "content", False, type=lambda v: v.lower() in ("1", "true")
+            ),
+        )
+    )
 
 
 @api.route("/projects/<string:pid>/policies/<string:ppid>", methods=["GET"])
@@ -700,6 +657,24 @@ def get_version_for_policy_in_project(pid, ppid, version):
     return jsonify(result["extra"]["policy"].get_version(version, as_dict=True))
 
 
+@api.route(
+    "/projects/<string:pid>/policies/<string:ppid>/versions/<string:version>/html",
+    methods=["GET"],
+)
+@login_required
+def render_version_for_policy_in_project(pid, ppid, version):
+    result = Authorizer(current_user).can_user_read_project_policy(ppid)
+    policy = result["extra"]["policy"]
+    version = policy.get_version(version)
+    return jsonify(
+        {
+            "version_id": version.id,
+            "version": version.version,
+            "html": policy.translate_to_html(version=version),
+        }
+    )
+
+
 @api.route("/projects/<string:pid>/policies/<string:ppid>/versions", methods=["POST"])
 @login_required
 def create_version_for_policy_in_project(pid, ppid):
@@ -1147,10 +1122,9 @@ def delete_feedback_for_control(pid, cid, fid):
 @login_required
 def get_evidence_for_project(pid):
     result = Authorizer(current_user).can_user_read_project(pid)
-    data = [
-        evidence.as_dict() for evidence in result["extra"]["project"].evidence.all()
-    ]
-    return jsonify(data)
+    project = result["extra"]["project"]
+    evidence = project.evidence.options(undefer(models.ProjectEvidence.content))
+    return jsonify(EvidenceIndex(project).serialize(evidence.all()))
 
 
 @api.route("/projects/<string:id>/evidence", methods=["POST"])
@@ -1168,6 +1142,70 @@ def create_evidence_for_project(id):
     return jsonify(evidence.as_dict())
 
 
+@api.route("/projects/<string:id>/evidence/uploads", methods=["POST"])
+@login_required
+def create_evidence_upload_for_project(id):
+    """
+    first phase of a direct upload, the client sends the file to
+    upload.url and then calls /uploads/<id>/finalize
+    """
+    result = Authorizer(current_user).can_user_edit_project(id)
+    data = request.get_json()
+    upload = models.UploadSession.create(
+        "evidence",
+        result["extra"]["project"],
+        name=data.get("name"),
+        file_name=data.get("file_name"),
+        size=data.get("size"),
+        checksum=data.get("checksum"),
+        sha256=data.get("sha256"),
+        content_type=data.get("content_type"),
+        description=data.get("description"),
+        meta={"content": data.get("content"), "group": data.get("group")},
+        owner_id=current_user.id,
+    )
+    origin = request.headers.get("Origin")
+    return jsonify(upload.as_dict(upload=upload.get_upload(origin=origin)))
+
+
+@api.route("/uploads/<string:id>", methods=["GET"])
+@login_required
+def get_upload(id):
+    result = Authorizer(current_user).can_user_manage_upload(id)
+    upload = result["extra"]["upload"]
+    origin = request.headers.get("Origin")
+    return jsonify(upload.as_dict(upload=upload.get_upload(origin=origin)))
+
+
+@api.route("/uploads/<string:id>/chunk", methods=["PUT"])
+@login_required
+def write_chunk_for_upload(id):
+    """
+    local storage fallback, the body is appended at ?offset=<bytes received>
+    """
+    result = Authorizer(current_user).can_user_manage_upload(id)
+    received = result["extra"]["upload"].write_chunk(
+        request.stream, offset=request.args.get("offset", 0, type=int)
+    )
+    return jsonify({"received": received})
+
+
+@api.route("/uploads/<string:id>/finalize", methods=["POST"])
+@login_required
+def finalize_upload(id):
+    result = Authorizer(current_user).can_user_manage_upload(id)
+    record = result["extra"]["upload"].finalize()
+    return jsonify(record.as_dict())
+
+
+@api.route("/uploads/<string:id>", methods=["DELETE"])
+@login_required
+def delete_upload(id):
+    result = Authorizer(current_user).can_user_manage_upload(id)
+    result["extra"]["upload"].discard()
+    return jsonify({"message": "ok"})
+
+
 @api.route(
     "/projects/<string:pid>/subcontrols/<string:sid>/evidence/<string:eid>/file",
     methods=["DELETE"],
@@ -1184,10 +1222,7 @@ def remove_file_from_evidence(pid, sid, eid):
 @login_required
 def get_evidence_for_subcontrol(pid, sid):
     result = Authorizer(current_user).can_user_read_project_subcontrol(sid)
-    data = [
-        evidence.as_dict() for evidence in result["extra"]["subcontrol"].evidence.all()
-    ]
-    return jsonify(data)
+    return jsonify(result["extra"]["subcontrol"].get_evidence(as_dict=True))
 
 
 @api.route("/projects/<string:pid>/subcontrols/<string:sid>/evidence", methods=["POST"])
@@ -5,3 +5,8 @@ from .init_db import (
     DataImportCommand,
     ForceDropTablesCommand,
 )
+from .logs import IndexLogsCommand, ArchiveLogsCommand
+from .storage import ReconcileStorageCommand, CollectBlobsCommand
+from .history import CompactHistoryCommand
+from .search import IndexSearchCommand
+from .progress import ReconcileProgressCommand
@@ -0,0 +1,32 @@
+from flask_script import Command, Option
+from app.models import CompletionHistory
+import time
+
+
+class CompactHistoryCommand(Command):
+    """Compact old completion history to one snapshot per project per day."""
+
+    option_list = (
+        Option(
+            "--days",
+            "-d",
+            dest="days",
+            type=int,
+            help="only snapshots older than N days",
+        ),
+        Option(
+            "--every",
+            "-e",
+            dest="every",
+            type=float,
+            help="keep running and compact every N hours",
+        ),
+    )
+
+    def run(self, days=None, every=None):
+        while True:
+            deleted = CompletionHistory.compact(after_days=days)
+            print(f"[INFO] Deleted {deleted} completion snapshots")
+            if not every:
+                return
+            time.sleep(every * 3600)
@@ -0,0 +1,38 @@
+from flask_script import Command, Option
+from app.models import Logs
+from app.utils.log_archive import LogArchiver
+import time
+
+
+class IndexLogsCommand(Command):
+    """Create the optional GIN index for log meta filters."""
+
+    def run(self):
+        Logs.create_meta_index()
+        print("[INFO] Log meta index has been created.")
+
+
+class ArchiveLogsCommand(Command):
+    """Archive and delete logs older than the retention period."""
+
+    option_list = (
+        Option("--days", "-d", dest="days", type=int, help="retention in days"),
+        Option(
+            "--every",
+            "-e",
+            dest="every",
+            type=float,
+            help="keep running and archive every N hours",
+        ),
+    )
+
+    def run(self, days=None, every=None):
+        while True:
+            for result in LogArchiver(retention_days=days).run():
+                print(
+                    f"[INFO] {result['month']}: archived {result['archived']} "
+                    f"and deleted {result['deleted']} logs"
+                )
+            if not every:
+                return
+            time.sleep(every * 3600)
@@ -0,0 +1,46 @@
+from flask_script import Command, Option
+from app import db
+from app.models import Project, ProjectProgress
+import time
+
+
+class ReconcileProgressCommand(Command):
+    """Rebuild the control and project progress rollups."""
+
+    option_list = (
+        Option("--tenant", "-t", dest="tenant_id", help="only reconcile this tenant"),
+        Option(
+            "--missing",
+            "-m",
+            dest="missing",
+            action="store_true",
+            help="only build the projects without a rollup",
+        ),
+        Option(
+            "--every",
+            "-e",
+            dest="every",
+            type=float,
+            help="keep running and reconcile every N hours",
+        ),
+    )
+
+    def run(self, tenant_id=None, missing=False, every=None):
+        while True:
+            query = Project.query.with_entities(Project.id)
+            if tenant_id:
+                query = query.filter(Project.tenant_id == tenant_id)
+            if missing:
+                query = query.filter(
+                    ~Project.id.in_(db.session.query(ProjectProgress.project_id))
+                )
+            for (project_id,) in query.all():
+                record = ProjectProgress.rebuild(project_id)
+                db.session.commit()
+                print(
+                    f"[INFO] project:{project_id}: {record.controls} controls, "
+                    f"{record.completion_progress()}% complete"
+                )
+            if not every:
+                return
+            time.sleep(every * 3600)
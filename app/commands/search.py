@@ -0,0 +1,33 @@
+from flask_script import Command, Option
+from app import db
+from app.models import Tenant
+from app.utils.search_index import SearchIndex
+import time
+
+
+class IndexSearchCommand(Command):
+    """Rebuild the full-text search documents of every tenant."""
+
+    option_list = (
+        Option("--tenant", "-t", dest="tenant_id", help="only rebuild this tenant"),
+        Option(
+            "--every",
+            "-e",
+            dest="every",
+            type=float,
+            help="keep running and rebuild every N hours",
+        ),
+    )
+
+    def run(self, tenant_id=None, every=None):
+        while True:
+            query = Tenant.query
+            if tenant_id:
+                query = query.filter(Tenant.id == tenant_id)
+            for tenant in query.all():
+                SearchIndex().reindex(tenant.id)
+                db.session.commit()
+                print(f"[INFO] Rebuilt the search index of tenant:{tenant.id}")
+            if not every:
+                return
+            time.sleep(every * 3600)
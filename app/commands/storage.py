@@ -0,0 +1,61 @@
+from flask_script import Command, Option
+from app.models import StorageUsage, Tenant, FileBlob, UploadSession
+import time
+
+
+class ReconcileStorageCommand(Command):
+    """Recompute the storage usage ledger of every tenant."""
+
+    option_list = (
+        Option("--tenant", "-t", dest="tenant_id", help="only reconcile this tenant"),
+        Option(
+            "--every",
+            "-e",
+            dest="every",
+            type=float,
+            help="keep running and reconcile every N hours",
+        ),
+    )
+
+    def run(self, tenant_id=None, every=None):
+        while True:
+            query = Tenant.query
+            if tenant_id:
+                query = query.filter(Tenant.id == tenant_id)
+            for tenant in query.all():
+                total = StorageUsage.reconcile(tenant)
+                print(f"[INFO] {tenant.name}: {total} bytes")
+            if not every:
+                return
+            time.sleep(every * 3600)
+
+
+class CollectBlobsCommand(Command):
+    """Delete expired uploads and the evidence blobs that are no longer referenced."""
+
+    option_list = (
+        Option(
+            "--grace",
+            "-g",
+            dest="grace_hours",
+            type=float,
+            help="only blobs unreferenced for N hours",
+        ),
+        Option(
+            "--every",
+            "-e",
+            dest="every",
+            type=float,
+            help="keep running and collect every N hours",
+        ),
+    )
+
+    def run(self, grace_hours=None, every=None):
+        while True:
+            discarded = UploadSession.sweep()
+            print(f"[INFO] Discarded {discarded} expired uploads")
+            deleted = FileBlob.collect(grace_hours=grace_hours)
+            print(f"[INFO] Deleted {deleted} unreferenced blobs")
+            if not every:
+                return
+            time.sleep(every * 3600)
@@ -1,5 +1,7 @@
-from sqlalchemy import func, distinct, case
-from sqlalchemy.orm import validates
+from sqlalchemy import func, distinct, case, and_, or_, cast, select, DDL, inspect
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR, insert
+from sqlalchemy.orm import validates, deferred, undefer, aliased
+from sqlalchemy.exc import IntegrityError
 from app.utils.mixin_models import (
     DateMixin,
     SubControlMixin,
@@ -8,21 +10,22 @@ from app.utils.mixin_models import (
     AuthorizerMixin,
 )
 from flask_login import UserMixin
-from flask import current_app, render_template, abort
+from flask import current_app, render_template, abort, url_for
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.datastructures import FileStorage
-from datetime import datetime
-from sqlalchemy.event import listens_for
+from datetime import datetime, timedelta
+from sqlalchemy.event import listens_for, listen
 from app import db, login
 from uuid import uuid4
 from app.utils import misc
 import arrow
+import base64
 import json
 import os
-from string import Formatter
+import re
 from app.email import send_email
 from random import randrange
-from app.utils.authorizer import Authorizer
+from app.utils.authorizer import Authorizer, AccessMap
 import email_validator
 from werkzeug.utils import secure_filename
 import shutil
@@ -30,6 +33,16 @@ import random
 import logging
 import shortuuid
 from app.utils.file_handler import FileStorageHandler
+from app.utils.completion_history import CompletionRecorder
+from app.utils.evidence_index import EvidenceIndex
+from app.utils.membership import MembershipDirectory
+from app.utils.search_index import SearchIndex
+from app.utils.framework_import import (
+    FrameworkCatalog,
+    FrameworkImporter,
+    build_control,
+    with_defaults,
+)
 from typing import List
 from app.utils.exceptions import FileDoesNotExist
 
@@ -81,6 +94,7 @@ class VendorFile(db.Model, QueryMixin):
     collected_on = db.Column(db.DateTime, default=datetime.utcnow)
     vendor_id = db.Column(db.String, db.ForeignKey("vendors.id"), nullable=False)
     owner_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=False)
+    blob_id = db.Column(db.String, db.ForeignKey("file_blobs.id"), nullable=True)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
@@ -99,26 +113,44 @@ class VendorFile(db.Model, QueryMixin):
         file_handler = FileStorageHandler(
             provider=current_app.config["STORAGE_METHOD"],
         )
-        return file_handler.get_file(path=os.path.join(self.vendor_id, self.name))
+        return file_handler.get_file(path=self.get_path())
 
-    def save_file(self, file_object):
+    def get_path(self):
+        if self.blob_id:
+            return FileBlob.query.get(self.blob_id).path
+        return os.path.join(
+            self.vendor.get_evidence_folder(self.provider), f"{self.id}_{self.name}"
+        )
+
+    def send_file(self):
+        """
+        streaming (and Range aware) download response for the file
+        """
         storage_method = current_app.config["STORAGE_METHOD"]
         if self.provider != storage_method:
             abort(
                 500,
                 f"Storage method mismatch. File provider:{self.provider}. STORAGE_METHOD:{storage_method}",
             )
+        file_handler = FileStorageHandler(provider=self.provider)
+        try:
+            return file_handler.send_file(self.get_path(), download_name=self.name)
+        except FileDoesNotExist:
+            abort(404, "File does not exist")
 
-        if storage_method == "local":
-            folder = self.vendor.create_evidence_folder()
+    def save_file(self, file_object):
+        storage_method = current_app.config["STORAGE_METHOD"]
+        if self.provider != storage_method:
+            abort(
+                500,
+                f"Storage method mismatch. File provider:{self.provider}. STORAGE_METHOD:{storage_method}",
+            )
 
-        upload_params = {
-            "file": file_object,
-            "file_name": f"{self.id}_{self.name}",
-            "folder": self.vendor.get_evidence_folder(storage_method),
-        }
-        file_handler = FileStorageHandler(provider=storage_method)
-        return file_handler.upload_file(**upload_params)
+        blob = FileBlob.store(self.vendor.tenant, file_object, provider=storage_method)
+        if self.blob_id:
+            FileBlob.release(self.blob_id)
+        self.blob_id = blob.id
+        return blob.path
 
     @validates("provider")
     def _validate_provider(self, key, value):
@@ -465,8 +497,10 @@ class Vendor(db.Model, QueryMixin):
     def create_evidence_folder(self):
         return self.tenant.create_vendor_evidence_folder(vendor_id=self.id)
 
-    def get_evidence_folder(self):
-        return self.tenant.get_vendor_evidence_folder(vendor_id=self.id)
+    def get_evidence_folder(self, provider="local"):
+        return self.tenant.get_vendor_evidence_folder(
+            vendor_id=self.id, provider=provider
+        )
 
     def days_until_next_review(self, humanize=False):
         next_review_date = self.get_next_review_date()
@@ -742,16 +776,7 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
         return Tenant.query.filter(Tenant.is_default).first()
 
     def get_members(self):
-        members = []
-        for member in self.members.all():
-            user = member.user.as_dict()
-            roles = [role.name for role in member.roles.all()]
-            user["roles"] = roles
-            if "vendor" in roles:
-                user["is_vendor"] = True
-            user.pop("tenants", None)
-            members.append(user)
-        return members
+        return MembershipDirectory(self).get_members()
 
     def send_member_email_invite(self, user):
         """
@@ -905,6 +930,7 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
 
         member.roles = new_roles
         db.session.commit()
+        AccessMap.clear()
         return member
 
     def remove_member(self, user):
@@ -915,6 +941,7 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
         if member:
             db.session.delete(member)
             db.session.commit()
+            AccessMap.clear()
         return True
 
     def add_role_for_member(self, user, role_names):
@@ -937,6 +964,7 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
                 member.roles.append(role)
 
         db.session.commit()
+        AccessMap.clear()
         return member
 
     def remove_role_for_member(self, user, role_names):
@@ -959,6 +987,7 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
                 member.roles.remove(role)
 
         db.session.commit()
+        AccessMap.clear()
         return member
 
     @validates("license")
@@ -1149,28 +1178,88 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
         return True
 
     def create_base_controls_for_framework(self, name):
-        name = name.lower()
-        with open(
-            os.path.join(current_app.config["FRAMEWORK_FOLDER"], f"{name}.json")
-        ) as f:
-            controls = json.load(f)
-            # TODO - reformat, takes forever b/c of commit
-            Control.create({"controls": controls, "framework": name}, self.id)
+        framework = Framework.find_by_name(name, self.id)
+        if framework and current_app.config["SHARED_FRAMEWORK_CATALOG"]:
+            framework.catalog_id = FrameworkCatalog.get_framework(name).id
+            db.session.commit()
+            return True
+        FrameworkImporter(self.id).import_framework(name)
         return True
 
     def create_base_frameworks(self, init_controls=False):
         folder = current_app.config["FRAMEWORK_FOLDER"]
         if not os.path.isdir(folder):
             abort(422, f"Folder does not exist: {folder}")
+        created = []
         for file in os.listdir(folder):
             if file.endswith(".json"):
                 name = file.split(".json")[0]
                 if not Framework.find_by_name(name, self.id):
                     Framework.create(name, self)
-                    if init_controls:
-                        self.create_base_controls_for_framework(name)
+                    created.append(name)
+        if init_controls and created:
+            if not current_app.config["SHARED_FRAMEWORK_CATALOG"]:
+                FrameworkImporter(self.id).import_frameworks(created)
+                return True
+            for catalog in FrameworkCatalog.load(created):
+                Framework.find_by_name(catalog.name, self.id).catalog_id = catalog.id
+            db.session.commit()
         return True
 
+    def customize_control(self, control):
+        """
+        copy-on-write for controls of the shared framework catalog. Copies
+        the control and its subcontrols into the tenant and points the
+        tenant projects to the copy. Returns the tenant control
+        """
+        if control.tenant_id == self.id:
+            return control
+        if control.tenant_id is not None:
+            abort(403, "Control does not belong to the tenant")
+        framework = Framework.query.filter(
+            Framework.tenant_id == self.id, Framework.catalog_id == control.framework_id
+        ).first()
+        if not framework:
+            abort(404, "Framework is not enabled for the tenant")
+        if copy := framework.controls.filter(Control.source_id == control.id).first():
+            return copy
+
+        copy = Control(
+            **{
+                c.name: getattr(control, c.name)
+                for c in Control.__table__.columns
+                if c.name not in ["id", "date_added", "date_updated"]
+            }
+        )
+        copy.tenant_id = self.id
+        copy.framework_id = framework.id
+        copy.source_id = control.id
+        db.session.add(copy)
+        subcontrols = {}
+        for sub in control.subcontrols.all():
+            subcontrols[sub.id] = SubControl(
+                **{
+                    c.name: getattr(sub, c.name)
+                    for c in SubControl.__table__.columns
+                    if c.name not in ["id", "control_id", "date_added", "date_updated"]
+                }
+            )
+            copy.subcontrols.append(subcontrols[sub.id])
+        db.session.flush()
+
+        project_ids = db.session.query(Project.id).filter(Project.tenant_id == self.id)
+        ProjectControl.query.filter(ProjectControl.control_id == control.id).filter(
+            ProjectControl.project_id.in_(project_ids)
+        ).update({"control_id": copy.id}, synchronize_session=False)
+        for source_id, sub in subcontrols.items():
+            ProjectSubControl.query.filter(
+                ProjectSubControl.subcontrol_id == source_id
+            ).filter(ProjectSubControl.project_id.in_(project_ids)).update(
+                {"subcontrol_id": sub.id}, synchronize_session=False
+            )
+        db.session.commit()
+        return copy
+
     def create_base_policies(self):
         for filename in os.listdir(current_app.config["POLICY_FOLDER"]):
             if filename.endswith(".html"):
@@ -1282,17 +1371,24 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
             *(["projects", project_id.lower()] if project_id else []),
         )
 
-    def can_save_file_in_folder(self, provider=None):
-        if not provider:
-            provider = current_app.config["STORAGE_METHOD"]
-        handler = FileStorageHandler(provider=provider)
-        current_size = handler.get_size(folder=self.get_evidence_folder())
+    def can_save_file_in_folder(self, provider=None, size=0):
+        """
+        checks the storage_cap against the StorageUsage ledger, so the
+        provider is not listed on every upload
+        """
+        current_size = self.get_storage_usage()
 
-        if current_size < int(self.storage_cap):
+        if current_size + size < int(self.storage_cap):
             return True
 
         return False
 
+    def get_storage_usage(self, project_id=None):
+        """
+        bytes stored by the tenant (or one of its projects)
+        """
+        return StorageUsage.get(self, project_id=project_id)
+
     def get_tenant_info(self):
         data = {
             "projects": self.projects.count(),
@@ -1380,8 +1476,11 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
             project.framework_id = framework_id
 
         self.projects.append(project)
-        for control in controls:
-            project.add_control(control, commit=False)
+        db.session.flush()
+        # the controls added below apply their progress to the rollup
+        db.session.add(ProjectProgress(project_id=project.id))
+        db.session.flush()
+        project.add_controls(controls, commit=False)
 
         evidence = ProjectEvidence(
             name="Evidence N/A",
@@ -1392,6 +1491,651 @@ class Tenant(db.Model, QueryMixin, AuthorizerMixin):
         return project
 
 
+class StorageUsage(db.Model):
+    """
+    Ledger of the bytes stored per tenant and per project. The tenant row
+    (key is the tenant id) includes projects and vendor files. Uploads and
+    deletes adjust the rows in SQL, reconcile() recomputes them from the
+    storage provider (see manage.py reconcile_storage)
+    """
+
+    __tablename__ = "storage_usage"
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    key = db.Column(db.String, nullable=False, unique=True)
+    bytes = db.Column(db.BigInteger, default=0)
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
+    project_id = db.Column(
+        db.String, db.ForeignKey("projects.id", ondelete="CASCADE"), nullable=True
+    )
+    date_reconciled = db.Column(db.DateTime)
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def add(tenant_id, size, project_id=None, tenant=True):
+        """
+        adds size bytes (negative for deletes) to the tenant and project.
+        With tenant=False only the project is updated (e.g. a blob that is
+        already counted for the tenant). Does not commit, the caller owns
+        the transaction
+        """
+        keys = [(tenant_id, None)] if tenant else []
+        if project_id:
+            keys.append((project_id, project_id))
+        for key, project in keys:
+            updated = StorageUsage.query.filter(StorageUsage.key == key).update(
+                {
+                    StorageUsage.bytes: StorageUsage.bytes + size,
+                    StorageUsage.date_updated: datetime.utcnow(),
+                },
+                synchronize_session=False,
+            )
+            if not updated and key != tenant_id:
+                db.session.add(
+                    StorageUsage(
+                        key=key,
+                        bytes=max(size, 0),
+                        tenant_id=tenant_id,
+                        project_id=project,
+                    )
+                )
+        return True
+
+    @staticmethod
+    def get(tenant, project_id=None):
+        """
+        returns the bytes used. The tenant is reconciled on first use
+        """
+        key = project_id or tenant.id
+        if record := StorageUsage.query.filter(StorageUsage.key == key).first():
+            return record.bytes
+        if not StorageUsage.query.filter(StorageUsage.key == tenant.id).first():
+            StorageUsage.reconcile(tenant)
+            return StorageUsage.get(tenant, project_id=project_id)
+        return 0
+
+    @staticmethod
+    def reconcile(tenant, provider=None):
+        """
+        recomputes the ledger of the tenant from the storage provider
+        """
+        provider = provider or current_app.config["STORAGE_METHOD"]
+        handler = FileStorageHandler(provider=provider)
+
+        def get_size(folder, recursive=False):
+            try:
+                return handler.get_size(folder=folder, recursive=recursive)
+            except Exception as e:
+                logging.warning(f"Unable to get the size of {folder}: {e}")
+                return 0
+
+        sizes = {
+            project.id: get_size(project.get_evidence_folder(provider=provider))
+            for project in tenant.projects.all()
+        }
+        # files in the content addressed store, counted once per project
+        blobs = (
+            db.session.query(FileBlob.id, FileBlob.size, ProjectEvidence.project_id)
+            .join(ProjectEvidence, ProjectEvidence.blob_id == FileBlob.id)
+            .filter(FileBlob.tenant_id == tenant.id, FileBlob.provider == provider)
+            .distinct()
+            .all()
+        )
+        for blob in blobs:
+            sizes[blob.project_id] = sizes.get(blob.project_id, 0) + blob.size
+        # s3 and gcs prefixes include the project folders
+        total = get_size(tenant.get_evidence_folder(provider=provider), True)
+        total += sum(
+            get_size(vendor.get_evidence_folder(provider))
+            for vendor in tenant.vendors.all()
+        )
+
+        now = datetime.utcnow()
+        records = {
+            record.key: record
+            for record in StorageUsage.query.filter(
+                StorageUsage.tenant_id == tenant.id
+            ).all()
+        }
+        for key, size in [(tenant.id, total), *sizes.items()]:
+            if not (record := records.pop(key, None)):
+                record = StorageUsage(
+                    key=key,
+                    tenant_id=tenant.id,
+                    project_id=None if key == tenant.id else key,
+                )
+                db.session.add(record)
+            record.bytes = size
+            record.date_reconciled = now
+            record.date_updated = now
+        for record in records.values():
+            db.session.delete(record)
+        db.session.commit()
+        return total
+
+
+class FileBlob(db.Model):
+    """
+    Content addressed storage for evidence and vendor files. Every distinct
+    file of a tenant is stored once under blobs/<sha256> and counted once in
+    the StorageUsage ledger. ProjectEvidence and VendorFile reference the
+    blob and ref_count tracks the references, collect() deletes the blobs
+    nobody references anymore
+
+    Usage:
+        blob = FileBlob.store(tenant, request.files["file"])
+        FileBlob.release(blob.id)
+    """
+
+    __tablename__ = "file_blobs"
+    __table_args__ = (db.UniqueConstraint("tenant_id", "provider", "sha256"),)
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    sha256 = db.Column(db.String(64), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    provider = db.Column(db.String, nullable=False)
+    path = db.Column(db.String, nullable=False)
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
+    date_unreferenced = db.Column(db.DateTime, index=True)
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def get_path(tenant, sha256, provider):
+        return os.path.join(
+            tenant.get_evidence_folder(provider=provider), "blobs", sha256[:2], sha256
+        )
+
+    @staticmethod
+    def find(tenant_id, sha256, provider, lock=False):
+        _query = FileBlob.query.filter(
+            FileBlob.tenant_id == tenant_id,
+            FileBlob.provider == provider,
+            FileBlob.sha256 == sha256,
+        )
+        if lock:
+            # collect() deletes under the same lock
+            _query = _query.with_for_update()
+        return _query.first()
+
+    @staticmethod
+    def reference(tenant_id, sha256, provider):
+        """
+        adds a reference to an existing blob. Returns None if there is no
+        blob with the content
+        """
+        if blob := FileBlob.find(tenant_id, sha256, provider, lock=True):
+            blob.ref_count += 1
+            blob.date_unreferenced = None
+            db.session.flush()
+        return blob
+
+    @staticmethod
+    def create(tenant, sha256, size, provider):
+        """
+        records a blob that was written to get_path(). A concurrent upload
+        of the same content wrote the same bytes, so it only adds a
+        reference to the winner
+        """
+        blob = FileBlob(
+            sha256=sha256,
+            size=size,
+            provider=provider,
+            path=FileBlob.get_path(tenant, sha256, provider),
+            ref_count=1,
+            tenant_id=tenant.id,
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            return FileBlob.reference(tenant.id, sha256, provider)
+        StorageUsage.add(tenant.id, size)
+        return blob
+
+    @staticmethod
+    def store(tenant, file_object, provider=None):
+        """
+        stores a FileStorage and returns its (referenced) blob. Identical
+        content is not uploaded again and does not count against the
+        storage_cap. Does not commit
+        """
+        provider = provider or current_app.config["STORAGE_METHOD"]
+        if provider not in current_app.config["STORAGE_PROVIDERS"]:
+            abort(500, f"Invalid storage provider: {str(provider)}")
+
+        sha256, size = FileStorageHandler.hash_stream(file_object.stream)
+        if blob := FileBlob.reference(tenant.id, sha256, provider):
+            return blob
+
+        if not tenant.can_save_file_in_folder(provider=provider, size=size):
+            abort(400, "Tenant has exceeded storage limits")
+        path = FileBlob.get_path(tenant, sha256, provider)
+        if provider == "local":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not FileStorageHandler(provider=provider).upload_file(
+            file_object, abs_path=path
+        ):
+            abort(500, f"Unable to upload {file_object.filename} to {provider}")
+        return FileBlob.create(tenant, sha256, size, provider)
+
+    @staticmethod
+    def adopt(tenant, path, provider, sha256, size):
+        """
+        turns a file that was uploaded to path (see UploadSession) into a
+        blob. sha256 and size were verified by the caller, the file is moved
+        to its content address or deleted if the tenant already has it
+        """
+        handler = FileStorageHandler(provider=provider)
+        if blob := FileBlob.reference(tenant.id, sha256, provider):
+            handler.delete_file(path)
+            return blob
+        handler.move_file(path, FileBlob.get_path(tenant, sha256, provider))
+        return FileBlob.create(tenant, sha256, size, provider)
+
+    @staticmethod
+    def release(blob_id):
+        """
+        drops a reference, the blob is deleted by collect()
+        """
+        FileBlob.query.filter(FileBlob.id == blob_id).update(
+            {
+                FileBlob.ref_count: FileBlob.ref_count - 1,
+                FileBlob.date_unreferenced: case(
+                    [(FileBlob.ref_count <= 1, datetime.utcnow())], else_=None
+                ),
+            },
+            synchronize_session=False,
+        )
+        return True
+
+    @staticmethod
+    def recount():
+        """
+        recomputes ref_count from the evidence and vendor files, e.g. after
+        a project was deleted with its evidence
+        """
+        references = (
+            select([func.count(ProjectEvidence.id)])
+            .where(ProjectEvidence.blob_id == FileBlob.id)
+            .as_scalar()
+            + select([func.count(VendorFile.id)])
+            .where(VendorFile.blob_id == FileBlob.id)
+            .as_scalar()
+        )
+        FileBlob.query.filter(FileBlob.ref_count != references).update(
+            {
+                FileBlob.ref_count: references,
+                FileBlob.date_unreferenced: case(
+                    [(references == 0, datetime.utcnow())], else_=None
+                ),
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+
+    @staticmethod
+    def collect(grace_hours=None, limit=1000):
+        """
+        deletes the blobs (and their files) that have been unreferenced for
+        longer than grace_hours. Returns the number of deleted blobs
+        """
+        FileBlob.recount()
+        if grace_hours is None:
+            grace_hours = current_app.config.get("BLOB_GC_GRACE_HOURS", 24)
+        cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+        ids = [
+            blob.id
+            for blob in FileBlob.query.with_entities(FileBlob.id)
+            .filter(FileBlob.ref_count <= 0, FileBlob.date_unreferenced <= cutoff)
+            .limit(limit)
+            .all()
+        ]
+        deleted = 0
+        for blob_id in ids:
+            # skip it if store() referenced it again in the meantime
+            blob = (
+                FileBlob.query.filter(FileBlob.id == blob_id, FileBlob.ref_count <= 0)
+                .with_for_update()
+                .first()
+            )
+            if not blob:
+                db.session.rollback()
+                continue
+            try:
+                FileStorageHandler(provider=blob.provider).delete_file(blob.path)
+            except Exception as e:
+                logging.warning(f"Unable to delete blob {blob.path}: {e}")
+            StorageUsage.add(blob.tenant_id, -blob.size)
+            db.session.delete(blob)
+            db.session.commit()
+            deleted += 1
+        return deleted
+
+
+class UploadSession(db.Model):
+    """
+    Two phase upload of evidence and vendor files. create() reserves the
+    name and the storage path and returns a presigned (S3) or resumable
+    (GCS) url, the client uploads straight to the bucket and finalize()
+    verifies the size and checksums, moves the file into the FileBlob store
+    and records the ProjectEvidence or VendorFile. Local storage receives
+    the file in chunks (write_chunk)
+
+    The client declares the sha256 of the file, so finalize() only reads
+    the metadata of the bucket: S3 verifies the sha256 of the PUT, GCS has
+    no sha256 and verifies the declared md5 instead. Local files are hashed
+    once by finalize()
+    """
+
+    __tablename__ = "upload_sessions"
+    VALID_TARGETS = ["evidence", "vendor_file"]
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    target = db.Column(db.String, nullable=False)
+    target_id = db.Column(db.String, nullable=False)
+    record_id = db.Column(db.String)
+    name = db.Column(db.String, nullable=False)
+    description = db.Column(db.String)
+    file_name = db.Column(db.String, nullable=False)
+    content_type = db.Column(db.String)
+    provider = db.Column(db.String, nullable=False)
+    path = db.Column(db.String, nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    checksum = db.Column(db.String)
+    sha256 = db.Column(db.String(64))
+    meta = db.Column(db.JSON(), default={})
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
+    owner_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=False)
+    date_expires = db.Column(db.DateTime, nullable=False, index=True)
+    date_added = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def as_dict(self, upload=None):
+        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
+        if upload:
+            data["upload"] = upload
+        return data
+
+    @validates("target")
+    def _validate_target(self, key, value):
+        if value not in self.VALID_TARGETS:
+            abort(422, f"Invalid upload target: {value}")
+        return value
+
+    @staticmethod
+    def create(
+        target,
+        parent,
+        name,
+        file_name,
+        size,
+        owner_id,
+        checksum=None,
+        sha256=None,
+        content_type=None,
+        description=None,
+        meta={},
+        provider=None,
+    ):
+        """
+        Reserves an upload for a project (evidence) or vendor (vendor_file)
+
+        Args:
+            target: evidence or vendor_file
+            parent: Project or Vendor the file belongs to
+            name: name of the evidence or vendor file
+            file_name: name of the uploaded file
+            size: size of the file in bytes
+            owner_id: user id of the uploader
+            checksum: hex md5 of the file, verified on finalize (required
+                for GCS)
+            sha256: hex sha256 of the file (required for S3 and GCS)
+            meta: extra ProjectEvidence fields (content, group)
+        """
+        provider = provider or current_app.config["STORAGE_METHOD"]
+        if provider not in current_app.config["STORAGE_PROVIDERS"]:
+            abort(422, f"Provider not supported:{provider}")
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            abort(422, "File size is required")
+        if checksum and not re.fullmatch(r"[0-9a-fA-F]{32}", checksum):
+            abort(422, "Checksum must be the hex md5 of the file")
+        if sha256 and not re.fullmatch(r"[0-9a-fA-F]{64}", sha256):
+            abort(422, "sha256 must be the hex sha256 of the file")
+        if provider != "local" and not sha256:
+            abort(422, f"sha256 of the file is required for {provider}")
+        if provider == "gcs" and not checksum:
+            abort(422, "Checksum is required for gcs")
+        file_name = secure_filename(file_name or "").lower()
+        if not name or not file_name:
+            abort(422, "Name and file name are required")
+
+        tenant = parent.tenant
+        if not tenant.can_save_file_in_folder(provider=provider, size=size):
+            abort(400, "Tenant has exceeded storage limits")
+
+        record_id = str(shortuuid.ShortUUID().random(length=8)).lower()
+        if target == "evidence":
+            if parent.evidence.filter(ProjectEvidence.name == name).first():
+                abort(422, f"Evidence already exists with name:{name}")
+            folder = parent.get_evidence_folder(provider=provider)
+            path = os.path.join(folder, f"{record_id}_{file_name}")
+        elif target == "vendor_file":
+            name = name.lower()
+            if parent.files.filter(func.lower(VendorFile.name) == name).first():
+                abort(422, f"File already exists with the name: {name}")
+            folder = parent.get_evidence_folder(provider)
+            path = os.path.join(folder, f"{record_id}_{name}")
+        else:
+            abort(422, f"Invalid upload target: {target}")
+
+        upload = UploadSession(
+            target=target,
+            target_id=parent.id,
+            record_id=record_id,
+            name=name,
+            description=description,
+            file_name=file_name,
+            content_type=content_type,
+            provider=provider,
+            path=path.lstrip(os.sep) if provider != "local" else path,
+            size=size,
+            checksum=checksum.lower() if checksum else None,
+            sha256=sha256.lower() if sha256 else None,
+            meta=meta,
+            tenant_id=tenant.id,
+            owner_id=owner_id,
+            date_expires=datetime.utcnow()
+            + timedelta(seconds=current_app.config.get("UPLOAD_URL_EXPIRES", 3600)),
+        )
+        db.session.add(upload)
+        db.session.commit()
+        return upload
+
+    def get_handler(self):
+        return FileStorageHandler(provider=self.provider)
+
+    def get_parent(self):
+        if self.target == "evidence":
+            return Project.query.get(self.target_id)
+        return Vendor.query.get(self.target_id)
+
+    def is_expired(self):
+        return datetime.utcnow() > self.date_expires
+
+    def get_upload(self, origin=None):
+        """
+        returns the {"method", "url", "headers"} of the direct upload.
+        Local storage points at the chunk endpoint
+        """
+        expires = int((self.date_expires - datetime.utcnow()).total_seconds())
+        upload = self.get_handler().create_upload(
+            self.path,
+            self.size,
+            checksum=self.checksum,
+            sha256=self.sha256,
+            content_type=self.content_type,
+            origin=origin,
+            expires=max(expires, 1),
+        )
+        if not upload["url"]:
+            upload["url"] = url_for("api.write_chunk_for_upload", id=self.id)
+            upload["chunked"] = True
+        return upload
+
+    def write_chunk(self, stream, offset=0):
+        if self.provider != "local":
+            abort(422, f"Chunked uploads are not supported for {self.provider}")
+        if self.is_expired():
+            abort(410, "Upload has expired")
+        try:
+            received = self.get_handler().write_chunk(self.path, stream, offset=offset)
+        except ValueError as e:
+            abort(409, str(e))
+        if received > self.size:
+            self.discard()
+            abort(422, "Upload is larger than the declared size")
+        return received
+
+    def discard(self):
+        """
+        deletes the uploaded file (if any) and the session
+        """
+        try:
+            self.get_handler().delete_file(self.path)
+        except Exception as e:
+            logging.warning(f"Unable to delete upload {self.path}: {e}")
+        db.session.delete(self)
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def sweep(grace_hours=1, limit=1000):
+        """
+        discards the sessions that expired more than grace_hours ago
+        without being finalized and deletes what was already uploaded for
+        them. The grace lets a finalize() that started before the expiry
+        finish. Returns the number of discarded sessions
+        """
+        cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+        ids = [
+            upload.id
+            for upload in UploadSession.query.with_entities(UploadSession.id)
+            .filter(UploadSession.date_expires < cutoff)
+            .limit(limit)
+            .all()
+        ]
+        discarded = 0
+        for upload_id in ids:
+            # skip it if a concurrent sweep holds it
+            upload = (
+                UploadSession.query.filter(UploadSession.id == upload_id)
+                .with_for_update(skip_locked=True)
+                .first()
+            )
+            if not upload:
+                db.session.rollback()
+                continue
+            upload.discard()
+            discarded += 1
+        return discarded
+
+    def finalize(self):
+        """
+        verifies the uploaded file and records the ProjectEvidence or
+        VendorFile. The session is locked, so a concurrent finalize() of
+        the same upload waits and then gets a 409
+        """
+        if not (
+            UploadSession.query.filter(UploadSession.id == self.id)
+            .with_for_update()
+            .populate_existing()
+            .first()
+        ):
+            abort(409, "Upload was already finalized or discarded")
+        if self.is_expired():
+            self.discard()
+            abort(410, "Upload has expired")
+        try:
+            info = self.get_handler().get_upload_info(self.path)
+        except FileDoesNotExist:
+            abort(409, "The file has not been uploaded")
+        if info["size"] != self.size:
+            self.discard()
+            abort(422, f"Size mismatch. Expected:{self.size}, got:{info['size']}")
+        if self.checksum and info["md5"] and info["md5"] != self.checksum:
+            self.discard()
+            abort(422, "Checksum mismatch")
+        sha256 = info["sha256"]
+        if self.provider == "gcs":
+            # GCS has no sha256, the md5 it computed vouches for the upload
+            sha256 = self.sha256 if info["md5"] else None
+        if not sha256 or (self.sha256 and sha256 != self.sha256):
+            self.discard()
+            abort(422, "Checksum mismatch")
+
+        parent = self.get_parent()
+        if not parent:
+            self.discard()
+            abort(404, "Upload target not found")
+        try:
+            blob = FileBlob.adopt(
+                parent.tenant, self.path, self.provider, sha256, info["size"]
+            )
+        except (FileDoesNotExist, FileNotFoundError):
+            abort(409, "The file has not been uploaded")
+        if self.target == "evidence":
+            # unset fields keep their column defaults
+            fields = {
+                "description": self.description,
+                "content": (self.meta or {}).get("content"),
+                "group": (self.meta or {}).get("group"),
+            }
+            record = ProjectEvidence(
+                id=self.record_id,
+                name=self.name,
+                file_name=self.file_name,
+                file_provider=self.provider,
+                owner_id=self.owner_id,
+                tenant_id=self.tenant_id,
+                **{key: value for key, value in fields.items() if value is not None},
+            )
+            parent.evidence.append(record)
+            record.set_blob(blob)
+        else:
+            record = VendorFile(
+                id=self.record_id,
+                name=self.name,
+                description=self.description,
+                provider=self.provider,
+                owner_id=self.owner_id,
+                blob_id=blob.id,
+            )
+            parent.files.append(record)
+        db.session.delete(self)
+        db.session.commit()
+        return record
+
+
 class ProjectEvidence(db.Model, QueryMixin):
     __tablename__ = "project_evidence"
     __table_args__ = (db.UniqueConstraint("name", "project_id"),)
@@ -1403,11 +2147,12 @@ class ProjectEvidence(db.Model, QueryMixin):
     )
     name = db.Column(db.String(), nullable=False)
     description = db.Column(db.String(), default="Empty description")
-    content = db.Column(db.String())
+    content = deferred(db.Column(db.String()))
     group = db.Column(db.String(), default="default")
     collected_on = db.Column(db.DateTime, default=datetime.utcnow)
     file_name = db.Column(db.String())
     file_provider = db.Column(db.String(), default="local")
+    blob_id = db.Column(db.String, db.ForeignKey("file_blobs.id"), nullable=True)
     owner_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=True)
     project_id = db.Column(db.String, db.ForeignKey("projects.id"))
     tenant_id = db.Column(db.String, db.ForeignKey("tenants.id"))
@@ -1415,14 +2160,7 @@ class ProjectEvidence(db.Model, QueryMixin):
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
     def as_dict(self):
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        data["control_count"] = self.control_count()
-        data["controls"] = [
-            {"id": control.id, "name": control.subcontrol.name}
-            for control in self.get_controls()
-        ]
-        data["has_file"] = self.has_file()
-        return data
+        return EvidenceIndex().serialize([self])[0]
 
     def has_file(self):
         if self.file_name:
@@ -1434,7 +2172,10 @@ class ProjectEvidence(db.Model, QueryMixin):
             self.delete_file()
         except:
             pass
+        control_ids = [control.control_id for control in self.get_associations()]
         db.session.delete(self)
+        db.session.flush()
+        ControlProgress.refresh_for_subcontrols(control_ids)
         db.session.commit()
         return True
 
@@ -1489,16 +2230,21 @@ class ProjectEvidence(db.Model, QueryMixin):
         return self
 
     def remove_controls(self, control_ids: List[int] = []):
-        if control_ids:
-            EvidenceAssociation.query.filter(
-                EvidenceAssociation.evidence_id == self.id
-            ).filter(EvidenceAssociation.control_id.in_(control_ids)).delete()
-        else:
-            EvidenceAssociation.query.filter(
-                EvidenceAssociation.evidence_id == self.id
-            ).delete()
+        if not control_ids:
+            control_ids = [control.control_id for control in self.get_associations()]
+        EvidenceAssociation.query.filter(
+            EvidenceAssociation.evidence_id == self.id
+        ).filter(EvidenceAssociation.control_id.in_(control_ids)).delete(
+            synchronize_session=False
+        )
+        ControlProgress.refresh_for_subcontrols(control_ids)
         db.session.commit()
 
+    def get_associations(self):
+        return EvidenceAssociation.query.filter(
+            EvidenceAssociation.evidence_id == self.id
+        ).all()
+
     def associate_with_controls(self, control_ids: List[int]):
         """
         Associate evidence with a list of control_ids. This will patch the existing association.
@@ -1538,15 +2284,40 @@ class ProjectEvidence(db.Model, QueryMixin):
         if self.file_provider != storage_method:
             abort(500, f"File storage backend: {self.file_provider} is not enabled.")
 
-        path = os.path.join(
+        file_handler = FileStorageHandler(
+            provider=self.file_provider,
+        )
+        return file_handler.get_file(path=self.get_file_path(), as_blob=as_blob)
+
+    def get_file_path(self):
+        if self.blob_id:
+            return FileBlob.query.get(self.blob_id).path
+        return os.path.join(
             self.project.get_evidence_folder(provider=self.file_provider),
             self.file_name,
         )
 
+    def send_file(self):
+        """
+        streaming (and Range aware) download response for the file. Memory
+        use does not depend on the file size
+        """
+        if not self.file_name:
+            abort(404, "Evidence does not contain a file")
+
+        storage_method = current_app.config["STORAGE_METHOD"]
+        if self.file_provider != storage_method:
+            abort(500, f"File storage backend: {self.file_provider} is not enabled.")
+
         file_handler = FileStorageHandler(
             provider=self.file_provider,
         )
-        return file_handler.get_file(path=path, as_blob=as_blob)
+        try:
+            return file_handler.send_file(
+                self.get_file_path(), download_name=self.file_name
+            )
+        except FileDoesNotExist:
+            abort(404, "File does not exist")
 
     def remove_file(self):
         """
@@ -1555,14 +2326,59 @@ class ProjectEvidence(db.Model, QueryMixin):
         """
         if not self.file_name:
             abort(500, "Evidence does not contain a file")
+        self.set_blob(None)
         self.file_name = None
         db.session.commit()
         return True
 
+    def set_blob(self, blob):
+        """
+        points the evidence to blob (or None) and releases the previous
+        blob. The project ledger in StorageUsage counts every blob once
+        per project, the tenant ledger is kept by FileBlob
+        """
+        if (blob.id if blob else None) == self.blob_id:
+            if blob:
+                # store() referenced the content the evidence already has
+                FileBlob.release(blob.id)
+            return
+        tenant_id = self.project.tenant_id
+        if self.blob_id:
+            previous = FileBlob.query.get(self.blob_id)
+            FileBlob.release(self.blob_id)
+            if previous and not self.shares_blob(previous.id):
+                StorageUsage.add(
+                    tenant_id, -previous.size, project_id=self.project.id, tenant=False
+                )
+        if blob and not self.shares_blob(blob.id):
+            StorageUsage.add(
+                tenant_id, blob.size, project_id=self.project.id, tenant=False
+            )
+        self.blob_id = blob.id if blob else None
+
+    def shares_blob(self, blob_id):
+        """
+        is the blob used by other evidence of the project
+        """
+        return (
+            db.session.query(ProjectEvidence.id)
+            .filter(
+                ProjectEvidence.project_id == self.project.id,
+                ProjectEvidence.blob_id == blob_id,
+                ProjectEvidence.id != self.id,
+            )
+            .first()
+            is not None
+        )
+
     def delete_file(self, safe_delete=True):
         if not self.file_name:
             abort(500, "Evidence does not contain a file")
 
+        # blobs are shared, FileBlob.collect deletes them once unreferenced
+        if self.blob_id:
+            return self.remove_file()
+
         if safe_delete:
             file_assoc = ProjectEvidence.query.filter(
                 ProjectEvidence.file_name == self.file_name
@@ -1577,13 +2393,16 @@ class ProjectEvidence(db.Model, QueryMixin):
         if self.file_provider != storage_method:
             abort(500, f"File storage backend: {self.file_provider} is not enabled.")
 
-        path = os.path.join(
-            self.project.tenant.get_evidence_folder(self.file_provider), self.file_name
-        )
+        path = self.get_file_path()
         file_handler = FileStorageHandler(
             provider=self.file_provider,
         )
+        try:
+            size = file_handler.get_file_size(path)
+        except Exception:
+            size = 0
         file_handler.delete_file(path=path)
+        StorageUsage.add(self.project.tenant_id, -size, project_id=self.project_id)
         self.remove_file()
         return True
 
@@ -1605,55 +2424,21 @@ class ProjectEvidence(db.Model, QueryMixin):
 
         file_name = secure_filename(file_name).lower()
 
+        # identical content is stored once per tenant, see FileBlob
+        blob = FileBlob.store(self.project.tenant, file_object, provider=provider)
+        self.set_blob(blob)
         self.file_name = file_name
         self.file_provider = provider
-
-        if not self.project.tenant.can_save_file_in_folder(provider=provider):
-            abort(400, "Tenant has exceeded storage limits")
-
-        file_handler = FileStorageHandler(
-            provider=provider,
-        )
-        # TODO - create does_file_exist method in FileStorageHandler class
-        try:
-            does_file_exist = file_handler.get_file(
-                path=os.path.join(
-                    self.project.get_evidence_folder(provider=self.file_provider),
-                    file_name,
-                )
-            )
-        except FileDoesNotExist:
-            does_file_exist = False
-
-        if does_file_exist:
-            abort(
-                422,
-                f"File already exists with the name:{file_name} in {provider} storage.",
-            )
-
-        if provider == "local":
-            # TODO - push logic to FileStorageHandler
-            self.project.create_evidence_folder()
-
-        upload_params = {
-            "file": file_object,
-            "file_name": file_name,
-            "folder": self.project.tenant.get_evidence_folder(
-                project_id=self.project_id, provider=provider
-            ),
-        }
-        # TODO - fix the response, upload_file does not return false
-        result = file_handler.upload_file(**upload_params)
-        if result is False:
-            self.file_name = None
-            self.file_provider = None
-            db.session.commit()
-            abort(500, f"Unable to upload {file_name} to {provider}")
+        db.session.commit()
         return True
 
 
 class EvidenceAssociation(db.Model):
     __tablename__ = "evidence_association"
+    __table_args__ = (
+        db.Index("ix_evidence_association_evidence", "evidence_id"),
+        db.Index("ix_evidence_association_control", "control_id"),
+    )
     id = db.Column(
         db.String,
         primary_key=True,
@@ -1690,6 +2475,8 @@ class EvidenceAssociation(db.Model):
                     control_id=control_id, evidence_id=evidence_id
                 )
                 db.session.add(evidence)
+        db.session.flush()
+        ControlProgress.refresh_for_subcontrols(control_ids)
         if commit:
             db.session.commit()
         return True
@@ -1703,6 +2490,8 @@ class EvidenceAssociation(db.Model):
             assoc = EvidenceAssociation.exists(control_id, evidence_id)
             if assoc:
                 db.session.delete(assoc)
+        db.session.flush()
+        ControlProgress.refresh_for_subcontrols(control_ids)
         if commit:
             db.session.commit()
         return True
@@ -1726,6 +2515,16 @@ class PolicyAssociation(db.Model):
 
 class Framework(db.Model):
     __tablename__ = "frameworks"
+    __table_args__ = (
+        # one catalog framework per name, across processes
+        db.Index(
+            "uq_frameworks_catalog_name",
+            "name",
+            unique=True,
+            postgresql_where=db.text("tenant_id IS NULL"),
+            sqlite_where=db.text("tenant_id IS NULL"),
+        ),
+    )
     id = db.Column(
         db.String,
         primary_key=True,
@@ -1738,6 +2537,8 @@ class Framework(db.Model):
     guidance = db.Column(db.String)
     """framework specific features"""
     feature_evidence = db.Column(db.Boolean(), default=False)
+    """the shared catalog framework (tenant_id is NULL) the controls are read from"""
+    catalog_id = db.Column(db.String, db.ForeignKey("frameworks.id"), nullable=True)
 
     controls = db.relationship("Control", backref="framework", lazy="dynamic")
     projects = db.relationship("Project", backref="framework", lazy="dynamic")
@@ -1747,9 +2548,33 @@ class Framework(db.Model):
 
     def as_dict(self):
         data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        data["controls"] = self.controls.count()
+        data["controls"] = self.get_controls(as_query=True).count()
         return data
 
+    def get_controls(self, as_query=False):
+        """
+        returns the controls of the framework. When the framework uses the
+        shared catalog, the catalog controls are included unless the tenant
+        has customized them (see Tenant.customize_control)
+        """
+        _query = Control.query.filter(Control.framework_id == self.id)
+        if self.catalog_id:
+            customized = db.session.query(Control.source_id).filter(
+                Control.framework_id == self.id, Control.source_id != None
+            )
+            _query = Control.query.filter(
+                or_(
+                    Control.framework_id == self.id,
+                    and_(
+                        Control.framework_id == self.catalog_id,
+                        ~Control.id.in_(customized),
+                    ),
+                )
+            )
+        if as_query:
+            return _query
+        return _query.all()
+
     @staticmethod
     def create(name, tenant):
         data = {
@@ -1794,7 +2619,7 @@ class Framework(db.Model):
         return getattr(self, name)
 
     def has_controls(self):
-        if self.controls.count():
+        if self.catalog_id or self.controls.count():
             return True
         return False
 
@@ -1813,8 +2638,9 @@ class Policy(db.Model):
     name = db.Column(db.String(), nullable=False)
     ref_code = db.Column(db.String())
     description = db.Column(db.String())
-    content = db.Column(db.String())
-    template = db.Column(db.String())
+    # large text is only loaded on access (or with undefer_group("body"))
+    content = deferred(db.Column(db.String()), group="body")
+    template = deferred(db.Column(db.String()), group="body")
     tenant_id = db.Column(db.String, db.ForeignKey("tenants.id"), nullable=True)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
     date_updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
@@ -1906,6 +2732,8 @@ class Control(db.Model):
         "SubControl", backref="control", lazy="dynamic", cascade="all, delete"
     )
     framework_id = db.Column(db.String, db.ForeignKey("frameworks.id"), nullable=False)
+    """the catalog control this control was customized from"""
+    source_id = db.Column(db.String, db.ForeignKey("controls.id"), nullable=True)
     project_controls = db.relationship(
         "ProjectControl", backref="control", lazy="dynamic", cascade="all, delete"
     )
@@ -1978,58 +2806,13 @@ class Control(db.Model):
         else:
             abort(400, "Framework is required")
 
-        # create controls and subcontrols
+        # create controls and subcontrols. For loading entire framework
+        # files, see app.utils.framework_import.FrameworkImporter
         for control in data.get("controls", []):
-            c = Control(
-                name=control.get("name"),
-                description=control.get("description"),
-                ref_code=control.get("ref_code"),
-                abs_ref_code=f"{framework.lower()}__{control.get('ref_code')}",
-                system_level=control.get("system_level"),
-                category=control.get("category"),
-                subcategory=control.get("subcategory"),
-                references=control.get("references"),
-                level=int(control.get("level", 1)),
-                guidance=control.get("guidance"),
-                mapping=control.get("mapping"),
-                vendor_recommendations=control.get("vendor_recommendations"),
-                dti=control.get("dti"),
-                dtc=control.get("dtc"),
-                meta=control.get("meta", {}),
-                tenant_id=tenant_id,
-            )
-            """
-            if there are no subcontrols for the control, we are going to add the
-            top-level control itself as the first subcontrol
-            """
-            subcontrols = control.get("subcontrols", [])
-            if not subcontrols:
-                subcontrols = [
-                    {
-                        "name": c.name,
-                        "description": c.description,
-                        "ref_code": c.ref_code,
-                        "mitigation": control.get(
-                            "mitigation", "The mitigation has not been documented"
-                        ),
-                        "guidance": control.get("guidance"),
-                        "tasks": control.get("tasks"),
-                    }
-                ]
+            row, subcontrols = build_control(control, framework, tenant_id)
+            c = Control(**row)
             for sub in subcontrols:
-                fa = SubControl(
-                    name=sub.get("name"),
-                    description=sub.get(
-                        "description", "The description has not been documented"
-                    ),
-                    ref_code=sub.get("ref_code", c.ref_code),
-                    mitigation=sub.get("mitigation"),
-                    guidance=sub.get("guidance"),
-                    implementation_group=sub.get("implementation_group"),
-                    meta=sub.get("meta", {}),
-                    tasks=sub.get("tasks", []),
-                )
-                c.subcontrols.append(fa)
+                c.subcontrols.append(SubControl(**sub))
             f.controls.append(c)
             created_controls.append(c)
         db.session.commit()
@@ -2095,6 +2878,11 @@ class ProjectMember(db.Model):
 
 class CompletionHistory(db.Model):
     __tablename__ = "completion_history"
+    __table_args__ = (
+        db.Index("ix_completion_history_project_date", "project_id", "date_added"),
+    )
+    # days that can be requested from CompletionHistory.get_range
+    RANGES = (30, 90, 365)
     id = db.Column(
         db.String,
         primary_key=True,
@@ -2105,6 +2893,472 @@ class CompletionHistory(db.Model):
     project_id = db.Column(db.String, db.ForeignKey("projects.id"), nullable=False)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @staticmethod
+    def get_range(project_id, days=30):
+        """
+        returns one value per day for the last N days (ending today). The
+        days are generated in SQL and every day carries the latest snapshot
+        taken until the end of that day forward, 0 before the first one
+        """
+        if days not in CompletionHistory.RANGES:
+            abort(
+                400,
+                f"Days must be one of: {', '.join(map(str, CompletionHistory.RANGES))}",
+            )
+        table = CompletionHistory.__table__
+        if (
+            not db.session.query(table.c.id)
+            .filter(table.c.project_id == project_id)
+            .first()
+        ):
+            return []
+        end = arrow.utcnow().floor("day").datetime.replace(tzinfo=None)
+        start = end - timedelta(days=days - 1)
+        series = select(
+            [
+                func.generate_series(
+                    start, end, timedelta(days=1), type_=db.DateTime
+                ).label("day")
+            ]
+        ).alias("days")
+        value = (
+            select([table.c.value])
+            .where(table.c.project_id == project_id)
+            .where(table.c.date_added < series.c.day + timedelta(days=1))
+            .order_by(table.c.date_added.desc(), table.c.id.desc())
+            .limit(1)
+            .as_scalar()
+        )
+        rows = db.session.execute(
+            select([series.c.day, func.coalesce(value, 0).label("value")]).order_by(
+                series.c.day
+            )
+        )
+        return [
+            {"date": row.day.strftime("%m/%d/%Y"), "value": row.value} for row in rows
+        ]
+
+    @staticmethod
+    def compact(after_days=None):
+        """
+        keeps the latest snapshot per project per day for the days that
+        ended more than after_days ago and deletes the rest
+        """
+        if after_days is None:
+            after_days = current_app.config.get("COMPLETION_HISTORY_COMPACT_DAYS", 90)
+        cutoff = (
+            arrow.utcnow()
+            .floor("day")
+            .shift(days=-after_days)
+            .datetime.replace(tzinfo=None)
+        )
+        table = CompletionHistory.__table__
+        ranked = (
+            select(
+                [
+                    table.c.id,
+                    func.row_number()
+                    .over(
+                        partition_by=(
+                            table.c.project_id,
+                            func.date_trunc("day", table.c.date_added),
+                        ),
+                        order_by=(table.c.date_added.desc(), table.c.id.desc()),
+                    )
+                    .label("rank"),
+                ]
+            )
+            .where(table.c.date_added < cutoff)
+            .alias("ranked")
+        )
+        result = db.session.execute(
+            table.delete().where(
+                table.c.id.in_(select([ranked.c.id]).where(ranked.c.rank > 1))
+            )
+        )
+        db.session.commit()
+        return result.rowcount
+
+
+class ControlProgress(db.Model):
+    """
+    Rollup of the applicable subcontrol counters for a ProjectControl.
+    Kept current by ControlProgress.refresh whenever implementation,
+    applicability or evidence of a subcontrol changes
+    """
+
+    __tablename__ = "control_progress"
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    subcontrols = db.Column(db.Integer, default=0)
+    applicable = db.Column(db.Integer, default=0)
+    implemented = db.Column(db.Integer, default=0)
+    evidence = db.Column(db.Integer, default=0)
+    complete = db.Column(db.Integer, default=0)
+    completed = db.Column(db.Float, default=0)
+    project_control_id = db.Column(
+        db.String,
+        db.ForeignKey("project_controls.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    project_id = db.Column(
+        db.String, db.ForeignKey("projects.id", ondelete="CASCADE"), index=True
+    )
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def is_applicable(self):
+        return self.applicable > 0
+
+    def is_complete(self):
+        return self.complete == self.applicable
+
+    def completed_progress(self):
+        if not self.applicable:
+            return 0
+        return round(self.completed / self.applicable, 0)
+
+    def implemented_progress(self):
+        if not self.applicable:
+            return 0
+        return round(self.implemented / self.applicable, 0)
+
+    def evidence_progress(self):
+        if not self.evidence:
+            return 0
+        return round((self.evidence / self.applicable) * 100, 0)
+
+    @staticmethod
+    def summarize(*criteria):
+        """
+        aggregates the applicable subcontrols per ProjectControl, matching
+        the math in SubControlMixin.get_completion_progress
+        """
+        evidence = (
+            db.session.query(EvidenceAssociation.control_id)
+            .join(
+                ProjectSubControl,
+                ProjectSubControl.id == EvidenceAssociation.control_id,
+            )
+            .filter(*criteria)
+            .distinct()
+            .subquery()
+        )
+        applicable = ProjectSubControl.is_applicable == True
+        has_evidence = and_(applicable, evidence.c.control_id != None)
+        implemented = func.coalesce(ProjectSubControl.implemented, 0)
+        return (
+            db.session.query(
+                ProjectSubControl.project_control_id,
+                ProjectSubControl.project_id,
+                func.count(ProjectSubControl.id),
+                func.sum(case([(applicable, 1)], else_=0)),
+                func.sum(case([(applicable, implemented)], else_=0)),
+                func.sum(case([(has_evidence, 1)], else_=0)),
+                func.sum(case([(and_(has_evidence, implemented == 100), 1)], else_=0)),
+                func.sum(
+                    case(
+                        [
+                            (and_(has_evidence, implemented > 25), implemented),
+                            (has_evidence, 25),
+                            (applicable, implemented * 0.75),
+                        ],
+                        else_=0,
+                    )
+                ),
+            )
+            .outerjoin(evidence, evidence.c.control_id == ProjectSubControl.id)
+            .filter(*criteria)
+            .group_by(
+                ProjectSubControl.project_control_id, ProjectSubControl.project_id
+            )
+            .all()
+        )
+
+    @staticmethod
+    def refresh(project_control_ids):
+        """
+        recomputes the rollup for the given ProjectControl ids and applies
+        the difference to the ProjectProgress of their projects. Does not
+        commit, the caller owns the transaction
+        """
+        if not isinstance(project_control_ids, (list, set, tuple)):
+            project_control_ids = [project_control_ids]
+        project_control_ids = set(filter(None, project_control_ids))
+        if not project_control_ids:
+            return True
+
+        # locks the controls (FOR NO KEY UPDATE, in id order) so concurrent
+        # refreshes of the same control do not subtract the same old record
+        project_ids = dict(
+            ProjectControl.query.with_entities(
+                ProjectControl.id, ProjectControl.project_id
+            )
+            .filter(ProjectControl.id.in_(project_control_ids))
+            .order_by(ProjectControl.id)
+            .with_for_update(key_share=True)
+            .all()
+        )
+        existing = {
+            record.project_control_id: record
+            for record in ControlProgress.query.filter(
+                ControlProgress.project_control_id.in_(project_control_ids)
+            ).all()
+        }
+        summaries = {
+            row[0]: row
+            for row in ControlProgress.summarize(
+                ProjectSubControl.project_control_id.in_(project_control_ids)
+            )
+        }
+        projects = {}
+        for project_control_id, project_id in project_ids.items():
+            delta = projects.setdefault(project_id, ProgressDelta())
+            if record := existing.get(project_control_id):
+                delta.subtract(record)
+            else:
+                record = ControlProgress(
+                    project_control_id=project_control_id, project_id=project_id
+                )
+                db.session.add(record)
+            record.set_counters(summaries.get(project_control_id))
+            delta.add(record)
+
+        for project_id, delta in projects.items():
+            ProjectProgress.apply(project_id, delta)
+        return True
+
+    @staticmethod
+    def refresh_for_subcontrols(subcontrol_ids):
+        if not isinstance(subcontrol_ids, (list, set, tuple)):
+            subcontrol_ids = [subcontrol_ids]
+        if not subcontrol_ids:
+            return True
+        project_control_ids = [
+            record.project_control_id
+            for record in ProjectSubControl.query.with_entities(
+                ProjectSubControl.project_control_id
+            )
+            .filter(ProjectSubControl.id.in_(subcontrol_ids))
+            .distinct()
+            .all()
+        ]
+        return ControlProgress.refresh(project_control_ids)
+
+    @staticmethod
+    def remove(project_control_id):
+        """
+        removes the rollup of a ProjectControl that is being deleted
+        """
+        if record := ControlProgress.query.filter(
+            ControlProgress.project_control_id == project_control_id
+        ).first():
+            delta = ProgressDelta()
+            delta.subtract(record)
+            ProjectProgress.apply(record.project_id, delta)
+            db.session.delete(record)
+        return True
+
+    def set_counters(self, summary=None):
+        """
+        summary is a row returned by ControlProgress.summarize
+        """
+        if not summary:
+            summary = [None] * 8
+        self.subcontrols = int(summary[2] or 0)
+        self.applicable = int(summary[3] or 0)
+        self.implemented = int(summary[4] or 0)
+        self.evidence = int(summary[5] or 0)
+        self.complete = int(summary[6] or 0)
+        self.completed = float(summary[7] or 0)
+        self.date_updated = datetime.utcnow()
+
+
+class ProgressDelta:
+    """
+    accumulates the per control contributions to a ProjectProgress
+    """
+
+    FIELDS = ["controls", "applicable_controls", "completed", "implemented", "evidence"]
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, control_progress, sign=1):
+        self.controls += sign
+        self.applicable_controls += sign * int(control_progress.is_applicable())
+        self.completed += sign * control_progress.completed_progress()
+        self.implemented += sign * control_progress.implemented_progress()
+        self.evidence += sign * control_progress.evidence_progress()
+        return self
+
+    def subtract(self, control_progress):
+        return self.add(control_progress, sign=-1)
+
+
+class ProjectProgress(db.Model):
+    """
+    Rollup of the ControlProgress records of a project. The totals are
+    the sum of the per control progress so the project level numbers are
+    read in O(1)
+    """
+
+    __tablename__ = "project_progress"
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    controls = db.Column(db.Integer, default=0)
+    applicable_controls = db.Column(db.Integer, default=0)
+    completed = db.Column(db.Float, default=0)
+    implemented = db.Column(db.Float, default=0)
+    evidence = db.Column(db.Float, default=0)
+    project_id = db.Column(
+        db.String,
+        db.ForeignKey("projects.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def as_dict(self):
+        return {
+            "controls": self.controls,
+            "applicable_controls": self.applicable_controls,
+            "completion_progress": self.completion_progress(),
+            "implemented_progress": self.implemented_progress(),
+            "evidence_progress": self.evidence_progress(),
+        }
+
+    def completion_progress(self, default=100):
+        if not self.applicable_controls:
+            return default
+        return round(self.completed / self.applicable_controls, 0)
+
+    def implemented_progress(self):
+        if not self.controls:
+            return 0
+        return round(self.implemented / self.controls, 0)
+
+    def evidence_progress(self):
+        if not self.controls:
+            return 0
+        return round(self.evidence / self.controls, 0)
+
+    @staticmethod
+    def apply(project_id, delta):
+        """
+        increments the totals in SQL so concurrent updates do not
+        overwrite each other. Projects get their rollup when they are
+        created, older projects from manage.py reconcile_progress
+        """
+        values = {
+            getattr(ProjectProgress, field): getattr(ProjectProgress, field)
+            + getattr(delta, field)
+            for field in ProgressDelta.FIELDS
+        }
+        values[ProjectProgress.date_updated] = datetime.utcnow()
+        ProjectProgress.query.filter(ProjectProgress.project_id == project_id).update(
+            values, synchronize_session=False
+        )
+        # snapshot for the completion history, recorded after commit
+        CompletionRecorder.mark(db.session, project_id)
+        return True
+
+    @staticmethod
+    def find(project_id):
+        return ProjectProgress.query.filter(
+            ProjectProgress.project_id == project_id
+        ).first()
+
+    @staticmethod
+    def get(project_id, rebuild=False):
+        """
+        returns the rollup for the project. Without a stored rollup (see
+        manage.py reconcile_progress) an unsaved one is computed, so reads
+        never lock or write
+        """
+        if rebuild:
+            return ProjectProgress.rebuild(project_id)
+        if record := ProjectProgress.find(project_id):
+            return record
+        return ProjectProgress.compute(project_id)[0]
+
+    @staticmethod
+    def compute(project_id, project_control_ids=None):
+        """
+        returns an unsaved ProjectProgress and the unsaved ControlProgress
+        records of the project, computed with a single aggregate query
+        """
+        if project_control_ids is None:
+            project_control_ids = [
+                row.id
+                for row in ProjectControl.query.with_entities(ProjectControl.id)
+                .filter(ProjectControl.project_id == project_id)
+                .all()
+            ]
+        summaries = {
+            row[0]: row
+            for row in ControlProgress.summarize(
+                ProjectSubControl.project_id == project_id
+            )
+        }
+        delta = ProgressDelta()
+        controls = []
+        for project_control_id in project_control_ids:
+            control_progress = ControlProgress(
+                project_control_id=project_control_id, project_id=project_id
+            )
+            control_progress.set_counters(summaries.get(project_control_id))
+            controls.append(control_progress)
+            delta.add(control_progress)
+
+        record = ProjectProgress(project_id=project_id)
+        for field in ProgressDelta.FIELDS:
+            setattr(record, field, getattr(delta, field))
+        record.date_updated = datetime.utcnow()
+        return record, controls
+
+    @staticmethod
+    def rebuild(project_id):
+        """
+        recomputes and stores every ControlProgress of the project. Used when
+        a project is created and for reconciliation, never on reads. Does
+        not commit, the caller owns the transaction
+        """
+        # serializes with concurrent rebuilds and ControlProgress.refresh
+        Project.query.with_entities(Project.id).filter(
+            Project.id == project_id
+        ).with_for_update(key_share=True).first()
+        project_control_ids = [
+            row.id
+            for row in ProjectControl.query.with_entities(ProjectControl.id)
+            .filter(ProjectControl.project_id == project_id)
+            .order_by(ProjectControl.id)
+            .with_for_update(key_share=True)
+            .all()
+        ]
+        ControlProgress.query.filter(ControlProgress.project_id == project_id).delete(
+            synchronize_session=False
+        )
+        computed, controls = ProjectProgress.compute(project_id, project_control_ids)
+        db.session.add_all(controls)
+        if record := ProjectProgress.find(project_id):
+            for field in [*ProgressDelta.FIELDS, "date_updated"]:
+                setattr(record, field, getattr(computed, field))
+        else:
+            record = computed
+            db.session.add(record)
+        db.session.flush()
+        return record
+
 
 class Project(db.Model, DateMixin):
     __tablename__ = "projects"
@@ -2201,12 +3455,14 @@ class Project(db.Model, DateMixin):
             data["framework"] = self.framework.name
 
         if with_summary:
-            controls = self.controls.all()
-            data["completion_progress"] = self.completion_progress(controls=controls)
-            data["total_controls"] = len(controls)
+            progress = self.get_progress()
+            data["completion_progress"] = progress.completion_progress()
+            data["total_controls"] = progress.controls
             data["total_policies"] = self.policies.count()
             if with_controls:
-                data["controls"] = [control.as_dict() for control in controls]
+                data["controls"] = [
+                    control.as_dict() for control in self.controls.all()
+                ]
             data["status"] = "not started"
             if data["completion_progress"] > 0 and data["completion_progress"] < 100:
                 data["status"] = "in progress"
@@ -2214,58 +3470,17 @@ class Project(db.Model, DateMixin):
                 data["status"] = "complete"
 
             if not exclude_timely:
-                data["implemented_progress"] = self.implemented_progress(
-                    controls=controls
-                )
-                data["evidence_progress"] = self.evidence_progress(controls=controls)
+                data["implemented_progress"] = progress.implemented_progress()
+                data["evidence_progress"] = progress.evidence_progress()
                 data["review_summary"] = self.review_summary()
 
         return data
 
-    def generate_last_30_days(self):
-        data_list = self.completion_history.order_by(
-            CompletionHistory.date_added.desc()
-        ).all()
-        if not data_list:
-            return []
-
-        # Convert input data_list into a dictionary for easier lookup
-        data_by_date = {
-            arrow.get(item.date_added).date(): item.value for item in data_list
-        }
-
-        last_date = arrow.get(data_list[0].date_added).date()
-        start_date = arrow.get(last_date).shift(days=-29).date()
+    def get_completion_history(self, days=30):
+        return CompletionHistory.get_range(self.id, days=days)
 
-        # Initialize the result list
-        result = []
-        last_valid_value = 0  # Default value if no prior data exists
-
-        # Iterate from start_date to last_date
-        for single_date in arrow.Arrow.range(
-            "day", arrow.get(start_date), arrow.get(last_date)
-        ):
-            current_date = single_date.date()
-
-            if current_date in data_by_date:
-                # Use the value from the data_list if the date exists
-                last_valid_value = data_by_date[current_date]
-                result.append(
-                    {
-                        "date": current_date.strftime("%m/%d/%Y"),
-                        "value": last_valid_value,
-                    }
-                )
-            else:
-                # Copy the last valid value if available
-                result.append(
-                    {
-                        "date": current_date.strftime("%m/%d/%Y"),
-                        "value": last_valid_value,
-                    }
-                )
-
-        return result
+    def generate_last_30_days(self):
+        return self.get_completion_history(days=30)
 
     def add_custom_control(self, control):
         """
@@ -2413,6 +3628,7 @@ class Project(db.Model, DateMixin):
             )
         )
         db.session.commit()
+        AccessMap.clear()
         return True
 
     def remove_member(self, user):
@@ -2420,6 +3636,7 @@ class Project(db.Model, DateMixin):
             return True
         self.members.filter(ProjectMember.user_id == user.id).delete()
         db.session.commit()
+        AccessMap.clear()
         return True
 
     def has_member(self, user_or_email):
@@ -2443,77 +3660,31 @@ class Project(db.Model, DateMixin):
         if member := self.members.filter(ProjectMember.user_id == user_id).first():
             if access_level not in ProjectMember.VALID_ACCESS_LEVELS:
                 return False
-            member.access_level = access_level
-            db.session.commit()
-        return False
-
-    def get_applicable_control_count(self):
-        applicable_controls_count = (
-            db.session.query(func.count(distinct(ProjectControl.id)))
-            .join(
-                ProjectSubControl,
-                ProjectControl.id == ProjectSubControl.project_control_id,
-            )
-            .filter(
-                ProjectControl.project_id == self.id,
-                ProjectSubControl.is_applicable == True,
-            )
-            .group_by(ProjectControl.id)
-            .having(
-                func.count(ProjectSubControl.id)
-                == func.sum(
-                    case([(ProjectSubControl.is_applicable == True, 1)], else_=0)
-                )
-            )
-            .count()
-        )
-        return applicable_controls_count
+            member.access_level = access_level
+            db.session.commit()
+            AccessMap.clear()
+        return False
+
+    def get_applicable_control_count(self):
+        return self.get_progress().applicable_controls
+
+    def get_progress(self, rebuild=False):
+        """
+        returns the ProjectProgress rollup for the project
+        """
+        return ProjectProgress.get(self.id, rebuild=rebuild)
 
     def evidence_groupings(self):
-        data = {}
-        for sub in self.subcontrols():
-            for evidence in sub.evidence.all():
-                if evidence.id not in data:
-                    data[evidence.id] = {
-                        "id": evidence.id,
-                        "name": evidence.name,
-                        "count": 0,
-                    }
-                else:
-                    data[evidence.id]["count"] += 1
-        return data
+        return EvidenceIndex(self).get_groupings()
 
-    def completion_progress(self, controls=None, default=100):
-        total = 0
-        total_applicable_controls = self.get_applicable_control_count()
-        if not total_applicable_controls:
-            return default
-        if controls is None:
-            controls = self.controls.all()
-        for control in controls:
-            total += control.completed_progress()
-        return round((total / total_applicable_controls), 0)
-
-    def evidence_progress(self, controls=None):
-        total = 0
-        if controls is None:
-            controls = self.controls.all()
-        if not controls:
-            return total
-        for control in controls:
-            total += control.progress("with_evidence")
-        return round((total / len(controls)), 0)
-
-    def implemented_progress(self, controls=None):
-        total = 0
-        if not controls:
-            controls = self.controls.all()
-        if not controls:
-            return total
-        for control in controls:
-            if control.is_applicable():
-                total += control.implemented_progress()
-        return round((total / len(controls)), 0)
+    def completion_progress(self, default=100):
+        return self.get_progress().completion_progress(default=default)
+
+    def evidence_progress(self):
+        return self.get_progress().evidence_progress()
+
+    def implemented_progress(self):
+        return self.get_progress().implemented_progress()
 
     def has_control(self, control_id):
         return self.controls.filter(ProjectControl.control_id == control_id).first()
@@ -2526,25 +3697,89 @@ class Project(db.Model, DateMixin):
             return False
         if self.has_control(control.id):
             return control
-        project_control = ProjectControl(control_id=control.id)
-        for sub in control.subcontrols.all():
-            control_sub = ProjectSubControl(subcontrol_id=sub.id, project_id=self.id)
-            project_control.subcontrols.append(control_sub)
+        project_control_ids = self.add_controls([control], commit=commit)
+        return ProjectControl.query.get(project_control_ids[0])
+
+    def add_controls(self, controls, commit=True, batch_size=None):
+        """
+        set-based version of add_control for many controls. Reads the
+        subcontrols with one query and inserts the ProjectControl,
+        ProjectSubControl and AuditorFeedback rows with multi-row inserts
+        """
+        batch_size = batch_size or current_app.config.get(
+            "FRAMEWORK_IMPORT_BATCH_SIZE", 500
+        )
+        existing = {
+            control_id
+            for (control_id,) in db.session.query(ProjectControl.control_id).filter(
+                ProjectControl.project_id == self.id
+            )
+        }
+        project_controls = {}
+        for control in controls:
+            if control and control.id not in existing:
+                project_controls[control.id] = with_defaults(
+                    ProjectControl.__table__,
+                    {"control_id": control.id, "project_id": self.id},
+                )
+        if not project_controls:
+            return []
+
+        project_subcontrols = []
+        feedback = []
+        for sub_id, control_id, tasks in (
+            db.session.query(SubControl.id, SubControl.control_id, SubControl.tasks)
+            .filter(SubControl.control_id.in_(list(project_controls)))
+            .order_by(SubControl.id)
+        ):
+            project_control_id = project_controls[control_id]["id"]
+            project_subcontrol = with_defaults(
+                ProjectSubControl.__table__,
+                {
+                    "subcontrol_id": sub_id,
+                    "project_control_id": project_control_id,
+                    "project_id": self.id,
+                },
+            )
+            project_subcontrols.append(project_subcontrol)
             # Add tasks (e.g. AuditorFeedback)
-            if sub.tasks:
-                for task in sub.tasks:
-                    control_sub.feedback.append(
-                        AuditorFeedback(
-                            title=task.get("title"),
-                            description=task.get("description"),
-                            owner_id=self.owner_id,
-                        )
+            for task in tasks or []:
+                feedback.append(
+                    with_defaults(
+                        AuditorFeedback.__table__,
+                        {
+                            "title": task.get("title"),
+                            "description": task.get("description"),
+                            "owner_id": self.owner_id,
+                            "control_id": project_control_id,
+                            "relates_to": project_subcontrol["id"],
+                        },
                     )
+                )
+
+        for model, rows in [
+            (ProjectControl, list(project_controls.values())),
+            (ProjectSubControl, project_subcontrols),
+            (AuditorFeedback, feedback),
+        ]:
+            for i in range(0, len(rows), batch_size):
+                db.session.execute(
+                    model.__table__.insert().values(rows[i : i + batch_size])
+                )
 
-        self.controls.append(project_control)
+        project_control_ids = [row["id"] for row in project_controls.values()]
+        ControlProgress.refresh(project_control_ids)
+        # the core inserts bypass the search index listener
+        search_index = SearchIndex()
+        for kind, ids in [
+            ("control", project_control_ids),
+            ("subcontrol", [row["id"] for row in project_subcontrols]),
+        ]:
+            for i in range(0, len(ids), batch_size):
+                search_index.refresh({kind: ids[i : i + batch_size]})
         if commit:
             db.session.commit()
-        return project_control
+        return project_control_ids
 
     def create_policy(self, name, description, template=None):
         policy = ProjectPolicy(name=name, description=description)
@@ -2570,6 +3805,7 @@ class Project(db.Model, DateMixin):
 
     def remove_control(self, id):
         if control := self.controls.filter(ProjectControl.id == id).first():
+            ControlProgress.remove(control.id)
             db.session.delete(control)
             db.session.commit()
         return True
@@ -2686,20 +3922,11 @@ class ProjectPolicy(db.Model):
 
     def get_versions(self, content=False, include_object=False):
         data = []
-        latest = True
-        for version in self.versions.order_by(PolicyVersion.version.desc()).all():
-            last_changed = arrow.get(version.date_updated or version.date_added).format(
-                "MMM, YY"
-            )
-            record = {
-                "version_id": version.id,
-                "version": version.version,
-                "status": version.status,
-                "published": version.published,
-                "last_changed": last_changed,
-                "is_latest": latest,
-            }
-            latest = False
+        _query = self.versions.order_by(PolicyVersion.version.desc())
+        if content:
+            _query = _query.options(undefer(PolicyVersion.content))
+        for version in _query.all():
+            record = ProjectPolicy.version_record(version, is_latest=not data)
             if content:
                 record["content"] = version.content
             if include_object:
@@ -2707,6 +3934,100 @@ class ProjectPolicy(db.Model):
             data.append(record)
         return data
 
+    @staticmethod
+    def version_record(version, is_latest=False):
+        last_changed = arrow.get(version.date_updated or version.date_added).format(
+            "MMM, YY"
+        )
+        return {
+            "version_id": version.id,
+            "version": version.version,
+            "status": version.status,
+            "published": version.published,
+            "last_changed": last_changed,
+            "is_latest": is_latest,
+        }
+
+    @staticmethod
+    def catalog(project_id, content=False):
+        """
+        returns the records of ProjectPolicy.as_dict() for every policy in
+        the project. Policies with their owner and reviewer emails and the
+        version metadata are loaded with two queries. The content of the
+        current versions is only loaded (with a third query) when content
+        is True
+        """
+        Owner = aliased(User)
+        Reviewer = aliased(User)
+        policies = (
+            db.session.query(ProjectPolicy, Owner.email, Reviewer.email)
+            .outerjoin(Owner, Owner.id == ProjectPolicy.owner_id)
+            .outerjoin(Reviewer, Reviewer.id == ProjectPolicy.reviewer_id)
+            .filter(ProjectPolicy.project_id == project_id)
+            .order_by(ProjectPolicy.name)
+            .all()
+        )
+        if not policies:
+            return []
+
+        versions = {}
+        for version in (
+            db.session.query(
+                PolicyVersion.id,
+                PolicyVersion.policy_id,
+                PolicyVersion.version,
+                PolicyVersion.status,
+                PolicyVersion.published,
+                PolicyVersion.date_added,
+                PolicyVersion.date_updated,
+            )
+            .filter(
+                PolicyVersion.policy_id.in_([policy.id for policy, _, _ in policies])
+            )
+            .order_by(PolicyVersion.policy_id, PolicyVersion.version.desc())
+            .all()
+        ):
+            versions.setdefault(version.policy_id, []).append(version)
+
+        data = []
+        for policy, owner, reviewer in policies:
+            record = {c.name: getattr(policy, c.name) for c in policy.__table__.columns}
+            record["owner"] = owner
+            record["reviewer"] = reviewer
+            record["version_id"] = 1
+            policy_versions = versions.get(policy.id, [])
+            # the published version and otherwise the latest one
+            if current := next(
+                (version for version in policy_versions if version.published),
+                policy_versions[0] if policy_versions else None,
+            ):
+                record["version_id"] = current.id
+                record["version"] = current.version
+            record["versions"] = [
+                ProjectPolicy.version_record(version, is_latest=index == 0)
+                for index, version in enumerate(policy_versions)
+            ]
+            record["version_count"] = len(policy_versions)
+            record["is_published"] = any(
+                version.published for version in policy_versions
+            )
+            data.append(record)
+
+        if content:
+            contents = dict(
+                db.session.query(PolicyVersion.id, PolicyVersion.content)
+                .filter(
+                    PolicyVersion.id.in_(
+                        [record["version_id"] for record in data if "version" in record]
+                    )
+                )
+                .all()
+            )
+            for record in data:
+                if "version" in record:
+                    record["content"] = contents.get(record["version_id"])
+        return data
+
     def get_latest_version(self, status=None):
         _query = self.versions
         if status:
@@ -2788,30 +4109,62 @@ class ProjectPolicy(db.Model):
             return user.email
         return None
 
-    def get_template_variables(self):
-        template = self.as_dict(
-            include=["uuid", "version", "name", "description", "ref_code"]
+    def get_template_variables(self, version=None):
+        """
+        placeholders of the policy: its fields, the organization, the
+        owner and reviewer emails and the labels of the tenant
+        """
+        tenant = self.project.tenant
+        template = {
+            "name": self.name,
+            "description": self.description,
+            "ref_code": self.ref_code,
+            "version": version.version if version else None,
+            "organization": tenant.name,
+        }
+        emails = dict(
+            db.session.query(User.id, User.email)
+            .filter(User.id.in_([self.owner_id, self.reviewer_id]))
+            .all()
         )
-        template["organization"] = self.project.tenant.name
-        template["owner_email"] = self.owner_email()
-        template["reviewer_email"] = self.reviewer_email()
-        for label in PolicyLabel.query.all():
-            template[label.key] = label.value
+        for field in ["owner", "reviewer"]:
+            template[field] = template[f"{field}_email"] = emails.get(
+                getattr(self, f"{field}_id")
+            )
+        for key, value in tenant.labels.with_entities(
+            PolicyLabel.key, PolicyLabel.value
+        ).all():
+            template[key] = value
         return template
 
-    def translate_to_html(self):
-        class CustomFormatter(Formatter):
-            def get_value(self, key, args, kwds):
-                if isinstance(key, str):
-                    try:
-                        return kwds[key]
-                    except KeyError:
-                        return key
-                else:
-                    return Formatter.get_value(key, args, kwds)
-
-        fmt = CustomFormatter()
-        return fmt.format(self.content, **self.get_template_variables())
+    def translate_to_html(self, version=None):
+        """
+        renders the version (by default the published and otherwise the
+        latest one) with the template variables. See PolicyRenderer
+        """
+        if version is None:
+            version = self.get_published_version() or self.get_latest_version()
+            if not version:
+                abort(404, "Policy does not have a version")
+        elif not isinstance(version, PolicyVersion):
+            version = self.get_version(version)
+        tenant = self.project.tenant
+        # anything the output depends on is part of the key
+        key = (
+            version.id,
+            version.date_updated,
+            self.date_updated,
+            self.owner_id,
+            self.reviewer_id,
+            tenant.name,
+            PolicyLabel.get_revision(tenant.id),
+        )
+        return current_app.policy_renderer.render(
+            key,
+            template_key=(version.id, version.date_updated),
+            get_content=lambda: version.content,
+            get_variables=lambda: self.get_template_variables(version=version),
+        )
 
 
 class PolicyVersion(db.Model):
@@ -2822,7 +4175,7 @@ class PolicyVersion(db.Model):
         default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
         unique=True,
     )
-    content = db.Column(db.String())
+    content = deferred(db.Column(db.String()))
     version = db.Column(db.Integer())
     status = db.Column(db.String(), default="draft")
     published = db.Column(db.Boolean(), default=False)
@@ -2897,14 +4250,10 @@ class ProjectControl(db.Model, ControlMixin):
     VALID_REVIEW_STATUS = ["infosec action", "ready for auditor", "complete"]
 
     def set_as_applicable(self):
-        for subcontrol in self.subcontrols.all():
-            subcontrol.is_applicable = True
-        db.session.commit()
+        self.set_applicability(True)
 
     def set_as_not_applicable(self):
-        for subcontrol in self.subcontrols.all():
-            subcontrol.is_applicable = False
-        db.session.commit()
+        self.set_applicability(False)
 
     def set_assignee(self, assignee_id):
         for subcontrol in self.subcontrols.all():
@@ -3344,6 +4693,8 @@ class ProjectSubControl(db.Model, SubControlMixin):
         if owner_id:
             self.owner_id = owner_id
 
+        db.session.flush()
+        ControlProgress.refresh(self.project_control_id)
         db.session.commit()
         return self
 
@@ -3548,6 +4899,7 @@ class User(db.Model, UserMixin):
     password = db.Column(db.String(255), nullable=False, server_default="")
     last_password_change = db.Column(db.DateTime())
     login_count = db.Column(db.Integer, default=0)
+    last_seen = db.Column(db.DateTime())
     first_name = db.Column(db.String(100), nullable=False, server_default="")
     last_name = db.Column(db.String(100), nullable=False, server_default="")
     super = db.Column(db.Boolean(), nullable=False, server_default="0")
@@ -3764,10 +5116,12 @@ class User(db.Model, UserMixin):
 
     @staticmethod
     def verify_auth_token(token):
-        data = misc.verify_jwt(token)
-        if data is False:
+        """
+        verified tokens are cached in-process, see TokenCache
+        """
+        if not (user_id := current_app.token_cache.get_user_id(token)):
             return False
-        return User.query.get(data["id"])
+        return User.query.get(user_id)
 
     def generate_auth_token(self, expiration=600):
         data = {"id": self.id}
@@ -3814,11 +5168,12 @@ class User(db.Model, UserMixin):
 
     def get_projects(self, tenant_id=None):
         tenants = [t for t in self.get_tenants() if not tenant_id or t.id == tenant_id]
+        authorizer = Authorizer(self)
         return [
             project
             for tenant in tenants
             for project in tenant.projects.all()
-            if Authorizer(self)._can_user_access_project(project)
+            if authorizer._can_user_access_project(project)
         ]
 
     def get_tenants(self, own=False):
@@ -3891,13 +5246,14 @@ class User(db.Model, UserMixin):
 
 class PolicyLabel(db.Model):
     __tablename__ = "policy_labels"
+    __table_args__ = (db.UniqueConstraint("key", "tenant_id"),)
     id = db.Column(
         db.String,
         primary_key=True,
         default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
         unique=True,
     )
-    key = db.Column(db.String(), unique=True, nullable=False)
+    key = db.Column(db.String(), nullable=False)
     value = db.Column(db.String(), nullable=False)
     owner_id = db.Column(db.String, db.ForeignKey("users.id"), nullable=False)
     tenant_id = db.Column(db.String, db.ForeignKey("tenants.id"), nullable=False)
@@ -3914,6 +5270,23 @@ class PolicyLabel(db.Model):
             raise ValueError("key must start with policy_label_")
         return key
 
+    @staticmethod
+    def get_revision(tenant_id):
+        """
+        changes whenever a label of the tenant is added, updated or deleted
+        """
+        count, updated = (
+            db.session.query(
+                func.count(PolicyLabel.id),
+                func.max(
+                    func.coalesce(PolicyLabel.date_updated, PolicyLabel.date_added)
+                ),
+            )
+            .filter(PolicyLabel.tenant_id == tenant_id)
+            .one()
+        )
+        return (count, updated)
+
 
 class Tag(db.Model):
     __tablename__ = "tags"
@@ -4300,6 +5673,218 @@ class FormSection(db.Model, QueryMixin):
         return item
 
 
+class AssessmentSummary(db.Model):
+    """
+    Rollup of the enabled FormItems of an assessment form, used by the
+    assessment list views instead of loading every item. Kept current by
+    refresh() when items are inserted, updated or deleted (see the
+    after_flush listener at the end of this module)
+    """
+
+    __tablename__ = "assessment_summaries"
+    id = db.Column(
+        db.String,
+        primary_key=True,
+        default=lambda: str(shortuuid.ShortUUID().random(length=8)).lower(),
+        unique=True,
+    )
+    form_id = db.Column(
+        db.String,
+        db.ForeignKey("forms.id", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    total_items = db.Column(db.Integer, default=0)
+    answered = db.Column(db.Integer, default=0)
+    pending = db.Column(db.Integer, default=0)
+    info_required = db.Column(db.Integer, default=0)
+    complete = db.Column(db.Integer, default=0)
+    remediation_required = db.Column(db.Integer, default=0)
+    remediation_complete = db.Column(db.Integer, default=0)
+    next_remediation_due = db.Column(db.DateTime)
+    date_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def percentage(part, total):
+        if not total:
+            return 0
+        return round((part / total) * 100)
+
+    def as_dict(self):
+        """
+        same keys (and math) as the item based Assessment helpers, e.g.
+        get_vendor_answered_percentage
+        """
+        total = self.total_items or 0
+        statuses = {
+            "pending": self.pending or 0,
+            "info_required": self.info_required or 0,
+            "complete": self.complete or 0,
+        }
+        reviewed = sum(statuses.values())
+        remediation_past_due = False
+        if self.next_remediation_due:
+            due_date = arrow.get(self.next_remediation_due).date()
+            remediation_past_due = due_date <= arrow.utcnow().date()
+        return {
+            "total_items": total,
+            "total_vendor_answered": self.answered or 0,
+            "vendor_answered_percentage": self.percentage(self.answered, total),
+            "question_statuses": statuses,
+            "infosec_review_percentage": self.percentage(
+                reviewed - statuses["pending"], reviewed
+            ),
+            "vendor_review_percentage": self.percentage(
+                reviewed - statuses["info_required"], reviewed
+            ),
+            "all_questions_complete": statuses["complete"] == total,
+            "remediation_required": self.remediation_required or 0,
+            "remediation_complete": self.remediation_complete or 0,
+            "next_remediation_due": self.next_remediation_due,
+            "remediation_past_due": remediation_past_due,
+        }
+
+    @staticmethod
+    def summarize(form_ids):
+        """
+        aggregates the enabled items per form, matching FormItem.get_status
+        """
+        answered = and_(
+            FormItem.applicable == True,
+            FormItem.response != None,
+            FormItem.response != "",
+        )
+        remediation = and_(
+            FormItem.remediation_plan_required == True,
+            FormItem.remediation_complete.isnot(True),
+        )
+        return (
+            select(
+                [
+                    FormSection.form_id,
+                    func.count(FormItem.id),
+                    func.sum(case([(answered, 1)], else_=0)),
+                    func.sum(case([(FormItem.review_status == "pending", 1)], else_=0)),
+                    func.sum(
+                        case([(FormItem.review_status == "info_required", 1)], else_=0)
+                    ),
+                    func.sum(
+                        case([(FormItem.review_status == "complete", 1)], else_=0)
+                    ),
+                    func.sum(case([(remediation, 1)], else_=0)),
+                    func.sum(
+                        case(
+                            [(FormItem.remediation_complete == True, 1)],
+                            else_=0,
+                        )
+                    ),
+                    func.min(
+                        case([(remediation, FormItem.remediation_due_date)], else_=None)
+                    ),
+                ]
+            )
+            .select_from(
+                FormItem.__table__.join(
+                    FormSection.__table__, FormSection.id == FormItem.section_id
+                )
+            )
+            .where(FormSection.form_id.in_(form_ids))
+            .where(FormItem.disabled.isnot(True))
+            .group_by(FormSection.form_id)
+        )
+
+    @staticmethod
+    def refresh(form_ids, session=None):
+        """
+        recomputes the summaries of the forms with core statements, so it
+        is safe to call from a flush event. The forms are locked (FOR NO
+        KEY UPDATE, in id order) so concurrent refreshes of a form run one
+        after the other and the later one counts the committed items of
+        the earlier one. Does not commit
+        """
+        session = session or db.session
+        forms = Form.__table__
+        # skips the forms deleted in the same flush
+        form_ids = {
+            row[0]
+            for row in session.execute(
+                select([forms.c.id])
+                .where(forms.c.id.in_(set(filter(None, form_ids))))
+                .order_by(forms.c.id)
+                .with_for_update(key_share=True)
+            )
+        }
+        if not form_ids:
+            return True
+        table = AssessmentSummary.__table__
+        rows = {
+            row[0]: row
+            for row in session.execute(AssessmentSummary.summarize(form_ids))
+        }
+        now = datetime.utcnow()
+        values = []
+        for form_id in form_ids:
+            row = rows.get(form_id) or [form_id] + [0] * 7 + [None]
+            values.append(
+                with_defaults(
+                    table,
+                    {
+                        "form_id": form_id,
+                        "total_items": int(row[1] or 0),
+                        "answered": int(row[2] or 0),
+                        "pending": int(row[3] or 0),
+                        "info_required": int(row[4] or 0),
+                        "complete": int(row[5] or 0),
+                        "remediation_required": int(row[6] or 0),
+                        "remediation_complete": int(row[7] or 0),
+                        "next_remediation_due": row[8],
+                        "date_updated": now,
+                    },
+                )
+            )
+        if session.get_bind().dialect.name != "postgresql":
+            session.execute(table.delete().where(table.c.form_id.in_(form_ids)))
+            session.execute(table.insert(), values)
+            return True
+        statement = insert(table).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.form_id],
+            set_={
+                column.name: statement.excluded[column.name]
+                for column in table.columns
+                if column.name not in ["id", "form_id"]
+            },
+        )
+        session.execute(statement)
+        return True
+
+    @staticmethod
+    def get(form_ids):
+        """
+        returns {form_id: AssessmentSummary}, building the missing ones
+        """
+        form_ids = set(filter(None, form_ids))
+        if not form_ids:
+            return {}
+        summaries = {
+            record.form_id: record
+            for record in AssessmentSummary.query.filter(
+                AssessmentSummary.form_id.in_(form_ids)
+            ).all()
+        }
+        if missing := form_ids - set(summaries):
+            AssessmentSummary.refresh(missing)
+            summaries.update(
+                {
+                    record.form_id: record
+                    for record in AssessmentSummary.query.filter(
+                        AssessmentSummary.form_id.in_(missing)
+                    ).all()
+                }
+            )
+        return summaries
+
+
 class Assessment(db.Model, QueryMixin):
     __tablename__ = "assessments"
     __table_args__ = (db.UniqueConstraint("name", "vendor_id"),)
@@ -4339,52 +5924,92 @@ class Assessment(db.Model, QueryMixin):
     VALID_STATUS = ["pending", "approved", "not approved"]
 
     def as_dict(self):
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        data["guests"] = self.get_available_guests()
-        if self.vendor_id:
-            data["vendor"] = self.vendor.name
-        data["owner"] = User.query.get(self.owner_id).email
-        data["is_review_complete"] = self.is_review_complete()
-        data["is_complete"] = self.is_complete()
-
-        data["due_date_humanize"] = self.days_until_due_date(humanize=True)
-        days_until_due_date = self.days_until_due_date()
-        data["days_until_due_date"] = days_until_due_date
-        data["due_date_upcoming"] = False
-        data["past_due"] = False
-        data["due_date"] = arrow.get(self.due_before).format("YYYY-MM-DD")
-        if days_until_due_date <= 14 and not data["is_review_complete"]:
-            data["due_date_upcoming"] = True
-        if days_until_due_date <= 0 and not data["is_review_complete"]:
-            data["past_due"] = True
-
-        data["assessment_published"] = self.is_assessment_published()
-        data["review_description"] = self.get_review_description()
-        data["is_vendor_status"] = self.is_vendor_status()
+        return Assessment.serialize([self])[0]
 
-        items = self.get_items(flatten=True)
-        (
-            total_items,
-            total_vendor_answered,
-            vendor_answered_percentage,
-        ) = self.get_vendor_answered_percentage(items=items)
-        data["total_items"] = total_items
-        data["total_vendor_answered"] = total_vendor_answered
-        data["vendor_answered_percentage"] = vendor_answered_percentage
-
-        data["question_statuses"] = self.get_grouping_for_question_review_status(
-            items=items
-        )
-        data["infosec_review_percentage"] = self.get_question_review_percentage(
-            items=items
+    @staticmethod
+    def serialize(assessments):
+        """
+        serializes a list of assessments with a fixed number of queries.
+        The question counters come from AssessmentSummary, the items are
+        never loaded
+        """
+        if not assessments:
+            return []
+        vendors = dict(
+            Vendor.query.with_entities(Vendor.id, Vendor.name)
+            .filter(Vendor.id.in_({a.vendor_id for a in assessments if a.vendor_id}))
+            .all()
         )
-        data["vendor_review_percentage"] = (
-            self.get_question_review_percentage_for_vendor(items=items)
+        owners = dict(
+            User.query.with_entities(User.id, User.email)
+            .filter(User.id.in_({a.owner_id for a in assessments}))
+            .all()
         )
-        data["all_questions_complete"] = False
-        if data["question_statuses"]["complete"] == total_items:
-            data["all_questions_complete"] = True
+        summaries = AssessmentSummary.get({a.form_id for a in assessments})
+        guests = {}
+        for assessment_id, email in (
+            db.session.query(AssessmentGuest.assessment_id, User.email)
+            .join(User, User.id == AssessmentGuest.user_id)
+            .filter(AssessmentGuest.assessment_id.in_({a.id for a in assessments}))
+            .all()
+        ):
+            guests.setdefault(assessment_id, set()).add(email)
+        # users with the vendor role can be added as guests
+        available_guests = {}
+        for tenant_id, user_id, email in (
+            db.session.query(TenantMember.tenant_id, User.id, User.email)
+            .join(User, User.id == TenantMember.user_id)
+            .join(
+                TenantMemberRole, TenantMemberRole.tenant_member_id == TenantMember.id
+            )
+            .join(Role, Role.id == TenantMemberRole.role_id)
+            .filter(TenantMember.tenant_id.in_({a.tenant_id for a in assessments}))
+            .filter(func.lower(Role.name) == "vendor")
+            .distinct()
+            .all()
+        ):
+            available_guests.setdefault(tenant_id, []).append((user_id, email))
 
+        empty = AssessmentSummary().as_dict()
+        data = []
+        for assessment in assessments:
+            record = {
+                c.name: getattr(assessment, c.name)
+                for c in assessment.__table__.columns
+            }
+            record["guests"] = [
+                {
+                    "id": user_id,
+                    "email": email,
+                    "access": email in guests.get(assessment.id, ()),
+                }
+                for user_id, email in available_guests.get(assessment.tenant_id, [])
+            ]
+            if assessment.vendor_id:
+                record["vendor"] = vendors.get(assessment.vendor_id)
+            record["owner"] = owners.get(assessment.owner_id)
+            record["is_review_complete"] = assessment.is_review_complete()
+            record["is_complete"] = assessment.is_complete()
+
+            record["due_date_humanize"] = assessment.days_until_due_date(humanize=True)
+            days_until_due_date = assessment.days_until_due_date()
+            record["days_until_due_date"] = days_until_due_date
+            record["due_date_upcoming"] = False
+            record["past_due"] = False
+            record["due_date"] = arrow.get(assessment.due_before).format("YYYY-MM-DD")
+            if days_until_due_date <= 14 and not record["is_review_complete"]:
+                record["due_date_upcoming"] = True
+            if days_until_due_date <= 0 and not record["is_review_complete"]:
+                record["past_due"] = True
+
+            record["assessment_published"] = assessment.is_assessment_published()
+            record["review_description"] = assessment.get_review_description()
+            record["is_vendor_status"] = assessment.is_vendor_status()
+            if summary := summaries.get(assessment.form_id):
+                record.update(summary.as_dict())
+            else:
+                record.update(empty)
+            data.append(record)
         return data
 
     def update_review_status(self, status, send_notification=False, override=False):
@@ -4696,14 +6321,7 @@ class Assessment(db.Model, QueryMixin):
         vendor role. Users already added as a vendor for this assessment
         will be marked with access:True
         """
-        users = []
-        for user in self.tenant.members.all():
-            record = {"id": user.id, "email": user.email, "access": False}
-            if self.can_user_be_added_as_a_guest(user):
-                if self.has_guest(user.email):
-                    record["access"] = True
-                users.append(record)
-        return users
+        return MembershipDirectory(self.tenant).get_available_guests(self)
 
     def can_user_be_added_as_a_guest(self, user):
         if self.tenant.has_member_with_role(user, "vendor"):
@@ -4711,7 +6329,12 @@ class Assessment(db.Model, QueryMixin):
         return False
 
     def has_guest(self, email):
-        return email in [x.user.email for x in self.guests.all()]
+        return (
+            self.guests.join(User, User.id == AssessmentGuest.user_id)
+            .filter(User.email == email)
+            .first()
+            is not None
+        )
 
     def get_guests(self):
         return [{"id": x.user_id, "email": x.user.email} for x in self.guests.all()]
@@ -4811,6 +6434,13 @@ class ConfigStore(db.Model):
 
 class Logs(db.Model):
     __tablename__ = "logs"
+    __table_args__ = (
+        # keyset pagination, see Logs.page
+        db.Index("ix_logs_tenant_date_id", "tenant_id", "date_added", "id"),
+        db.Index("ix_logs_date_id", "date_added", "id"),
+        db.Index("ix_logs_namespace_date", "namespace", "date_added"),
+        db.Index("ix_logs_user_date", "user_id", "date_added"),
+    )
     id = db.Column(
         db.String,
         primary_key=True,
@@ -4832,13 +6462,91 @@ class Logs(db.Model):
     """
 
     def as_dict(self):
-        data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
-        if self.user_id:
-            data["user_email"] = User.query.get(self.user_id).email
-        if self.tenant_id:
-            data["tenant_name"] = Tenant.query.get(self.tenant_id).name
+        return Logs.serialize([self])[0]
+
+    @staticmethod
+    def serialize(logs):
+        """
+        same as as_dict for many logs, resolving the user emails and tenant
+        names with one query each
+        """
+        user_ids = {log.user_id for log in logs if log.user_id}
+        tenant_ids = {log.tenant_id for log in logs if log.tenant_id}
+        emails = {}
+        if user_ids:
+            emails = dict(
+                db.session.query(User.id, User.email).filter(User.id.in_(user_ids))
+            )
+        tenants = {}
+        if tenant_ids:
+            tenants = dict(
+                db.session.query(Tenant.id, Tenant.name).filter(
+                    Tenant.id.in_(tenant_ids)
+                )
+            )
+        data = []
+        for log in logs:
+            record = {c.name: getattr(log, c.name) for c in log.__table__.columns}
+            if log.user_id:
+                record["user_email"] = emails.get(log.user_id)
+            if log.tenant_id:
+                record["tenant_name"] = tenants.get(log.tenant_id)
+            data.append(record)
         return data
 
+    @staticmethod
+    def encode_cursor(log):
+        value = json.dumps([log.date_added.isoformat(), log.id])
+        return base64.urlsafe_b64encode(value.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            date_added, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return datetime.fromisoformat(date_added), id
+        except (ValueError, TypeError):
+            abort(400, "Invalid cursor")
+
+    @staticmethod
+    def page(cursor=None, limit=100, **kwargs):
+        """
+        keyset pagination ordered by (date_added, id) descending. Pages stay
+        consistent while new logs are added and the cost does not grow with
+        the offset. Takes the same filters as Logs.get
+
+        Logs.page(tenant_id=tenant.id, limit=50)
+        Logs.page(tenant_id=tenant.id, cursor=data["next_cursor"])
+        """
+        limit = max(1, min(int(limit), 1000))
+        _query = Logs.get(as_query=True, limit=None, **kwargs)
+        if cursor:
+            date_added, id = Logs.decode_cursor(cursor)
+            _query = _query.filter(
+                or_(
+                    Logs.date_added < date_added,
+                    and_(Logs.date_added == date_added, Logs.id < id),
+                )
+            )
+        logs = _query.limit(limit + 1).all()
+        next_cursor = None
+        if len(logs) > limit:
+            logs = logs[:limit]
+            next_cursor = Logs.encode_cursor(logs[-1])
+        return {"logs": Logs.serialize(logs), "next_cursor": next_cursor}
+
+    @staticmethod
+    def create_meta_index():
+        """
+        optional GIN index for the meta filters of Logs.get. Built
+        concurrently so the table is not locked, see manage.py index_logs
+        """
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level="AUTOCOMMIT").execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_logs_meta "
+                "ON logs USING gin ((meta::jsonb) jsonb_path_ops)"
+            )
+        return True
+
     def as_readable(self):
         formatted_date = arrow.get(self.date_added).format("YYYY-MM-DD HH:mm:ss")
         user_str = f"User:{self.user_id}" if self.user_id else "User:N/A"
@@ -4884,18 +6592,22 @@ class Logs(db.Model):
         action = action.upper()
         if meta is None:
             meta = {}
-        msg = Logs(
-            namespace=namespace.lower(),
-            message=message,
-            level=level,
-            action=action,
-            success=success,
-            user_id=user_id,
-            tenant_id=tenant_id,
-            meta=meta,
+        row = with_defaults(
+            Logs.__table__,
+            {
+                "namespace": namespace.lower(),
+                "message": message,
+                "level": level,
+                "action": action,
+                "success": success,
+                "user_id": user_id,
+                "tenant_id": tenant_id,
+                "meta": meta,
+            },
         )
-        db.session.add(msg)
-        db.session.commit()
+        # written in batches by the AuditLogWriter, see app.utils.audit_log
+        current_app.audit_log.submit(row)
+        msg = Logs(**row)
         if stdout:
             getattr(current_app.logger, level.lower())(
                 f"Audit: {tenant_id} | {user_id} | {namespace} |  {success} | {action} | {message}"
@@ -4923,17 +6635,21 @@ class Logs(db.Model):
     ):
         """
         get_logs(level='error', namespace="my_namespace", meta={"key":"value":"key2":"value2"})
+
+        Logs.add stores namespace in lower case and level and action in upper
+        case, so the filters compare the columns directly and can use the
+        indexes. The meta filter uses jsonb containment (see create_meta_index)
         """
-        _query = Logs.query.order_by(Logs.date_added.desc()).limit(limit)
+        _query = Logs.query
 
         if id:
             _query = _query.filter(Logs.id == id)
         if message:
             _query = _query.filter(Logs.message == message)
         if namespace:
-            _query = _query.filter(func.lower(Logs.namespace) == func.lower(namespace))
+            _query = _query.filter(Logs.namespace == namespace.lower())
         if action:
-            _query = _query.filter(func.lower(Logs.action) == func.lower(action))
+            _query = _query.filter(Logs.action == action.upper())
         if success is not None:
             _query = _query.filter(Logs.success == success)
         if user_id:
@@ -4943,26 +6659,58 @@ class Logs(db.Model):
         if level:
             if not isinstance(level, list):
                 level = [level]
-            _query = _query.filter(
-                func.lower(Logs.level).in_([lvl.lower() for lvl in level])
-            )
+            _query = _query.filter(Logs.level.in_([lvl.upper() for lvl in level]))
 
         if meta:
-            for key, value in meta.items():
-                _query = _query.filter(Logs.meta.op("->>")(key) == value)
+            _query = _query.filter(cast(Logs.meta, JSONB).contains(meta))
         if span:
             _query = _query.filter(
                 Logs.date_added >= arrow.utcnow().shift(hours=-span).datetime
             )
+        _query = _query.order_by(Logs.date_added.desc(), Logs.id.desc())
         if as_query:
-            return _query
+            return _query.limit(limit) if limit else _query
         if as_count:
             return _query.count()
         if paginate:
             return _query.paginate(page=page, per_page=10)
+        logs = _query.limit(limit).all()
         if as_dict:
-            return [log.as_dict() for log in _query.all()]
-        return _query.all()
+            return Logs.serialize(logs)
+        return logs
+
+
+class SearchDocument(db.Model):
+    """
+    One full-text search document per indexed row, maintained by SearchIndex
+    """
+
+    __tablename__ = "search_documents"
+    __table_args__ = (db.Index("ix_search_documents_tenant_kind", "tenant_id", "kind"),)
+    kind = db.Column(db.String, primary_key=True)
+    object_id = db.Column(db.String, primary_key=True)
+    tenant_id = db.Column(
+        db.String, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
+    project_id = db.Column(
+        db.String, db.ForeignKey("projects.id", ondelete="CASCADE"), nullable=True
+    )
+    title = db.Column(db.String)
+    body = db.Column(db.String)
+    # weighted tsvector of title (A) and body (B) written by SearchIndex.upsert,
+    # unused on SQLite where SearchIndex searches an InvertedIndex
+    tsv = db.Column(TSVECTOR().with_variant(db.Text, "sqlite"))
+    date_updated = db.Column(db.DateTime, server_default=func.now())
+
+
+listen(
+    SearchDocument.__table__,
+    "after_create",
+    DDL(
+        "CREATE INDEX IF NOT EXISTS ix_search_documents_tsv "
+        "ON search_documents USING gin (tsv)"
+    ).execute_if(dialect="postgresql"),
+)
 
 
 @login.user_loader
@@ -4985,15 +6733,64 @@ def before_update_vendor_remediation_listener(target, value, old_value, initiato
         target.review_status = "pending"
 
 
-@listens_for(ProjectSubControl.implemented, "set")
-def after_update_project_sub_control_implementation_listener(
-    target, value, old_value, initiator
-):
+@listens_for(db.session, "after_flush")
+def after_flush_assessment_summary_listener(session, flush_context):
+    """
+    Refreshes the AssessmentSummary of the forms whose items changed in
+    this flush. new/dirty/deleted and the attribute history still hold the
+    pre-flush state here, so items (sections) moved to another section
+    (form) also refresh the form they left
+    """
+
+    def values(obj, key):
+        return {getattr(obj, key), *inspect(obj).attrs[key].history.deleted}
+
+    objects = [*session.new, *session.dirty, *session.deleted]
+    section_ids, form_ids = set(), set()
+    for obj in objects:
+        if isinstance(obj, FormItem):
+            section_ids.update(values(obj, "section_id"))
+        elif isinstance(obj, FormSection):
+            form_ids.update(values(obj, "form_id"))
+    section_ids.discard(None)
+    if section_ids:
+        table = FormSection.__table__
+        form_ids.update(
+            row[0]
+            for row in session.execute(
+                select([table.c.form_id]).where(table.c.id.in_(section_ids))
+            )
+        )
+    form_ids.discard(None)
+    if form_ids:
+        AssessmentSummary.refresh(form_ids, session=session)
+
+
+@listens_for(db.session, "after_flush")
+def after_flush_search_index_listener(session, flush_context):
+    """
+    Rebuilds the search documents of the rows changed in this flush.
+    Deleted rows are no longer found by the rebuild and lose their document.
+    Changed controls and subcontrols rebuild the documents of their projects
+    """
+    refs, source_refs = SearchIndex.get_refs(
+        [*session.new, *session.dirty, *session.deleted]
+    )
+    if refs or source_refs:
+        SearchIndex(session).refresh(refs, source_refs)
+
+
+@listens_for(db.session, "after_commit")
+def after_commit_completion_history_listener(session):
     """
-    When the implementation of a subcontrol is updated, we are going to calculate the project
-    completion so that we can show a progress chart overtime
+    When the progress of a project changed in the transaction, the
+    CompletionRecorder snapshots it in the background so we can show a
+    progress chart overtime
     """
-    project = target.project
-    if project.ready_for_completion_update():
-        completion = project.completion_progress()
-        project.add_completion_metric(completion=completion)
+    if project_ids := CompletionRecorder.pop(session):
+        current_app.completion_history.submit(project_ids)
+
+
+@listens_for(db.session, "after_rollback")
+def after_rollback_completion_history_listener(session):
+    CompletionRecorder.pop(session)
@@ -0,0 +1,162 @@
+from app import db
+from app.utils import misc
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import bindparam, func
+import threading
+import hashlib
+import atexit
+import time
+import os
+
+
+class TokenCache:
+    """
+    In-process LRU cache of recently verified API tokens. A hit maps the
+    token to its user id without checking the signature again. Entries
+    expire with the token or after ttl seconds, whichever comes first.
+    Only the sha256 of a token is kept
+
+    Usage:
+        user_id = app.token_cache.get_user_id(token)
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def from_config(app):
+        return TokenCache(
+            maxsize=app.config.get("API_TOKEN_CACHE_SIZE", 10000),
+            ttl=app.config.get("API_TOKEN_CACHE_TTL", 60),
+        )
+
+    @staticmethod
+    def get_key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get_user_id(self, token):
+        """
+        returns the user id of a valid token or None
+        """
+        key = self.get_key(token)
+        now = time.time()
+        with self._lock:
+            if cached := self._tokens.get(key):
+                if cached[1] > now:
+                    self._tokens.move_to_end(key)
+                    self._metrics["hits"] += 1
+                    return cached[0]
+                del self._tokens[key]
+            self._metrics["misses"] += 1
+
+        verified = misc.verify_jwt(token, return_header=True)
+        if verified is False:
+            return None
+        data, header = verified
+        expires = min(header.get("exp", now + self.ttl), now + self.ttl)
+        with self._lock:
+            self._tokens[key] = (data["id"], expires)
+            self._tokens.move_to_end(key)
+            while len(self._tokens) > self.maxsize:
+                self._tokens.popitem(last=False)
+        return data["id"]
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self._metrics, "size": len(self._tokens)}
+
+
+class UserActivity:
+    """
+    Aggregates login_count and last_seen of API requests in memory and
+    writes them with a single executemany every flush_interval seconds, so
+    authenticated requests do not lock the users row
+
+    Usage:
+        app.user_activity.record(user.id)
+    """
+
+    def __init__(self, app, enabled=True, flush_interval=30):
+        self.app = app
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def from_config(app):
+        return UserActivity(
+            app,
+            enabled=not app.config.get("TESTING"),
+            flush_interval=app.config.get("USER_ACTIVITY_FLUSH_INTERVAL", 30),
+        )
+
+    def record(self, user_id):
+        now = datetime.utcnow()
+        with self._lock:
+            count, _ = self._pending.get(user_id, (0, None))
+            self._pending[user_id] = (count + 1, now)
+        if not self.enabled:
+            return self.flush()
+        self.start()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        table = self.app.models["User"].__table__
+        statement = (
+            table.update()
+            .where(table.c.id == bindparam("user_id"))
+            .values(
+                login_count=func.coalesce(table.c.login_count, 0) + bindparam("count"),
+                last_seen=bindparam("seen"),
+            )
+        )
+        rows = [
+            {"user_id": user_id, "count": count, "seen": seen}
+            for user_id, (count, seen) in pending.items()
+        ]
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(statement, rows)
+        except Exception as e:
+            self.app.logger.error(f"Failed to write activity of {len(rows)} users: {e}")
+        return len(rows)
+
+    def start(self):
+        # the thread does not survive a fork (e.g. gunicorn workers)
+        if self._thread and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="user-activity", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,199 @@
+from app import db
+from sqlalchemy.exc import IntegrityError, DataError
+from queue import Queue, Empty, Full
+import threading
+import atexit
+import time
+import os
+
+
+class AuditLogWriter:
+    """
+    Writes audit log rows (see Logs.add) from a background thread. Rows are
+    put on a bounded in-process queue and inserted with a single
+    executemany per batch when batch_size rows are waiting or every
+    flush_interval seconds, whichever comes first.
+
+    When the queue is full the caller writes the row itself (backpressure).
+    A failed batch is retried and then written row by row, so only rows
+    the database rejects on their own are dropped (and logged). With
+    enabled=False (e.g. TESTING) every row is written synchronously.
+
+    Usage:
+        app.audit_log.submit(row)
+        app.audit_log.stats()
+    """
+
+    def __init__(
+        self,
+        app,
+        enabled=True,
+        batch_size=100,
+        flush_interval=2.0,
+        queue_size=10000,
+        retries=3,
+        retry_delay=0.5,
+    ):
+        self.app = app
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.queue = Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+        self._metrics = {
+            "queued": 0,
+            "written": 0,
+            "batches": 0,
+            "overflow": 0,
+            "errors": 0,
+            "dropped": 0,
+            "max_depth": 0,
+            "last_batch_size": 0,
+            "last_flush_seconds": 0,
+        }
+
+    @staticmethod
+    def from_config(app):
+        return AuditLogWriter(
+            app,
+            enabled=app.config.get("AUDIT_LOG_ASYNC", True)
+            and not app.config.get("TESTING"),
+            batch_size=app.config.get("AUDIT_LOG_BATCH_SIZE", 100),
+            flush_interval=app.config.get("AUDIT_LOG_FLUSH_INTERVAL", 2.0),
+            queue_size=app.config.get("AUDIT_LOG_QUEUE_SIZE", 10000),
+        )
+
+    @property
+    def table(self):
+        return self.app.models["Logs"].__table__
+
+    def submit(self, row):
+        """
+        enqueues a row for the logs table. Returns False if the row was
+        written synchronously
+        """
+        if not self.enabled:
+            self.write([row])
+            return False
+        self.start()
+        try:
+            self.queue.put_nowait(row)
+        except Full:
+            self._increment("overflow")
+            self.write([row])
+            return False
+        self._increment("queued")
+        depth = self.queue.qsize()
+        if depth > self._metrics["max_depth"]:
+            self._metrics["max_depth"] = depth
+        return True
+
+    def write(self, rows):
+        """
+        inserts the rows on a separate connection, so pending changes in
+        the caller's session are not committed
+        """
+        start = time.perf_counter()
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(self.table.insert(), rows)
+        with self._lock:
+            self._metrics["written"] += len(rows)
+            self._metrics["batches"] += 1
+            self._metrics["last_batch_size"] = len(rows)
+            self._metrics["last_flush_seconds"] = round(time.perf_counter() - start, 4)
+
+    def start(self):
+        # the thread does not survive a fork (e.g. gunicorn workers)
+        if self._thread and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="audit-log-writer", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, timeout=5):
+        """
+        stops the worker and writes the rows that are still queued
+        """
+        self._stopped.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def flush(self):
+        while rows := self._drain():
+            self._write_batch(rows)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._metrics,
+                "depth": self.queue.qsize(),
+                "capacity": self.queue.maxsize,
+                "enabled": self.enabled,
+            }
+
+    def _increment(self, key):
+        with self._lock:
+            self._metrics[key] += 1
+
+    def _drain(self):
+        rows = []
+        while len(rows) < self.batch_size:
+            try:
+                rows.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return rows
+
+    def _write_batch(self, rows):
+        """
+        retries a failed batch (e.g. a lost connection), then writes the
+        rows one by one so a single bad row does not lose the others
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                return self.write(rows)
+            except Exception as e:
+                self._increment("errors")
+                self.app.logger.warning(
+                    f"Failed to write {len(rows)} audit logs (attempt {attempt + 1}): {e}"
+                )
+                # a rejected row fails again, find it right away
+                if isinstance(e, (IntegrityError, DataError)):
+                    break
+                if attempt < self.retries:
+                    time.sleep(self.retry_delay * 2**attempt)
+        for row in rows:
+            try:
+                self.write([row])
+            except Exception as e:
+                self._increment("dropped")
+                self.app.logger.error(f"Dropped audit log {row}: {e}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            deadline = time.monotonic() + self.flush_interval
+            rows = []
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self.queue.get(timeout=remaining))
+                except Empty:
+                    break
+            if rows:
+                self._write_batch(rows)
@@ -1,4 +1,5 @@
-from flask import abort
+from flask import abort, current_app, g, has_app_context
+from app import db
 from app.utils.misc import get_class_by_tablename
 import logging
 
@@ -6,6 +7,89 @@ AUTHORIZED_MSG = "authorized"
 UNAUTHORIZED_MSG = "unauthorized"
 
 
+class AccessMap:
+    """
+    The tenant roles and project access levels of a user, loaded with two
+    queries and shared by every Authorizer in the request (flask.g)
+
+    Usage:
+        access = AccessMap.for_user(user)
+        access.has_tenant_role(tenant.id, ["admin"])
+    """
+
+    def __init__(self, user):
+        self.user_id = getattr(user, "id", None)
+        self._tenants = None
+        self._projects = None
+
+    @staticmethod
+    def for_user(user):
+        if not has_app_context():
+            return AccessMap(user)
+        access = AccessMap(user)
+        cache = g.setdefault("access_maps", {})
+        return cache.setdefault(access.user_id, access)
+
+    @staticmethod
+    def clear():
+        """
+        drops the cached maps after memberships, roles or access levels
+        change during the request
+        """
+        if has_app_context():
+            g.pop("access_maps", None)
+
+    @property
+    def tenants(self):
+        """
+        {tenant_id: {role names}}
+        """
+        if self._tenants is None:
+            TenantMember = current_app.models["TenantMember"]
+            TenantMemberRole = current_app.models["TenantMemberRole"]
+            Role = current_app.models["Role"]
+            self._tenants = {}
+            for tenant_id, role_name in (
+                db.session.query(TenantMember.tenant_id, Role.name)
+                .outerjoin(
+                    TenantMemberRole,
+                    TenantMemberRole.tenant_member_id == TenantMember.id,
+                )
+                .outerjoin(Role, Role.id == TenantMemberRole.role_id)
+                .filter(TenantMember.user_id == self.user_id)
+            ):
+                roles = self._tenants.setdefault(tenant_id, set())
+                if role_name:
+                    roles.add(role_name.lower())
+        return self._tenants
+
+    @property
+    def projects(self):
+        """
+        {project_id: access level}
+        """
+        if self._projects is None:
+            ProjectMember = current_app.models["ProjectMember"]
+            self._projects = dict(
+                db.session.query(
+                    ProjectMember.project_id, ProjectMember.access_level
+                ).filter(ProjectMember.user_id == self.user_id)
+            )
+        return self._projects
+
+    def is_tenant_member(self, tenant_id):
+        return tenant_id in self.tenants
+
+    def has_tenant_role(self, tenant_id, role_names):
+        return bool(self.tenants.get(tenant_id, set()) & set(role_names))
+
+    def is_project_member(self, project_id):
+        return project_id in self.projects
+
+    def has_project_access(self, project_id, access_levels):
+        return self.projects.get(project_id) in access_levels
+
+
 class Authorizer:
     def __init__(self, user, bubble_errors=False, ds=False):
         self.user = user
@@ -13,6 +97,7 @@ class Authorizer:
         # deserialize - don't return objects in the json response
         # Not implemented
         self.ds = ds
+        self.access = AccessMap.for_user(user)
 
     def return_response(self, ok, msg, code=200, **kwargs):
         data = {**{"ok": ok, "message": msg, "code": code}, "extra": {**kwargs}}
@@ -53,7 +138,7 @@ class Authorizer:
         if (
             self.user.super
             or self.user.id == tenant.owner_id
-            or self.user.has_role_for_tenant(tenant, "admin")
+            or self.access.has_tenant_role(tenant.id, ["admin"])
         ):
             return True
         return False
@@ -62,7 +147,7 @@ class Authorizer:
         if (
             self.user.super
             or self.user.id == tenant.owner_id
-            or self.user.has_role_for_tenant(tenant, "admin")
+            or self.access.has_tenant_role(tenant.id, ["admin"])
         ):
             return True
         return False
@@ -71,7 +156,7 @@ class Authorizer:
         if (
             self.user.super
             or self.user.id == tenant.owner_id
-            or self.user.has_tenant(tenant)
+            or self.access.is_tenant_member(tenant.id)
         ):
             return True
         return False
@@ -80,7 +165,7 @@ class Authorizer:
         if (
             self.user.super
             or self.user.id == tenant.owner_id
-            or self.user.has_tenant(tenant)
+            or self.access.is_tenant_member(tenant.id)
         ):
             return True
         return False
@@ -89,8 +174,8 @@ class Authorizer:
         if (
             self.user.super
             or self.user.id == tenant.owner_id
-            or self.user.has_any_role_for_tenant(
-                tenant,
+            or self.access.has_tenant_role(
+                tenant.id,
                 ["admin", "viewer", "vendor", "riskmanager", "riskviewer"],
             )
         ):
@@ -101,8 +186,8 @@ class Authorizer:
         if (
             self.user.super
             or self.user.id == tenant.owner_id
-            or self.user.has_any_role_for_tenant(
-                tenant, ["admin", "viewer", "riskmanager"]
+            or self.access.has_tenant_role(
+                tenant.id, ["admin", "viewer", "riskmanager"]
             )
         ):
             return True
@@ -155,6 +240,35 @@ class Authorizer:
             return self.return_response(True, AUTHORIZED_MSG, 200, tenant=tenant)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
+    def can_user_search_tenant(self, tenant):
+        """
+        the scope of the search: kinds the user may find and the projects
+        they may read (None for all projects of the tenant)
+        """
+        if not (tenant := self._does_tenant_exist(tenant)):
+            return self.return_response(False, "tenant not found", 404)
+        if not self._can_user_read_tenant(tenant):
+            return self.return_response(False, UNAUTHORIZED_MSG, 403)
+        kinds = ["control", "subcontrol", "evidence", "policy"]
+        if self._can_user_manage_tenant(tenant):
+            kinds.append("vendor")
+        if self._can_user_access_risk_module(tenant):
+            kinds.append("risk")
+        projects = None
+        if not self._can_user_admin_tenant(tenant):
+            projects = [
+                project_id
+                for project_id, access_level in self.access.projects.items()
+                if access_level in ["manager", "contributor", "viewer", "auditor"]
+            ]
+        return self.return_response(
+            True,
+            AUTHORIZED_MSG,
+            200,
+            tenant=tenant,
+            scope={"kinds": kinds, "projects": projects},
+        )
+
     # tenant assessment
     def can_user_manage_assessment(self, assessment):
         if not (assessment := self.id_to_obj("Assessment", assessment)):
@@ -221,16 +335,35 @@ class Authorizer:
 
     # tenant policy labels
     def can_user_manage_policy_label(self, label):
-        if not (label := self.id_to_obj("PolicyLabels", label)):
+        if not (label := self.id_to_obj("PolicyLabel", label)):
             return self.return_response(False, "policy label not found", 404)
-        if self.user == label.owner_id or self._can_user_manage_tenant(label.tenant):
-            return self.return_response(True, AUTHORIZED_MSG, 200, tag=tag)
+        if self.user.id == label.owner_id or self._can_user_manage_tenant(label.tenant):
+            return self.return_response(True, AUTHORIZED_MSG, 200, label=label)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
     # tenant controls
+    def _does_tenant_use_control(self, tenant, control):
+        """
+        controls of the tenant and of the catalog frameworks it enabled
+        """
+        if control.tenant_id:
+            return control.tenant_id == tenant.id
+        Framework = current_app.models["Framework"]
+        return db.session.query(
+            Framework.query.filter(
+                Framework.tenant_id == tenant.id,
+                Framework.catalog_id == control.framework_id,
+            ).exists()
+        ).scalar()
+
     def can_user_manage_control(self, control):
         if not (control := self.id_to_obj("Control", control)):
             return self.return_response(False, "control not found", 404)
+        # controls of the shared framework catalog are used by every tenant
+        if not control.tenant_id:
+            if self.user.super:
+                return self.return_response(True, AUTHORIZED_MSG, 200, control=control)
+            return self.return_response(False, UNAUTHORIZED_MSG, 403)
         if self._can_user_manage_tenant(control.tenant):
             return self.return_response(True, AUTHORIZED_MSG, 200, control=control)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
@@ -238,7 +371,7 @@ class Authorizer:
     def can_user_read_control(self, control):
         if not (control := self.id_to_obj("Control", control)):
             return self.return_response(False, "control not found", 404)
-        if self._can_user_read_tenant(control.tenant):
+        if not control.tenant_id or self._can_user_read_tenant(control.tenant):
             return self.return_response(True, AUTHORIZED_MSG, 200, control=control)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
@@ -284,6 +417,24 @@ class Authorizer:
             return self.return_response(True, AUTHORIZED_MSG, 200, evidence=evidence)
         return self.return_response(False, UNAUTHORIZED_MSG, 403)
 
+    def can_user_manage_upload(self, upload):
+        """
+        only the uploader, while they can still add files to the project
+        or vendor
+        """
+        if not (upload := self.id_to_obj("UploadSession", upload)):
+            return self.return_response(False, "upload not found", 404)
+        if self.user.id != upload.owner_id:
+            return self.return_response(False, UNAUTHORIZED_MSG, 403)
+        parent = upload.get_parent()
+        if upload.target == "evidence":
+            allowed = parent and self._can_user_edit_project(parent)
+        else:
+            allowed = parent and self._can_user_manage_tenant(parent.tenant)
+        if allowed:
+            return self.return_response(True, AUTHORIZED_MSG, 200, upload=upload)
+        return self.return_response(False, UNAUTHORIZED_MSG, 403)
+
     # project
     def _does_project_exist(self, project):
         if project := self.id_to_obj("Project", project):
@@ -293,33 +444,35 @@ class Authorizer:
     def _can_user_manage_project(self, project):
         if self._can_user_admin_tenant(
             project.tenant
-        ) or project.has_member_with_access(self.user, ["manager"]):
+        ) or self.access.has_project_access(project.id, ["manager"]):
             return True
         return False
 
     def _can_user_edit_project(self, project):
         if self._can_user_admin_tenant(
             project.tenant
-        ) or project.has_member_with_access(self.user, ["manager", "contributor"]):
+        ) or self.access.has_project_access(project.id, ["manager", "contributor"]):
             return True
         return False
 
     def _can_user_read_project(self, project):
         if self._can_user_admin_tenant(
             project.tenant
-        ) or project.has_member_with_access(
-            self.user, ["manager", "contributor", "viewer", "auditor"]
+        ) or self.access.has_project_access(
+            project.id, ["manager", "contributor", "viewer", "auditor"]
         ):
             return True
         return False
 
     def _can_user_audit_project(self, project):
-        if project.has_member_with_access(self.user, ["auditor"]):
+        if self.access.has_project_access(project.id, ["auditor"]):
             return True
         return False
 
     def _can_user_access_project(self, project):
-        if self._can_user_admin_tenant(project.tenant) or project.has_member(self.user):
+        if self._can_user_admin_tenant(project.tenant) or self.access.is_project_member(
+            project.id
+        ):
             return True
         return False
 
@@ -571,7 +724,9 @@ class Authorizer:
             return self.return_response(False, "control not found", 404)
         if not (project := self.id_to_obj("Project", project)):
             return self.return_response(False, "project not found", 404)
-        if self._can_user_edit_project(project) and control.tenant == project.tenant:
+        if self._can_user_edit_project(project) and self._does_tenant_use_control(
+            project.tenant, control
+        ):
             return self.return_response(
                 True, AUTHORIZED_MSG, 200, control=control, project=project
             )
@@ -0,0 +1,153 @@
+from app import db
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from app.utils.framework_import import with_defaults
+import threading
+import atexit
+import os
+
+
+class CompletionRecorder:
+    """
+    Records CompletionHistory snapshots outside of the request. Projects
+    whose ProjectProgress changed are marked during the transaction and
+    handed over after commit (see the session listeners in app.models). A
+    background thread snapshots them every flush_interval seconds from the
+    ProjectProgress rollup, at most once per project per interval seconds,
+    so bursts of edits coalesce into one snapshot
+
+    Usage:
+        CompletionRecorder.mark(session, project_id)
+        app.completion_history.submit(project_ids)
+    """
+
+    SESSION_KEY = "completion_projects"
+
+    def __init__(self, app, enabled=True, interval=86400, flush_interval=30):
+        self.app = app
+        self.enabled = enabled
+        self.interval = timedelta(seconds=interval)
+        self.flush_interval = flush_interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopped = threading.Event()
+
+    @staticmethod
+    def from_config(app):
+        return CompletionRecorder(
+            app,
+            enabled=not app.config.get("TESTING"),
+            interval=app.config.get("COMPLETION_HISTORY_INTERVAL", 86400),
+            flush_interval=app.config.get("COMPLETION_HISTORY_FLUSH_INTERVAL", 30),
+        )
+
+    @staticmethod
+    def mark(session, project_id):
+        """
+        marks the project for a snapshot once the session commits
+        """
+        session.info.setdefault(CompletionRecorder.SESSION_KEY, set()).add(project_id)
+
+    @staticmethod
+    def pop(session):
+        return session.info.pop(CompletionRecorder.SESSION_KEY, None) or set()
+
+    def submit(self, project_ids):
+        with self._lock:
+            self._pending.update(project_ids)
+        if not self.enabled:
+            return self.flush()
+        self.start()
+
+    def flush(self):
+        with self._lock:
+            project_ids, self._pending = self._pending, set()
+        if not project_ids:
+            return 0
+        try:
+            return self.record(project_ids)
+        except Exception as e:
+            self.app.logger.error(
+                f"Failed to record the completion of {len(project_ids)} projects: {e}"
+            )
+            return 0
+
+    def record(self, project_ids):
+        """
+        inserts a snapshot for the projects that are due. Uses its own
+        connection, so it is safe to call from any thread
+        """
+        models = self.app.models
+        projects = models["Project"].__table__
+        progress = models["ProjectProgress"].__table__
+        history = models["CompletionHistory"].__table__
+        now = datetime.utcnow()
+        with self.app.app_context():
+            with db.engine.begin() as connection:
+                rows = connection.execute(
+                    select(
+                        [
+                            projects.c.id,
+                            projects.c.last_completion_update,
+                            progress.c.completed,
+                            progress.c.applicable_controls,
+                        ]
+                    )
+                    .select_from(
+                        projects.join(progress, progress.c.project_id == projects.c.id)
+                    )
+                    .where(projects.c.id.in_(project_ids))
+                ).fetchall()
+                snapshots = []
+                for row in rows:
+                    last = row.last_completion_update
+                    if last and now - last < self.interval:
+                        continue
+                    # same math as ProjectProgress.completion_progress
+                    value = 100
+                    if row.applicable_controls:
+                        value = round(row.completed / row.applicable_controls, 0)
+                    snapshots.append(
+                        with_defaults(
+                            history,
+                            {
+                                "project_id": row.id,
+                                "value": int(value),
+                                "date_added": now,
+                            },
+                        )
+                    )
+                if not snapshots:
+                    return 0
+                connection.execute(history.insert(), snapshots)
+                connection.execute(
+                    projects.update()
+                    .where(projects.c.id.in_([row["project_id"] for row in snapshots]))
+                    .values(last_completion_update=now)
+                )
+        return len(snapshots)
+
+    def start(self):
+        # the thread does not survive a fork (e.g. gunicorn workers)
+        if self._thread and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="completion-history", daemon=True
+            )
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stopped.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
@@ -0,0 +1,259 @@
+from app import db
+from flask import current_app
+from sqlalchemy import and_
+from sqlalchemy.orm import contains_eager, undefer
+from app.utils.evidence_index import EvidenceIndex
+
+
+class ControlStats:
+    """
+    Builds the same records as ProjectControl.as_dict() for every control
+    in a project, but loads controls, subcontrols, evidence, tags, feedback,
+    comments and users with a fixed number of set-based queries instead of
+    several queries per subcontrol
+
+    Usage:
+        ControlStats(project).get_controls(view="missing-evidence")
+    """
+
+    VIEWS = [
+        "with-evidence",
+        "missing-evidence",
+        "not-implemented",
+        "implemented",
+        "applicable",
+        "not-applicable",
+        "complete",
+        "not-complete",
+    ]
+
+    def __init__(self, project):
+        self.project = project
+        self.models = current_app.models
+
+    def get_controls(self, view=None):
+        if view and view not in self.VIEWS:
+            return []
+
+        controls = self.query_controls(view=view)
+        if not controls:
+            return []
+        control_ids = [control.id for control, framework in controls]
+
+        subcontrols = self.query_subcontrols(control_ids if view else None)
+        evidence = self.query_evidence()
+        tags = self.query_tags()
+        feedback = self.query_feedback()
+        comments = self.query_comments()
+
+        user_ids = set()
+        for sub in subcontrols:
+            user_ids.update([sub.owner_id, sub.operator_id])
+        for record in feedback + comments:
+            user_ids.add(record.owner_id)
+        users = self.query_users(user_ids)
+
+        frameworks = {control.id: framework for control, framework in controls}
+        subcontrols_by_control = {}
+        for sub in subcontrols:
+            subcontrols_by_control.setdefault(sub.project_control_id, []).append(
+                sub.serialize(
+                    evidence=evidence.get(sub.id, []),
+                    owner=users.get(sub.owner_id),
+                    operator=users.get(sub.operator_id),
+                    framework=frameworks.get(sub.project_control_id),
+                    project=self.project.name,
+                )
+            )
+
+        feedback_by_control = {}
+        for record in feedback:
+            data = {c.name: getattr(record, c.name) for c in record.__table__.columns}
+            data["auditor_email"] = users.get(record.owner_id)
+            data["status"] = record.status
+            feedback_by_control.setdefault(record.control_id, []).append(data)
+
+        comments_by_control = {}
+        for record in comments:
+            data = {c.name: getattr(record, c.name) for c in record.__table__.columns}
+            data["author_email"] = users.get(record.owner_id)
+            comments_by_control.setdefault(record.control_id, []).append(data)
+
+        data = []
+        for control, framework in controls:
+            record = {
+                c.name: getattr(control, c.name) for c in control.__table__.columns
+            }
+            for field in [
+                "name",
+                "ref_code",
+                "system_level",
+                "category",
+                "subcategory",
+                "is_custom",
+            ]:
+                record[field] = getattr(control.control, field)
+            stats = control.summarize_stats(
+                subcontrols=subcontrols_by_control.get(control.id, []),
+                feedback=feedback_by_control.get(control.id, []),
+                tags=tags.get(control.id, []),
+                comments=comments_by_control.get(control.id, []),
+            )
+            data.append({**stats, **record})
+        return data
+
+    def view_filter(self, view):
+        """
+        translates the view into a predicate on the ControlProgress rollup,
+        matching the fields computed by ControlMixin.summarize_stats
+        """
+        ControlProgress = self.models["ControlProgress"]
+        applicable = ControlProgress.applicable
+        implemented = ControlProgress.implemented
+        evidence = ControlProgress.evidence
+        complete = ControlProgress.complete
+
+        # progress_implemented is round(implemented / applicable), so it is 0
+        # when the average is <= 0.5 and 100 when the average is >= 99.5
+        return {
+            "with-evidence": evidence > 0,
+            "missing-evidence": evidence == 0,
+            "not-implemented": implemented * 2 <= applicable,
+            "implemented": and_(applicable > 0, implemented * 2 >= applicable * 199),
+            "applicable": applicable > 0,
+            "not-applicable": applicable == 0,
+            "complete": complete == applicable,
+            "not-complete": complete != applicable,
+        }[view]
+
+    def query_controls(self, view=None):
+        ProjectControl = self.models["ProjectControl"]
+        Control = self.models["Control"]
+        Framework = self.models["Framework"]
+
+        _query = (
+            db.session.query(ProjectControl, Framework.name)
+            .join(Control, Control.id == ProjectControl.control_id)
+            .join(Framework, Framework.id == Control.framework_id)
+            .options(contains_eager(ProjectControl.control))
+            .filter(ProjectControl.project_id == self.project.id)
+        )
+        if view:
+            ControlProgress = self.models["ControlProgress"]
+            # builds the rollup on first use
+            self.project.get_progress()
+            _query = _query.join(
+                ControlProgress,
+                ControlProgress.project_control_id == ProjectControl.id,
+            ).filter(self.view_filter(view))
+        return _query.all()
+
+    def query_subcontrols(self, control_ids=None):
+        ProjectSubControl = self.models["ProjectSubControl"]
+        SubControl = self.models["SubControl"]
+
+        _query = (
+            ProjectSubControl.query.join(
+                SubControl, SubControl.id == ProjectSubControl.subcontrol_id
+            )
+            .options(contains_eager(ProjectSubControl.subcontrol))
+            .filter(ProjectSubControl.project_id == self.project.id)
+        )
+        if control_ids is not None:
+            _query = _query.filter(
+                ProjectSubControl.project_control_id.in_(control_ids)
+            )
+        return _query.order_by(ProjectSubControl.date_added.desc()).all()
+
+    def query_evidence(self):
+        """
+        returns {project_subcontrol_id: [evidence dicts]} with the same
+        fields as ProjectEvidence.as_dict()
+        """
+        ProjectSubControl = self.models["ProjectSubControl"]
+        ProjectEvidence = self.models["ProjectEvidence"]
+        EvidenceAssociation = self.models["EvidenceAssociation"]
+
+        links = (
+            db.session.query(EvidenceAssociation.control_id, ProjectEvidence)
+            .join(
+                ProjectEvidence, ProjectEvidence.id == EvidenceAssociation.evidence_id
+            )
+            .join(
+                ProjectSubControl,
+                ProjectSubControl.id == EvidenceAssociation.control_id,
+            )
+            .filter(ProjectSubControl.project_id == self.project.id)
+            .options(undefer(ProjectEvidence.content))
+            .all()
+        )
+        if not links:
+            return {}
+
+        # evidence may be mapped to controls outside of this project
+        mapped_controls = EvidenceIndex(self.project).get_controls(
+            {evidence.id for control_id, evidence in links}
+        )
+
+        serialized = {}
+        data = {}
+        for control_id, evidence in links:
+            if evidence.id not in serialized:
+                record = {
+                    c.name: getattr(evidence, c.name)
+                    for c in evidence.__table__.columns
+                }
+                controls = mapped_controls.get(evidence.id, [])
+                record["control_count"] = len(controls)
+                record["controls"] = controls
+                record["has_file"] = evidence.has_file()
+                serialized[evidence.id] = record
+            data.setdefault(control_id, []).append(serialized[evidence.id])
+        return data
+
+    def query_tags(self):
+        ProjectControl = self.models["ProjectControl"]
+        ControlTags = self.models["ControlTags"]
+        Tag = self.models["Tag"]
+
+        data = {}
+        for control_id, tag_id, name in (
+            db.session.query(ControlTags.control_id, Tag.id, Tag.name)
+            .join(Tag, Tag.id == ControlTags.tag_id)
+            .join(ProjectControl, ProjectControl.id == ControlTags.control_id)
+            .filter(ProjectControl.project_id == self.project.id)
+            .all()
+        ):
+            data.setdefault(control_id, []).append({"id": tag_id, "name": name})
+        return data
+
+    def query_feedback(self):
+        ProjectControl = self.models["ProjectControl"]
+        AuditorFeedback = self.models["AuditorFeedback"]
+        return (
+            AuditorFeedback.query.join(
+                ProjectControl, ProjectControl.id == AuditorFeedback.control_id
+            )
+            .filter(ProjectControl.project_id == self.project.id)
+            .all()
+        )
+
+    def query_comments(self):
+        ProjectControl = self.models["ProjectControl"]
+        ControlComment = self.models["ControlComment"]
+        return (
+            ControlComment.query.join(
+                ProjectControl, ProjectControl.id == ControlComment.control_id
+            )
+            .filter(ProjectControl.project_id == self.project.id)
+            .all()
+        )
+
+    def query_users(self, user_ids):
+        User = self.models["User"]
+        user_ids = [user_id for user_id in user_ids if user_id]
+        if not user_ids:
+            return {}
+        return dict(
+            db.session.query(User.id, User.email).filter(User.id.in_(user_ids)).all()
+        )
@@ -1,5 +1,5 @@
 from functools import wraps
-from flask import request, jsonify, redirect, url_for, flash
+from flask import request, jsonify, redirect, url_for, flash, current_app
 from app.models import *
 from flask_login import current_user, login_user, logout_user
 
@@ -11,13 +11,22 @@ def custom_login(user):
         login_user(user)
 
 
+def api_login(user):
+    """
+    token requests do not write to the users row, login_count and
+    last_seen are flushed in batches by app.user_activity
+    """
+    current_app.user_activity.record(user.id)
+    login_user(user)
+
+
 def validate_token_in_header(enc_token):
     user = User.verify_auth_token(enc_token)
     if not user:
         return False
     if not user.is_active:
         return False
-    if not user.confirmed:
+    if not user.email_confirmed_at:
         return False
     return user
 
@@ -56,7 +65,7 @@ def login_required(view_function):
             api = True
             if not (user := validate_token_in_header(token)):
                 return jsonify({"message": "Invalid authentication"}), 401
-            custom_login(user)
+            api_login(user)
         else:
             if not current_user.is_authenticated:
                 return redirect(url_for("auth.get_login", next=request.full_path))
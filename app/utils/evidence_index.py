@@ -0,0 +1,92 @@
+from app import db
+from flask import current_app
+from sqlalchemy import func
+
+
+class EvidenceIndex:
+    """
+    Evidence to subcontrol mappings of a project, built with one grouped
+    join instead of loading the associations and subcontrols of every
+    evidence row separately
+
+    Usage:
+        EvidenceIndex(project).get_groupings()
+        EvidenceIndex(project).serialize(project.evidence.all())
+    """
+
+    def __init__(self, project=None):
+        self.project = project
+        self.models = current_app.models
+
+    def get_controls(self, evidence_ids):
+        """
+        returns {evidence_id: [{"id": subcontrol id, "name": name}]}
+        """
+        EvidenceAssociation = self.models["EvidenceAssociation"]
+        ProjectSubControl = self.models["ProjectSubControl"]
+        SubControl = self.models["SubControl"]
+
+        data = {}
+        if not evidence_ids:
+            return data
+        for evidence_id, control_id, name in (
+            db.session.query(
+                EvidenceAssociation.evidence_id,
+                EvidenceAssociation.control_id,
+                SubControl.name,
+            )
+            .join(
+                ProjectSubControl,
+                ProjectSubControl.id == EvidenceAssociation.control_id,
+            )
+            .join(SubControl, SubControl.id == ProjectSubControl.subcontrol_id)
+            .filter(EvidenceAssociation.evidence_id.in_(evidence_ids))
+            .order_by(SubControl.name)
+            .all()
+        ):
+            data.setdefault(evidence_id, []).append({"id": control_id, "name": name})
+        return data
+
+    def get_groupings(self):
+        """
+        returns {evidence_id: {"id", "name", "count"}} where count is the
+        number of subcontrols of the project mapped to the evidence
+        """
+        EvidenceAssociation = self.models["EvidenceAssociation"]
+        ProjectSubControl = self.models["ProjectSubControl"]
+        ProjectEvidence = self.models["ProjectEvidence"]
+
+        return {
+            row.id: {"id": row.id, "name": row.name, "count": row.count}
+            for row in db.session.query(
+                ProjectEvidence.id,
+                ProjectEvidence.name,
+                func.count(EvidenceAssociation.id).label("count"),
+            )
+            .join(
+                EvidenceAssociation,
+                EvidenceAssociation.evidence_id == ProjectEvidence.id,
+            )
+            .join(
+                ProjectSubControl,
+                ProjectSubControl.id == EvidenceAssociation.control_id,
+            )
+            .filter(ProjectSubControl.project_id == self.project.id)
+            .group_by(ProjectEvidence.id, ProjectEvidence.name)
+            .all()
+        }
+
+    def serialize(self, evidence):
+        """
+        builds the same records as ProjectEvidence.as_dict() for a list of
+        evidence
+        """
+        controls = self.get_controls([record.id for record in evidence])
+        data = []
+        for record in evidence:
+            item = {c.name: getattr(record, c.name) for c in record.__table__.columns}
+            item["control_count"] = len(controls.get(record.id, []))
+            item["controls"] = controls.get(record.id, [])
+            item["has_file"] = record.has_file()
+            data.append(item)
+        return data
@@ -1,15 +1,125 @@
-from flask import current_app
+from flask import current_app, request, Response, send_file
+import hashlib
+import base64
 import os
 import boto3
 from google.cloud import storage
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
+from requests.adapters import HTTPAdapter
+from google.api_core.exceptions import NotFound
+import threading
 import shutil
 import glob
 from datetime import timedelta
+from urllib.parse import quote
 from app.utils.exceptions import FileDoesNotExist
+import unicodedata
+
+
+def content_disposition(download_name):
+    """
+    attachment header like send_file builds it: a quoted ASCII filename
+    and the UTF-8 name in filename* for non-ASCII names
+    """
+    download_name = "".join(c for c in download_name if c.isprintable())
+    simple = unicodedata.normalize("NFKD", download_name)
+    simple = simple.encode("ascii", "ignore").decode("ascii")
+    escaped = simple.replace("\\", "\\\\").replace('"', '\\"')
+    value = f'attachment; filename="{escaped}"'
+    if simple != download_name:
+        quoted = quote(download_name, safe="!#$&+-.^_`|~")
+        value += f"; filename*=UTF-8''{quoted}"
+    return value
+
+
+class StorageClients:
+    """
+    Process-wide registry of S3 and GCS clients. Clients are created on
+    first use, keyed by their credentials, and shared by every
+    FileStorageHandler (both clients are thread safe). boto3 and
+    google-auth refresh expiring credentials on their own, so a client is
+    only rebuilt after clear() or in a forked process (e.g. gunicorn workers)
+
+    Usage:
+        StorageClients.get_s3(region_name="us-east-1")
+        StorageClients.get_gcs()
+    """
+
+    _clients = {}
+    _lock = threading.Lock()
+    _pid = None
+
+    @classmethod
+    def get(cls, key, factory):
+        # sockets and locks do not survive a fork
+        if cls._pid != os.getpid():
+            with cls._lock:
+                if cls._pid != os.getpid():
+                    cls._clients = {}
+                    cls._pid = os.getpid()
+        if (client := cls._clients.get(key)) is not None:
+            return client
+        with cls._lock:
+            if (client := cls._clients.get(key)) is None:
+                client = cls._clients[key] = factory()
+        return client
+
+    @classmethod
+    def get_s3(
+        cls, access_key=None, secret_key=None, region_name=None, endpoint_url=None
+    ):
+        max_connections = current_app.config.get("STORAGE_MAX_POOL_CONNECTIONS", 50)
+
+        def factory():
+            # boto3.client() uses a shared default session that is not thread safe
+            session = boto3.session.Session()
+            return session.client(
+                "s3",
+                aws_access_key_id=access_key,
+                aws_secret_access_key=secret_key,
+                region_name=region_name,
+                endpoint_url=endpoint_url,
+                config=Config(
+                    max_pool_connections=max_connections,
+                    tcp_keepalive=True,
+                    retries={"mode": "standard"},
+                    # S3 compatible stand-ins (e.g. minio) use path style urls
+                    s3={"addressing_style": "path"} if endpoint_url else None,
+                ),
+            )
+
+        return cls.get(
+            ("s3", access_key, secret_key, region_name, endpoint_url), factory
+        )
+
+    @classmethod
+    def get_gcs(cls, credentials_path=None):
+        max_connections = current_app.config.get("STORAGE_MAX_POOL_CONNECTIONS", 50)
+
+        def factory():
+            if credentials_path:
+                client = storage.Client.from_service_account_json(credentials_path)
+            else:
+                client = storage.Client()
+            # the default requests pool keeps 10 connections
+            adapter = HTTPAdapter(
+                pool_connections=max_connections, pool_maxsize=max_connections
+            )
+            client._http.mount("https://", adapter)
+            return client
+
+        return cls.get(("gcs", credentials_path), factory)
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._clients = {}
 
 
 class FileStorageHandler:
+    CHUNK_SIZE = 1024 * 1024
+
     def __init__(
         self,
         provider,
@@ -72,21 +182,20 @@ class FileStorageHandler:
                 "AWS_REGION is not configured, boto3 will try to use ADC"
             )
 
-        if access_key and secret_key:
-            self.s3_client = boto3.client(
-                "s3",
-                aws_access_key_id=access_key,
-                aws_secret_access_key=secret_key,
-                region_name=region_name,
-            )
-        else:
-            self.s3_client = boto3.client("s3", region_name=region_name)
+        if not (access_key and secret_key):
+            access_key = secret_key = None
+        self.s3_client = StorageClients.get_s3(
+            access_key=access_key,
+            secret_key=secret_key,
+            region_name=region_name,
+            endpoint_url=current_app.config.get("AWS_ENDPOINT_URL"),
+        )
 
     def _initialize_gcs(self, gcs_bucket_name):
         self.gcs_bucket_name = gcs_bucket_name or current_app.config.get("GCS_BUCKET")
         if not self.gcs_bucket_name:
             raise ValueError("gcs_bucket_name is required for GCS storage")
-        self.gcs_client = storage.Client()
+        self.gcs_client = StorageClients.get_gcs()
 
     def _check_provider(self, required_provider):
         if self.provider != required_provider:
@@ -145,14 +254,297 @@ class FileStorageHandler:
         elif self.provider == "gcs":
             return self.delete_gcs_file(path=path)
 
-    def get_size(self, folder):
+    def get_size(self, folder, recursive=False):
+        """
+        total size of the files in the folder. S3 and GCS always include
+        sub folders (prefix match)
+        """
         if self.provider == "local":
-            return self.get_local_size(folder=folder)
+            return self.get_local_size(folder=folder, recursive=recursive)
         elif self.provider == "s3":
             return self.get_s3_size(folder=folder)
         elif self.provider == "gcs":
             return self.get_gcs_size(folder=folder)
 
+    def get_file_size(self, path):
+        if self.provider == "local":
+            return os.path.getsize(self.get_local_path(path))
+        elif self.provider == "s3":
+            obj = self.s3_client.head_object(Bucket=self.s3_bucket_name, Key=path)
+            return obj["ContentLength"]
+        elif self.provider == "gcs":
+            blob = self.gcs_client.bucket(self.gcs_bucket_name).get_blob(path)
+            if not blob:
+                raise FileDoesNotExist(f"File:{path} does not exist in GCS")
+            return blob.size
+
+    # Direct Uploads
+    def create_upload(
+        self,
+        path,
+        size,
+        checksum=None,
+        sha256=None,
+        content_type=None,
+        origin=None,
+        expires=None,
+    ):
+        """
+        Returns the request the client sends to upload the file straight to
+        the bucket, so the bytes do not pass through the app. Local storage
+        has no bucket, the url is left to the caller (see write_chunk)
+
+        Parameters:
+            path (str): path of the file in the provider
+            size (int): size of the file in bytes
+            checksum (str): hex md5 of the file, S3 and GCS reject other content
+            sha256 (str): hex sha256 of the file, S3 rejects other content
+            content_type (str): content type of the file
+            origin (str): origin of the browser upload (GCS CORS)
+            expires (int): seconds the url is valid
+
+        Returns:
+            {"method", "url", "headers"}
+        """
+        content_type = content_type or "application/octet-stream"
+        expires = expires or current_app.config.get("UPLOAD_URL_EXPIRES", 3600)
+        headers = {"Content-Type": content_type}
+        if self.provider == "local":
+            return {"method": "PUT", "url": None, "headers": headers}
+        elif self.provider == "s3":
+            params = {
+                "Bucket": self.s3_bucket_name,
+                "Key": path.lstrip(os.sep),
+                "ContentType": content_type,
+            }
+            if checksum:
+                params["ContentMD5"] = base64.b64encode(
+                    bytes.fromhex(checksum)
+                ).decode()
+                headers["Content-MD5"] = params["ContentMD5"]
+            if sha256:
+                params["ChecksumSHA256"] = base64.b64encode(
+                    bytes.fromhex(sha256)
+                ).decode()
+                headers["x-amz-checksum-sha256"] = params["ChecksumSHA256"]
+            url = self.s3_client.generate_presigned_url(
+                "put_object", Params=params, ExpiresIn=int(expires)
+            )
+            return {"method": "PUT", "url": url, "headers": headers}
+        elif self.provider == "gcs":
+            blob = self.gcs_client.bucket(self.gcs_bucket_name).blob(path)
+            url = blob.create_resumable_upload_session(
+                content_type=content_type, size=size, origin=origin
+            )
+            if checksum:
+                md5 = base64.b64encode(bytes.fromhex(checksum)).decode()
+                headers["X-Goog-Hash"] = f"md5={md5}"
+            return {"method": "PUT", "url": url, "headers": headers}
+
+    def get_upload_info(self, path):
+        """
+        size, hex md5 and hex sha256 of an uploaded file. S3 and GCS only
+        read the object metadata: the md5 is None for multipart (S3) and
+        composite (GCS) objects, the sha256 is the checksum S3 verified on
+        upload and None for GCS. Local files are hashed in one pass
+        """
+        if self.provider == "local":
+            path = self.get_local_path(path)
+            if not os.path.isfile(path):
+                raise FileDoesNotExist(f"File:{path} does not exist in local")
+            md5, sha256 = hashlib.md5(), hashlib.sha256()
+            with open(path, "rb") as file:
+                while chunk := file.read(self.CHUNK_SIZE):
+                    md5.update(chunk)
+                    sha256.update(chunk)
+            return {
+                "size": os.path.getsize(path),
+                "md5": md5.hexdigest(),
+                "sha256": sha256.hexdigest(),
+            }
+        elif self.provider == "s3":
+            try:
+                obj = self.s3_client.head_object(
+                    Bucket=self.s3_bucket_name,
+                    Key=path.lstrip(os.sep),
+                    ChecksumMode="ENABLED",
+                )
+            except ClientError:
+                raise FileDoesNotExist(f"File:{path} does not exist in S3")
+            etag = obj["ETag"].strip('"')
+            checksum = obj.get("ChecksumSHA256")
+            return {
+                "size": obj["ContentLength"],
+                "md5": None if "-" in etag else etag,
+                "sha256": (
+                    base64.b64decode(checksum).hex()
+                    if checksum and "-" not in checksum
+                    else None
+                ),
+            }
+        elif self.provider == "gcs":
+            blob = self.gcs_client.bucket(self.gcs_bucket_name).get_blob(path)
+            if not blob:
+                raise FileDoesNotExist(f"File:{path} does not exist in GCS")
+            md5 = base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None
+            return {"size": blob.size, "md5": md5, "sha256": None}
+
+    @staticmethod
+    def hash_stream(stream, chunk_size=None):
+        """
+        sha256 and size of a seekable stream (e.g. FileStorage.stream). The
+        stream is rewound to where it was
+        """
+        chunk_size = chunk_size or FileStorageHandler.CHUNK_SIZE
+        position = stream.tell()
+        digest = hashlib.sha256()
+        size = 0
+        while chunk := stream.read(chunk_size):
+            digest.update(chunk)
+            size += len(chunk)
+        stream.seek(position)
+        return digest.hexdigest(), size
+
+    def move_file(self, path, destination):
+        """
+        moves a stored file within the provider (server side for S3 and GCS)
+        """
+        if self.provider == "local":
+            destination = self.get_local_path(destination)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            os.replace(self.get_local_path(path), destination)
+        elif self.provider == "s3":
+            self.s3_client.copy(
+                {"Bucket": self.s3_bucket_name, "Key": path.lstrip(os.sep)},
+                self.s3_bucket_name,
+                destination.lstrip(os.sep),
+            )
+            self.delete_s3_file(path.lstrip(os.sep))
+        elif self.provider == "gcs":
+            bucket = self.gcs_client.bucket(self.gcs_bucket_name)
+            bucket.rename_blob(bucket.blob(path), destination)
+        return destination
+
+    def write_chunk(self, path, stream, offset=0):
+        """
+        Chunked upload for local storage. Appends the stream to the file at
+        offset, which must be the number of bytes received so far. Returns
+        the new size of the file
+        """
+        self._check_provider("local")
+        path = self.get_local_path(path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        received = os.path.getsize(path) if os.path.isfile(path) else 0
+        if offset != received:
+            raise ValueError(f"Expected offset:{received}, got:{offset}")
+        with open(path, "ab") as file:
+            shutil.copyfileobj(stream, file, self.CHUNK_SIZE)
+        return os.path.getsize(path)
+
+    def stream_file(self, path, start=0, end=None, chunk_size=None):
+        """
+        Yields the bytes of the file from start to end (inclusive) in chunks,
+        so memory use does not depend on the file size
+
+        Parameters:
+            path (str): path of the file in the provider
+            start (int): first byte
+            end (int): last byte, defaults to the end of the file
+            chunk_size (int): size of the yielded chunks
+        """
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        if not self.does_file_exist(
+            self.get_local_path(path) if self.provider == "local" else path
+        ):
+            raise FileDoesNotExist(f"File:{path} does not exist in {self.provider}")
+
+        if self.provider == "local":
+            return self.stream_local_file(path, start, end, chunk_size)
+        elif self.provider == "s3":
+            return self.stream_s3_file(path, start, end, chunk_size)
+        elif self.provider == "gcs":
+            blob = self.gcs_client.bucket(self.gcs_bucket_name).blob(path)
+            return self.stream_gcs_blob(blob, start, end, chunk_size)
+
+    def send_file(self, path, download_name, mimetype="application/octet-stream"):
+        """
+        Returns a streaming response for the file that honours HTTP Range
+        requests. Local files are sent with send_file, which lets the WSGI
+        server use sendfile() (zero-copy)
+        """
+        if self.provider == "local":
+            path = self.get_local_path(path)
+            if not self.does_local_file_exist(path):
+                raise FileDoesNotExist(f"File:{path} does not exist in local")
+            return send_file(
+                path,
+                mimetype=mimetype,
+                as_attachment=True,
+                download_name=download_name,
+                conditional=True,
+            )
+        if not self.does_file_exist(path):
+            raise FileDoesNotExist(f"File:{path} does not exist in {self.provider}")
+        if self.provider == "s3":
+            stream = lambda start, end: self.stream_s3_file(path, start, end)
+        else:
+            blob = self.gcs_client.bucket(self.gcs_bucket_name).blob(path)
+            stream = lambda start, end: self.stream_gcs_blob(blob, start, end)
+        return self.range_response(
+            self.get_file_size(path),
+            stream,
+            download_name=download_name,
+            mimetype=mimetype,
+        )
+
+    @staticmethod
+    def read_range(file, start=0, end=None, chunk_size=None):
+        """
+        yields the bytes from start to end (inclusive) of a seekable file
+        """
+        chunk_size = chunk_size or FileStorageHandler.CHUNK_SIZE
+        file.seek(start)
+        remaining = None if end is None else end - start + 1
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            if not (chunk := file.read(size)):
+                return
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+
+    @staticmethod
+    def range_response(
+        size, stream, download_name, mimetype="application/octet-stream"
+    ):
+        """
+        Builds a (partial) response for the current request. stream is
+        called with the first and last byte to send and returns an iterator
+        """
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Disposition": content_disposition(download_name),
+        }
+        status = 200
+        start, end = 0, size - 1
+        if request.range and request.range.units == "bytes":
+            if not (byte_range := request.range.range_for_length(size)):
+                headers["Content-Range"] = f"bytes */{size}"
+                return Response(status=416, headers=headers)
+            start, end = byte_range[0], byte_range[1] - 1
+            headers["Content-Range"] = request.range.make_content_range(
+                size
+            ).to_header()
+            status = 206
+        headers["Content-Length"] = str(max(end - start + 1, 0))
+        return Response(
+            stream(start, end) if size else [],
+            status=status,
+            mimetype=mimetype,
+            headers=headers,
+            direct_passthrough=True,
+        )
+
     def does_file_exist(self, abs_path):
         if self.provider == "local":
             return self.does_local_file_exist(abs_path)
@@ -182,15 +574,30 @@ class FileStorageHandler:
             return True
         return False
 
-    def get_local_size(self, folder):
+    def get_local_size(self, folder, recursive=False):
         """
-        Does not calculate sub folders
+        Does not calculate sub folders unless recursive is set
         """
         folder = folder.rstrip(os.sep)
+        pattern = f"{folder}/**/*" if recursive else f"{folder}/*"
         return sum(
-            os.path.getsize(f) for f in glob.glob(f"{folder}/*") if os.path.isfile(f)
+            os.path.getsize(f)
+            for f in glob.glob(pattern, recursive=recursive)
+            if os.path.isfile(f)
         )
 
+    @staticmethod
+    def get_upload_size(file_object):
+        """
+        size in bytes of an uploaded FileStorage without reading it
+        """
+        stream = file_object.stream
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+
     def get_s3_size(self, folder):
         folder = folder.lstrip(os.sep)
         size = 0
@@ -226,7 +633,13 @@ class FileStorageHandler:
         return self.s3_client.delete_object(Bucket=self.s3_bucket_name, Key=path)
 
     def delete_gcs_file(self, path):
-        raise ValueError("Not Implemented")
+        self._check_provider("gcs")
+        blob = self.gcs_client.bucket(self.gcs_bucket_name).blob(path)
+        try:
+            blob.delete()
+        except NotFound:
+            raise Exception(f"File not found for deletion:{path}")
+        return True
 
     # Local Storage Methods
     def upload_to_local(self, file, file_name=None, folder=None, abs_path=None):
@@ -254,14 +667,24 @@ class FileStorageHandler:
             raise ValueError(f"Path is required: {path}")
         return os.listdir(path)
 
+    def get_local_path(self, path):
+        if not path.startswith(current_app.config["EVIDENCE_FOLDER"]):
+            path = os.path.join(current_app.config["EVIDENCE_FOLDER"], path)
+        return path
+
+    def stream_local_file(self, path, start=0, end=None, chunk_size=None):
+        self._check_provider("local")
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        with open(self.get_local_path(path), "rb") as file:
+            yield from self.read_range(file, start, end, chunk_size)
+
     def get_local_file(self, path, as_blob=False):
         self._check_provider("local")
 
         if not self.does_file_exist(path):
             raise FileDoesNotExist(f"File:{path} does not exist in local")
 
-        if not path.startswith(current_app.config["EVIDENCE_FOLDER"]):
-            path = os.path.join(current_app.config["EVIDENCE_FOLDER"], path)
+        path = self.get_local_path(path)
 
         if as_blob:
             with open(path, "rb") as file:
@@ -285,8 +708,8 @@ class FileStorageHandler:
 
         try:
             if isinstance(file, str):
-                if not os.path.isfile(abs_path):
-                    raise ValueError(f"File not found:{abs_path}")
+                if not os.path.isfile(file):
+                    raise ValueError(f"File not found:{file}")
                 self.s3_client.upload_file(file, self.s3_bucket_name, abs_path)
             else:
                 self.s3_client.upload_fileobj(file, self.s3_bucket_name, abs_path)
@@ -327,6 +750,17 @@ class FileStorageHandler:
 
         return self.s3_client.head_object(Bucket=self.s3_bucket_name, Key=path)
 
+    def stream_s3_file(self, path, start=0, end=None, chunk_size=None):
+        self._check_provider("s3")
+        params = {"Bucket": self.s3_bucket_name, "Key": path}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+        body = self.s3_client.get_object(**params)["Body"]
+        try:
+            yield from body.iter_chunks(chunk_size or self.CHUNK_SIZE)
+        finally:
+            body.close()
+
     def list_s3_files(self, path=""):
         self._check_provider("s3")
 
@@ -397,6 +831,12 @@ class FileStorageHandler:
         )
         return gcs_path
 
+    @staticmethod
+    def stream_gcs_blob(blob, start=0, end=None, chunk_size=None):
+        chunk_size = chunk_size or FileStorageHandler.CHUNK_SIZE
+        with blob.open("rb", chunk_size=chunk_size) as file:
+            yield from FileStorageHandler.read_range(file, start, end, chunk_size)
+
     def list_gcs_files(self, path=""):
         self._check_provider("gcs")
 
@@ -0,0 +1,344 @@
+from app import db
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from concurrent.futures import ThreadPoolExecutor
+import shortuuid
+import threading
+import time
+import json
+import os
+import re
+
+SEPARATORS = re.compile(r"[\s,]*")
+
+
+def iter_json_array(path, chunk_size=64 * 1024):
+    """
+    Yields the items of a top-level JSON array one at a time without
+    loading the whole file into memory
+    """
+    decoder = json.JSONDecoder()
+    with open(path) as f:
+        buffer = ""
+        position = 0
+        started = False
+        eof = False
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if position < len(buffer):
+                if not started:
+                    if buffer[position] != "[":
+                        raise ValueError(f"Expected a JSON array in: {path}")
+                    started = True
+                    position += 1
+                    continue
+                if buffer[position] == "]":
+                    return
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # a scalar at the end of the buffer may continue in the next chunk
+                    if end < len(buffer) or eof:
+                        position = end
+                        yield item
+                        continue
+            if eof:
+                if started:
+                    raise ValueError(f"Unterminated JSON array in: {path}")
+                return
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer = buffer[position:] + chunk
+            position = 0
+
+
+def build_control(control, framework, tenant_id):
+    """
+    Maps a control from a framework file to the column values of a Control
+    and its SubControls. See Control.create for the data format
+    """
+    row = {
+        "name": control.get("name"),
+        "description": control.get("description"),
+        "ref_code": control.get("ref_code"),
+        "abs_ref_code": f"{framework.lower()}__{control.get('ref_code')}",
+        "system_level": control.get("system_level"),
+        "category": control.get("category"),
+        "subcategory": control.get("subcategory"),
+        "references": control.get("references"),
+        "level": int(control.get("level", 1)),
+        "guidance": control.get("guidance"),
+        "mapping": control.get("mapping"),
+        "vendor_recommendations": control.get("vendor_recommendations"),
+        "dti": control.get("dti"),
+        "dtc": control.get("dtc"),
+        "meta": control.get("meta", {}),
+        "tenant_id": tenant_id,
+    }
+    """
+    if there are no subcontrols for the control, we are going to add the
+    top-level control itself as the first subcontrol
+    """
+    subcontrols = control.get("subcontrols", [])
+    if not subcontrols:
+        subcontrols = [
+            {
+                "name": row["name"],
+                "description": row["description"],
+                "ref_code": row["ref_code"],
+                "mitigation": control.get(
+                    "mitigation", "The mitigation has not been documented"
+                ),
+                "guidance": control.get("guidance"),
+                "tasks": control.get("tasks"),
+            }
+        ]
+    subcontrol_rows = []
+    for sub in subcontrols:
+        subcontrol_rows.append(
+            {
+                "name": sub.get("name"),
+                "description": sub.get(
+                    "description", "The description has not been documented"
+                ),
+                "ref_code": sub.get("ref_code", row["ref_code"]),
+                "mitigation": sub.get("mitigation"),
+                "guidance": sub.get("guidance"),
+                "implementation_group": sub.get("implementation_group"),
+                "meta": sub.get("meta", {}),
+                "tasks": sub.get("tasks", []),
+            }
+        )
+    return row, subcontrol_rows
+
+
+def with_defaults(table, row):
+    """
+    applies the python side column defaults to a row used in a
+    multi-row insert
+    """
+    for column in table.columns:
+        if column.key in row or column.default is None:
+            continue
+        if column.default.is_callable:
+            row[column.key] = column.default.arg(None)
+        elif column.default.is_scalar:
+            row[column.key] = column.default.arg
+    return row
+
+
+class FrameworkImporter:
+    """
+    Bulk loads the controls of a framework file with multi-row inserts
+
+    Usage:
+        FrameworkImporter(tenant.id).import_framework("soc2")
+        FrameworkImporter(tenant.id).import_frameworks(["soc2", "hipaa_v2"])
+    """
+
+    def __init__(self, tenant_id, batch_size=None):
+        self.tenant_id = tenant_id
+        self.batch_size = batch_size or current_app.config.get(
+            "FRAMEWORK_IMPORT_BATCH_SIZE", 500
+        )
+        self.models = current_app.models
+
+    def get_framework(self, name):
+        Framework = self.models["Framework"]
+        if framework := Framework.find_by_name(name, self.tenant_id):
+            return framework
+        framework = Framework(
+            name=name,
+            description=f"Framework for {name.capitalize()}",
+            feature_evidence=True,
+            tenant_id=self.tenant_id,
+        )
+        db.session.add(framework)
+        db.session.flush()
+        return framework
+
+    def import_framework(self, name, path=None):
+        """
+        inserts the controls and subcontrols of the framework in batches.
+        Bundled frameworks are read from the FrameworkCatalog, a custom path
+        is streamed from disk. Returns the row counts and throughput
+        """
+        Control = self.models["Control"]
+        SubControl = self.models["SubControl"]
+
+        name = name.lower()
+        start = time.perf_counter()
+        framework = self.get_framework(name)
+
+        controls = []
+        subcontrols = []
+        stats = {"framework": name, "controls": 0, "subcontrols": 0}
+
+        def flush():
+            if controls:
+                db.session.execute(Control.__table__.insert().values(controls))
+                stats["controls"] += len(controls)
+            if subcontrols:
+                db.session.execute(SubControl.__table__.insert().values(subcontrols))
+                stats["subcontrols"] += len(subcontrols)
+            controls.clear()
+            subcontrols.clear()
+
+        if path:
+            records = (
+                build_control(record, name, self.tenant_id)
+                for record in iter_json_array(path)
+            )
+        else:
+            records = FrameworkCatalog.get_controls(name)
+
+        for row, subcontrol_rows in records:
+            # rows from the catalog are shared, so we always insert copies
+            control = dict(
+                row,
+                id=str(shortuuid.ShortUUID().random(length=8)).lower(),
+                framework_id=framework.id,
+                tenant_id=self.tenant_id,
+            )
+            controls.append(with_defaults(Control.__table__, control))
+            for sub in subcontrol_rows:
+                subcontrols.append(
+                    with_defaults(
+                        SubControl.__table__, dict(sub, control_id=control["id"])
+                    )
+                )
+            if len(controls) + len(subcontrols) >= self.batch_size:
+                flush()
+        flush()
+        db.session.commit()
+
+        stats["seconds"] = round(time.perf_counter() - start, 3)
+        rows = stats["controls"] + stats["subcontrols"]
+        stats["rows_per_second"] = round(rows / stats["seconds"]) if rows else 0
+        current_app.logger.info(
+            f"Imported framework:{name} for tenant:{self.tenant_id} - "
+            f"{rows} rows in {stats['seconds']}s ({stats['rows_per_second']} rows/sec)"
+        )
+        return stats
+
+    def import_frameworks(self, names, workers=None):
+        """
+        imports several frameworks in parallel. Each worker runs in its own
+        app context and therefore its own database session
+        """
+        workers = workers or current_app.config.get("FRAMEWORK_IMPORT_WORKERS", 4)
+        if workers <= 1 or len(names) <= 1:
+            return [self.import_framework(name) for name in names]
+
+        app = current_app._get_current_object()
+
+        def run(name):
+            with app.app_context():
+                try:
+                    return FrameworkImporter(
+                        self.tenant_id, batch_size=self.batch_size
+                    ).import_framework(name)
+                finally:
+                    db.session.remove()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, names))
+
+
+class FrameworkCatalog:
+    """
+    Process-wide, read-only catalog of the bundled frameworks.
+
+    get_controls parses each file in FRAMEWORK_FOLDER once per process and
+    hands out the same pre-built rows to every caller. get_framework stores
+    each framework once in the database (tenant_id is NULL) so tenants can
+    reference the catalog with Framework.catalog_id instead of copying every
+    Control and SubControl. See Tenant.customize_control for copy-on-write
+    """
+
+    _controls = {}
+    _lock = threading.Lock()
+    _framework_locks = {}
+
+    @classmethod
+    def get_path(cls, name):
+        return os.path.join(
+            current_app.config["FRAMEWORK_FOLDER"], f"{name.lower()}.json"
+        )
+
+    @classmethod
+    def get_controls(cls, name):
+        """
+        returns a tuple of (control row, subcontrol rows) for the framework.
+        The rows are shared and must not be modified
+        """
+        path = cls.get_path(name)
+        modified = os.path.getmtime(path)
+        with cls._lock:
+            cached = cls._controls.get(path)
+        if cached and cached[0] == modified:
+            return cached[1]
+
+        records = tuple(
+            build_control(record, name.lower(), None)
+            for record in iter_json_array(path)
+        )
+        with cls._lock:
+            cls._controls[path] = (modified, records)
+        return records
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._controls.clear()
+
+    @classmethod
+    def find_framework(cls, name):
+        return current_app.models["Framework"].find_by_name(name, None)
+
+    @classmethod
+    def get_framework(cls, name):
+        """
+        returns the catalog Framework and loads its controls on first use
+        """
+        name = name.lower()
+        if framework := cls.find_framework(name):
+            return framework
+        with cls._lock:
+            lock = cls._framework_locks.setdefault(name, threading.Lock())
+        with lock:
+            if not (framework := cls.find_framework(name)):
+                framework = cls.import_framework(name)
+        return framework
+
+    @classmethod
+    def import_framework(cls, name):
+        """
+        the lock above only covers this process. When another process
+        imports the same framework, the unique index on catalog names
+        rejects our insert and we use their framework
+        """
+        try:
+            FrameworkImporter(None).import_framework(name)
+        except IntegrityError:
+            db.session.rollback()
+        return cls.find_framework(name)
+
+    @classmethod
+    def load(cls, names):
+        """
+        loads the catalog frameworks that are not in the database yet,
+        in parallel
+        """
+        missing = [name.lower() for name in names if not cls.find_framework(name)]
+        if missing:
+            try:
+                FrameworkImporter(None).import_frameworks(missing)
+            except IntegrityError:
+                # imported by another process, get_framework finds it
+                db.session.rollback()
+        return [cls.get_framework(name) for name in names]
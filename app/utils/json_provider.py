@@ -0,0 +1,149 @@
+from flask import stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+from datetime import date
+import dataclasses
+import decimal
+import uuid
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def to_json(o):
+    """
+    default for the providers: everything Flask serializes plus
+    SQLAlchemy result rows (session.execute) as objects
+    """
+    if isinstance(o, date):
+        return http_date(o)
+    if isinstance(o, (decimal.Decimal, uuid.UUID)):
+        return str(o)
+    if dataclasses.is_dataclass(o):
+        return dataclasses.asdict(o)
+    if hasattr(o, "__html__"):
+        return str(o.__html__())
+    if isinstance(o, tuple):
+        # named tuples (e.g. Query rows) are arrays in the stdlib encoder
+        return list(o)
+    if hasattr(o, "_mapping"):
+        return dict(o._mapping)
+    if hasattr(o, "keys") and hasattr(o, "items"):
+        return dict(o.items())
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+class AppJSONProvider(DefaultJSONProvider):
+    """
+    Stdlib JSON provider of the app (app.json, used by jsonify). Adds
+    SQLAlchemy rows and streamed arrays for long lists. Use
+    AppJSONProvider.from_config to get the orjson provider when it is
+    installed and enabled with JSON_PROVIDER
+
+    Usage:
+        return current_app.json.stream(
+            project.as_dict() for project in projects
+        )
+    """
+
+    name = "stdlib"
+    default = staticmethod(to_json)
+    # serialize dates as ISO 8601 instead of HTTP dates (JSON_ISO_DATES)
+    iso_dates = False
+    # rows are written to the response in chunks of about this many bytes
+    chunk_size = 64 * 1024
+
+    @staticmethod
+    def from_config(app):
+        if app.config.get("JSON_PROVIDER", "orjson") == "orjson" and orjson:
+            provider = OrjsonProvider(app)
+        else:
+            provider = AppJSONProvider(app)
+        provider.iso_dates = app.config.get("JSON_ISO_DATES", False)
+        return provider
+
+    def dumps(self, obj, **kwargs):
+        if self.iso_dates:
+            kwargs.setdefault("default", self.iso_default)
+        return super().dumps(obj, **kwargs)
+
+    def iso_default(self, o):
+        if isinstance(o, date):
+            return o.isoformat()
+        return self.default(o)
+
+    def dump_item(self, obj):
+        """
+        one compact item of a streamed array, as bytes
+        """
+        return self.dumps(obj, separators=(",", ":")).encode()
+
+    def stream(self, items, status=200):
+        """
+        returns a response that writes the JSON array of items while they
+        are produced, so the whole list is never held in memory. Errors
+        raised by items can not change the status anymore, so validate and
+        authorize before
+        """
+
+        def generate():
+            buffer = [b"["]
+            size = 0
+            for index, item in enumerate(items):
+                data = self.dump_item(item)
+                buffer.append(b"," + data if index else data)
+                size += len(data)
+                if size >= self.chunk_size:
+                    yield b"".join(buffer)
+                    buffer, size = [], 0
+            buffer.append(b"]\n")
+            yield b"".join(buffer)
+
+        return self._app.response_class(
+            stream_with_context(generate()), status=status, mimetype=self.mimetype
+        )
+
+
+class OrjsonProvider(AppJSONProvider):
+    """
+    orjson backed provider with the output of AppJSONProvider (sorted
+    keys, HTTP dates unless JSON_ISO_DATES is set)
+    """
+
+    name = "orjson"
+
+    def get_options(self, indent=False):
+        options = orjson.OPT_NON_STR_KEYS
+        if not self.iso_dates:
+            options |= orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if set(kwargs) - {"indent", "separators"}:
+            # options orjson does not have, e.g. cls
+            return AppJSONProvider.dumps(self, obj, **kwargs)
+        return self.dumps_bytes(obj, indent=bool(kwargs.get("indent"))).decode()
+
+    def dumps_bytes(self, obj, indent=False):
+        return orjson.dumps(obj, default=self.default, option=self.get_options(indent))
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def dump_item(self, obj):
+        return self.dumps_bytes(obj)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            self.dumps_bytes(obj, indent=indent) + b"\n", mimetype=self.mimetype
+        )
@@ -0,0 +1,140 @@
+from app import db
+from flask import current_app
+from app.utils.file_handler import FileStorageHandler
+from sqlalchemy import func, or_, and_
+from datetime import datetime, timedelta
+import tempfile
+import arrow
+import gzip
+import json
+import os
+
+
+class LogArchiver:
+    """
+    Monthly rollover for the logs table. Every calendar month that ended
+    before the retention window is exported to a gzip compressed NDJSON
+    file through the FileStorageHandler and then deleted in batches.
+
+    Usage:
+        LogArchiver(retention_days=365).run()
+    """
+
+    def __init__(self, retention_days=None, batch_size=None, provider=None):
+        self.retention_days = int(
+            retention_days or current_app.config.get("LOG_RETENTION_DAYS", 365)
+        )
+        self.batch_size = int(
+            batch_size or current_app.config.get("LOG_ARCHIVE_BATCH_SIZE", 5000)
+        )
+        self.provider = provider or current_app.config["STORAGE_METHOD"]
+        self.Logs = current_app.models["Logs"]
+
+    def get_folder(self):
+        if self.provider != "local":
+            return "logs"
+        folder = os.path.join(current_app.config["EVIDENCE_FOLDER"], "logs")
+        os.makedirs(folder, exist_ok=True)
+        return folder
+
+    def get_cutoff(self):
+        return datetime.utcnow() - timedelta(days=self.retention_days)
+
+    def expired_months(self):
+        """
+        returns the first day of every month that ended before the cutoff
+        and still has logs
+        """
+        Logs = self.Logs
+        cutoff = (
+            arrow.get(self.get_cutoff()).floor("month").datetime.replace(tzinfo=None)
+        )
+        oldest = db.session.query(func.min(Logs.date_added)).scalar()
+        if not oldest or oldest >= cutoff:
+            return []
+        months = []
+        month = arrow.get(oldest).floor("month")
+        while month.datetime.replace(tzinfo=None) < cutoff:
+            months.append(month.datetime.replace(tzinfo=None))
+            month = month.shift(months=1)
+        return months
+
+    def iter_rows(self, start, end):
+        """
+        yields the logs of [start, end) in batches with keyset pagination
+        """
+        Logs = self.Logs
+        table = Logs.__table__
+        last = None
+        while True:
+            _query = (
+                db.session.query(table)
+                .filter(Logs.date_added >= start, Logs.date_added < end)
+                .order_by(Logs.date_added, Logs.id)
+            )
+            if last:
+                _query = _query.filter(
+                    or_(
+                        Logs.date_added > last.date_added,
+                        and_(Logs.date_added == last.date_added, Logs.id > last.id),
+                    )
+                )
+            rows = _query.limit(self.batch_size).all()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1]
+
+    def delete_rows(self, start, end):
+        Logs = self.Logs
+        deleted = 0
+        while True:
+            ids = (
+                db.session.query(Logs.id)
+                .filter(Logs.date_added >= start, Logs.date_added < end)
+                .limit(self.batch_size)
+                .subquery()
+            )
+            count = Logs.query.filter(Logs.id.in_(ids)).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+            deleted += count
+            if count < self.batch_size:
+                return deleted
+
+    def archive_month(self, start):
+        end = arrow.get(start).shift(months=1).datetime.replace(tzinfo=None)
+        file_name = f"logs-{start:%Y-%m}-{datetime.utcnow():%Y%m%d%H%M%S}.ndjson.gz"
+        path = os.path.join(tempfile.mkdtemp(), file_name)
+        count = 0
+        try:
+            with gzip.open(path, "wt") as f:
+                for row in self.iter_rows(start, end):
+                    f.write(json.dumps(dict(row._asdict()), default=str) + "\n")
+                    count += 1
+            if not count:
+                return {"month": f"{start:%Y-%m}", "archived": 0, "deleted": 0}
+            archive = FileStorageHandler(provider=self.provider).upload_file(
+                path, file_name=file_name, folder=self.get_folder()
+            )
+            if not archive:
+                raise ValueError(f"Failed to upload log archive: {file_name}")
+        finally:
+            if os.path.isfile(path):
+                os.remove(path)
+            os.rmdir(os.path.dirname(path))
+
+        deleted = self.delete_rows(start, end)
+        current_app.logger.info(
+            f"Archived {count} logs of {start:%Y-%m} to {archive} and deleted {deleted}"
+        )
+        return {
+            "month": f"{start:%Y-%m}",
+            "archived": count,
+            "deleted": deleted,
+            "path": archive,
+        }
+
+    def run(self):
+        return [self.archive_month(month) for month in self.expired_months()]
@@ -0,0 +1,122 @@
+from app import db
+from flask import current_app
+
+
+class MembershipDirectory:
+    """
+    Members of a tenant with their roles, loaded with two queries and
+    kept in memory. Project access levels and assessment guests are
+    joined against it with one query each, instead of looking up every
+    member separately
+
+    Usage:
+        directory = MembershipDirectory(tenant)
+        directory.get_members()
+        directory.get_project_members(project)
+        directory.get_available_guests(assessment)
+    """
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.models = current_app.models
+        self._members = None
+
+    @property
+    def members(self):
+        """
+        returns [(user dict, role names)] for every member of the tenant
+        """
+        if self._members is None:
+            self._members = self.load_members()
+        return self._members
+
+    def load_members(self):
+        User = self.models["User"]
+        TenantMember = self.models["TenantMember"]
+        TenantMemberRole = self.models["TenantMemberRole"]
+        Role = self.models["Role"]
+
+        columns = [c for c in User.__table__.columns if c.name != "password"]
+        rows = (
+            db.session.query(TenantMember.id.label("member_id"), *columns)
+            .join(User, User.id == TenantMember.user_id)
+            .filter(TenantMember.tenant_id == self.tenant.id)
+            .order_by(User.email)
+            .all()
+        )
+        roles = {}
+        for member_id, name in (
+            db.session.query(TenantMemberRole.tenant_member_id, Role.name)
+            .join(Role, Role.id == TenantMemberRole.role_id)
+            .join(
+                TenantMember,
+                TenantMember.id == TenantMemberRole.tenant_member_id,
+            )
+            .filter(TenantMember.tenant_id == self.tenant.id)
+            .all()
+        ):
+            roles.setdefault(member_id, []).append(name)
+
+        members = []
+        for row in rows:
+            user = {c.name: getattr(row, c.name) for c in columns}
+            members.append((user, roles.get(row.member_id, [])))
+        return members
+
+    def get_members(self):
+        """
+        records of Tenant.get_members(), without the password hash
+        """
+        data = []
+        for user, roles in self.members:
+            record = {**user, "roles": roles}
+            if "vendor" in roles:
+                record["is_vendor"] = True
+            data.append(record)
+        return data
+
+    def get_project_access(self, project):
+        """
+        returns {user_id: access_level} of the project members
+        """
+        ProjectMember = self.models["ProjectMember"]
+        return dict(
+            db.session.query(ProjectMember.user_id, ProjectMember.access_level)
+            .filter(ProjectMember.project_id == project.id)
+            .all()
+        )
+
+    def get_project_members(self, project):
+        """
+        returns the tenant members with their access to the project
+        """
+        access = self.get_project_access(project)
+        data = []
+        for user, roles in self.members:
+            record = {"id": user["id"], "email": user["email"], "member": False}
+            if user["id"] in access:
+                record["member"] = True
+                record["access_level"] = access[user["id"]]
+            data.append(record)
+        return data
+
+    def get_guest_ids(self, assessment):
+        AssessmentGuest = self.models["AssessmentGuest"]
+        return {
+            row.user_id
+            for row in db.session.query(AssessmentGuest.user_id)
+            .filter(AssessmentGuest.assessment_id == assessment.id)
+            .all()
+        }
+
+    def get_available_guests(self, assessment):
+        """
+        returns the members with the vendor role, marked with access:True
+        when they are already a guest of the assessment
+        """
+        guests = self.get_guest_ids(assessment)
+        return [
+            {"id": user["id"], "email": user["email"], "access": user["id"] in guests}
+            for user, roles in self.members
+            if "vendor" in roles
+        ]
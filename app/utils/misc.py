@@ -40,13 +40,13 @@ def perform_pwd_checks(password, password_two=None):
     return True
 
 
-def verify_jwt(token):
+def verify_jwt(token, return_header=False):
     if not token:
         current_app.logger.warning("Empty token when verifying JWT")
         return False
     s = Serializer(current_app.config["SECRET_KEY"])
     try:
-        data = s.loads(token)
+        data = s.loads(token, return_header=return_header)
     except SignatureExpired:
         current_app.logger.warning("SignatureExpired while verifying JWT")
         return False
@@ -92,6 +92,7 @@ def project_creation(tenant, payload, user):
     # check if framework has initialized controls
     if not framework.has_controls():
         framework.init_controls()
+    framework_controls = framework.get_controls(as_query=True)
 
     if fw_name == "soc2":
         category_list = []
@@ -111,8 +112,7 @@ def project_creation(tenant, payload, user):
         for category in category_list:
             filter_list.append(models.Control.category == category)
         controls = (
-            models.Control.query.filter(or_(*filter_list))
-            .filter(models.Control.framework_id == framework.id)
+            framework_controls.filter(or_(*filter_list))
             .filter(models.Control.is_custom == False)
             .all()
         )
@@ -133,11 +133,7 @@ def project_creation(tenant, payload, user):
         filter_list = []
         for level in level_list:
             filter_list.append(models.Control.level == level)
-        controls = (
-            models.Control.query.filter(or_(*filter_list))
-            .filter(models.Control.framework_id == framework.id)
-            .all()
-        )
+        controls = framework_controls.filter(or_(*filter_list)).all()
     elif fw_name == "cmmc_v2":
         level_list = []
         if payload.get("level-1"):
@@ -151,17 +147,9 @@ def project_creation(tenant, payload, user):
         filter_list = []
         for level in level_list:
             filter_list.append(models.Control.level == level)
-        controls = (
-            models.Control.query.filter(or_(*filter_list))
-            .filter(models.Control.framework_id == framework.id)
-            .all()
-        )
+        controls = framework_controls.filter(or_(*filter_list)).all()
     else:
-        controls = (
-            models.Control.query.filter(models.Control.framework_id == framework.id)
-            .order_by(models.Control.id.asc())
-            .all()
-        )
+        controls = framework_controls.order_by(models.Control.id.asc()).all()
 
     tenant.create_project(
         name, user.id, framework.id, description=description, controls=controls
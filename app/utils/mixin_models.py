@@ -4,6 +4,8 @@ from sqlalchemy.ext.declarative import declared_attr
 from functools import partial
 from app.utils.authorizer import Authorizer
 from sqlalchemy import func
+from sqlalchemy.orm import undefer
+from app.utils.evidence_index import EvidenceIndex
 import arrow
 
 
@@ -66,7 +68,19 @@ class ControlMixin(object):
             subcontrols = self.subcontrols.order_by(
                 current_app.models["ProjectSubControl"].date_added.desc()
             ).all()
-        feedback = self.get_feedback()
+        return self.summarize_stats(
+            subcontrols=[subcontrol.as_dict() for subcontrol in subcontrols],
+            feedback=self.get_feedback(as_dict=True),
+            tags=[{"id": tag.id, "name": tag.name} for tag in self.tags.all()],
+            comments=self.get_comments(),
+        )
+
+    def summarize_stats(self, subcontrols, feedback, tags, comments):
+        """
+        builds the control stats from already serialized subcontrols,
+        feedback, tags and comments. See app.utils.control_stats for
+        loading these in bulk for an entire project
+        """
         data = {
             "description": self.control.description,
             "guidance": self.control.guidance,
@@ -77,14 +91,14 @@ class ControlMixin(object):
             "progress_completed": 0,
             "progress_implemented": 0,
             "progress_evidence": 0,
-            "feedback": self.get_feedback(as_dict=True),
+            "feedback": feedback,
             "subcontrols": [],
             "owners": [],
-            "tags": [{"id": tag.id, "name": tag.name} for tag in self.tags.all()],
-            "comments": self.get_comments(),
+            "tags": tags,
+            "comments": comments,
             "stats": {
                 "feedback": len(feedback),
-                "complete_feedback": sum(1 for task in feedback if task.is_complete),
+                "complete_feedback": sum(1 for task in feedback if task["is_complete"]),
                 "evidence": 0,
                 "subcontrols": len(subcontrols),
                 "subcontrols_complete": 0,
@@ -99,9 +113,8 @@ class ControlMixin(object):
         implemented = 0
         completed = 0
         evidence = 0
-        for subcontrol in subcontrols:
-            sub = subcontrol.as_dict()
-            if subcontrol.owner_id:
+        for sub in subcontrols:
+            if sub["owner_id"]:
                 data["owners"].append(sub["owner"])
                 data["stats"]["owners"] += 1
 
@@ -179,9 +192,32 @@ class ControlMixin(object):
     def set_applicability(self, applicable):
         for subcontrol in self.subcontrols.all():
             subcontrol.is_applicable = applicable
+        db.session.flush()
+        current_app.models["ControlProgress"].refresh(self.id)
         db.session.commit()
         return True
 
+    def get_progress(self):
+        """
+        returns the ControlProgress rollup for the control. Without a stored
+        rollup (see manage.py reconcile_progress) an unsaved one is computed,
+        so reads never write
+        """
+        ControlProgress = current_app.models["ControlProgress"]
+        ProjectSubControl = current_app.models["ProjectSubControl"]
+        if progress := ControlProgress.query.filter(
+            ControlProgress.project_control_id == self.id
+        ).first():
+            return progress
+        progress = ControlProgress(
+            project_control_id=self.id, project_id=self.project_id
+        )
+        summaries = ControlProgress.summarize(
+            ProjectSubControl.project_control_id == self.id
+        )
+        progress.set_counters(summaries[0] if summaries else None)
+        return progress
+
     def status(self):
         """
         If an auditor is added to the project, then the auditor must set the review_status to complete
@@ -205,16 +241,14 @@ class ControlMixin(object):
         return "not started"
 
     def is_complete(self):
-        if self.query_subcontrols(filter="uncomplete"):
-            return False
-        return True
+        return self.get_progress().is_complete()
 
     def is_applicable(self):
-        if self.query_subcontrols():
-            return True
-        return False
+        return self.get_progress().is_applicable()
 
     def progress(self, filter):
+        if filter == "with_evidence":
+            return self.get_progress().evidence_progress()
         count = self.query_subcontrols(filter=filter)
         if not count:
             return 0
@@ -224,11 +258,10 @@ class ControlMixin(object):
         total_progress = 0
         applicable_subcontrols = 0
         if not subcontrols:
-            subcontrols = self.get_subcontrols()
-
-        # If there are no applicable subcontrols, we will return 100% completion
-        if not subcontrols:
-            return default
+            progress = self.get_progress()
+            if not progress.is_applicable():
+                return default
+            return progress.completed_progress()
 
         for subcontrol in subcontrols:
             if not subcontrol.is_applicable:
@@ -240,13 +273,7 @@ class ControlMixin(object):
         return round(total_progress / applicable_subcontrols, 0)
 
     def implemented_progress(self):
-        total = 0
-        subcontrols = self.query_subcontrols()
-        if not subcontrols:
-            return total
-        for control in subcontrols:
-            total += control.implemented or 0
-        return round((total / len(subcontrols)), 0)
+        return self.get_progress().implemented_progress()
 
     def query_subcontrols(self, filter=None, only_applicable=True):
         """
@@ -297,64 +324,79 @@ class SubControlMixin(object):
 
     def as_dict(self, include_evidence=False):
         User = current_app.models["User"]
+        return self.serialize(
+            evidence=self.get_evidence(as_dict=True),
+            owner=User.query.get(self.owner_id).email if self.owner_id else None,
+            operator=(
+                User.query.get(self.operator_id).email if self.operator_id else None
+            ),
+            framework=self.framework().name,
+            project=self.p_control.project.name,
+        )
+
+    def serialize(self, evidence, owner, operator, framework, project):
+        """
+        builds the subcontrol dict from already loaded relations so
+        callers can resolve evidence and users in bulk
+        """
+        has_evidence = bool(evidence)
         data = {c.name: getattr(self, c.name) for c in self.__table__.columns}
         data["implementation_status"] = self.implementation_status()
-        data["completion_status"] = self.completion_description()
-        data["progress_completed"] = self.get_completion_progress()
-        data["is_complete"] = self.is_complete()
-        data["framework"] = self.framework().name
-        data["project"] = self.p_control.project.name
+        data["completion_status"] = self.completion_description(
+            has_evidence=has_evidence
+        )
+        data["progress_completed"] = self.get_completion_progress(
+            has_evidence=has_evidence
+        )
+        data["is_complete"] = self.is_complete(has_evidence=has_evidence)
+        data["framework"] = framework
+        data["project"] = project
         data["parent_control"] = self.p_control.control.name
         data["name"] = self.subcontrol.name
         data["description"] = self.subcontrol.description
         data["mitigation"] = self.subcontrol.mitigation
         data["ref_code"] = self.subcontrol.ref_code
         data["guidance"] = self.subcontrol.guidance
-        data["evidence"] = self.evidence.count()
-
-        data["owner"] = (
-            User.query.get(self.owner_id).email if self.owner_id else "Missing Owner"
-        )
-        data["operator"] = (
-            User.query.get(self.operator_id).email
-            if self.operator_id
-            else "Missing Operator"
-        )
-        data["evidence"] = self.get_evidence(as_dict=True)
-        data["has_evidence"] = False
-        if data["evidence"]:
-            data["has_evidence"] = True
+        data["owner"] = owner or "Missing Owner"
+        data["operator"] = operator or "Missing Operator"
+        data["evidence"] = evidence
+        data["has_evidence"] = has_evidence
         return data
 
     def get_evidence(self, as_dict=False):
-        query = self.evidence.all()
         if as_dict:
-            return [evidence.as_dict() for evidence in query]
-        return query
+            Evidence = current_app.models["ProjectEvidence"]
+            return EvidenceIndex().serialize(
+                self.evidence.options(undefer(Evidence.content)).all()
+            )
+        return self.evidence.all()
 
-    def get_completion_progress(self):
+    def get_completion_progress(self, has_evidence=None):
         if not self.is_applicable:
             return 0
 
-        has_evidence = 100 if self.has_evidence() else 0
+        if has_evidence is None:
+            has_evidence = self.has_evidence()
 
         # Base progress is the implementation percentage
         implemented_adjusted = self.implemented
 
         # If no evidence, reduce implemented progress by 25%
-        if not self.has_evidence():
+        if not has_evidence:
             implemented_adjusted *= 0.75
 
         # Ensure that having evidence alone contributes some progress
-        return max(implemented_adjusted, has_evidence * 0.25)
+        return max(implemented_adjusted, (100 if has_evidence else 0) * 0.25)
 
-    def completion_description(self):
+    def completion_description(self, has_evidence=None):
         text = ""
         if not self.is_applicable:
             return "Control is not applicable."
+        if has_evidence is None:
+            has_evidence = self.has_evidence()
         implemented_status = str(self.implementation_status())
         text += f"Control is {implemented_status}"
-        if self.has_evidence():
+        if has_evidence:
             text += " and has evidence attached."
         else:
             text += " but is missing evidence."
@@ -379,10 +421,12 @@ class SubControlMixin(object):
             return "fully implemented"
         return "partially implemented"
 
-    def is_complete(self):
+    def is_complete(self, has_evidence=None):
         if self.implemented != 100:
             return False
-        if not self.has_evidence():
+        if has_evidence is None:
+            has_evidence = self.has_evidence()
+        if not has_evidence:
             return False
         return True
 
@@ -403,6 +447,7 @@ class SubControlMixin(object):
         EvidenceAssociation.query.filter(
             EvidenceAssociation.control_id == self.id
         ).delete()
+        current_app.models["ControlProgress"].refresh(self.project_control_id)
         db.session.commit()
         return True
 
@@ -415,6 +460,8 @@ class SubControlMixin(object):
         for id in evidence_id_list:
             if evidence := Evidence.query.get(id):
                 self.evidence.append(evidence)
+        db.session.flush()
+        current_app.models["ControlProgress"].refresh(self.project_control_id)
         db.session.commit()
         return True
 
@@ -0,0 +1,100 @@
+from collections import OrderedDict
+import threading
+import re
+
+# {name} placeholders. Anything else in braces (CSS, JSON, attribute or
+# index access) is not a placeholder and is left as it is
+PLACEHOLDER = re.compile(r"\{([A-Za-z_][\w-]*)\}")
+
+
+class PolicyRenderer:
+    """
+    Renders policy versions to HTML. The placeholders of a version are
+    parsed once per (version id, last update) and the rendered HTML is
+    cached with LRU eviction. Callers put everything the output depends on
+    (e.g. the label revision of the tenant) in the cache key, so changed
+    versions and labels are rendered again without explicit invalidation
+
+    Usage:
+        html = app.policy_renderer.render(
+            key, template_key, get_content, get_variables
+        )
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._templates = OrderedDict()
+        self._rendered = OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {"hits": 0, "misses": 0, "compiled": 0}
+
+    @staticmethod
+    def from_config(app):
+        return PolicyRenderer(maxsize=app.config.get("POLICY_RENDER_CACHE_SIZE", 256))
+
+    def compile(self, content):
+        """
+        returns the parts of the content: literal text at even and
+        placeholder names at odd positions
+        """
+        return PLACEHOLDER.split(content or "")
+
+    def format(self, parts, variables):
+        """
+        substitutes the placeholders found in variables, unknown
+        placeholders are kept verbatim
+        """
+        output = []
+        for index, part in enumerate(parts):
+            if index % 2 == 0:
+                output.append(part)
+            elif part in variables:
+                output.append(str(variables[part]))
+            else:
+                output.append(f"{{{part}}}")
+        return "".join(output)
+
+    def render(self, key, template_key, get_content, get_variables):
+        """
+        returns the cached HTML for key. On a miss the content is compiled
+        (once per template_key) and formatted with get_variables()
+        """
+        with self._lock:
+            if (html := self._rendered.get(key)) is not None:
+                self._rendered.move_to_end(key)
+                self._metrics["hits"] += 1
+                return html
+            self._metrics["misses"] += 1
+            parts = self._templates.get(template_key)
+            if parts is not None:
+                self._templates.move_to_end(template_key)
+
+        if parts is None:
+            parts = self.compile(get_content())
+            with self._lock:
+                self._metrics["compiled"] += 1
+                self._put(self._templates, template_key, parts)
+
+        html = self.format(parts, get_variables())
+        with self._lock:
+            self._put(self._rendered, key, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+            self._rendered.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._metrics,
+                "templates": len(self._templates),
+                "rendered": len(self._rendered),
+            }
+
+    def _put(self, cache, key, value):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > self.maxsize:
+            cache.popitem(last=False)
@@ -0,0 +1,177 @@
+from app import db
+from flask import current_app
+from sqlalchemy import func, case, literal, or_, select, union_all
+from sqlalchemy.orm import contains_eager, joinedload
+from app.utils.control_stats import ControlStats
+
+
+class ResponsibilityMatrix:
+    """
+    Owner and operator assignments of the subcontrols in a project. Counts
+    and assignments are computed with grouped queries and every user is
+    resolved with a single query, so the number of queries does not grow
+    with the size of the project
+
+    Usage:
+        ResponsibilityMatrix(project).get_summary()
+        ResponsibilityMatrix(project).get_assignments(user_id, expand=False)
+    """
+
+    ROLES = ["owner", "operator"]
+
+    def __init__(self, project):
+        self.project = project
+        self.models = current_app.models
+
+    def get_summary(self):
+        """
+        returns the number of subcontrols owned and operated by each user
+        """
+        ProjectSubControl = self.models["ProjectSubControl"]
+        table = ProjectSubControl.__table__
+        in_project = table.c.project_id == self.project.id
+
+        grouped = [
+            select(
+                [
+                    literal(role).label("role"),
+                    table.c[f"{role}_id"].label("user_id"),
+                    func.count().label("subcontrols"),
+                ]
+            )
+            .where(in_project)
+            .where(table.c[f"{role}_id"].isnot(None))
+            .group_by(table.c[f"{role}_id"])
+            for role in self.ROLES
+        ]
+        counts = db.session.execute(union_all(*grouped)).fetchall()
+        users = ControlStats(self.project).query_users({row.user_id for row in counts})
+
+        data = {
+            "total": db.session.query(func.count(table.c.id))
+            .filter(in_project)
+            .scalar(),
+            "owners": [],
+            "operators": [],
+        }
+        for row in counts:
+            if row.user_id not in users:
+                continue
+            data[f"{row.role}s"].append(
+                {
+                    "email": users[row.user_id],
+                    "user_id": row.user_id,
+                    "subcontrols": row.subcontrols,
+                }
+            )
+        return data
+
+    def status(self):
+        """
+        SQL version of SubControlMixin.implementation_status
+        """
+        ProjectSubControl = self.models["ProjectSubControl"]
+        implemented = func.coalesce(ProjectSubControl.implemented, 0)
+        return case(
+            [
+                (ProjectSubControl.is_applicable.isnot(True), "not applicable"),
+                (implemented == 0, "not implemented"),
+                (implemented == 100, "fully implemented"),
+            ],
+            else_="partially implemented",
+        )
+
+    def get_assignments(self, user_id, expand=False):
+        """
+        returns the subcontrols owned and operated by the user (or the
+        unassigned ones when user_id is None) as compact rows. With
+        expand=True the rows match SubControlMixin.as_dict()
+        """
+        if expand:
+            return self.get_expanded_assignments(user_id)
+
+        ProjectSubControl = self.models["ProjectSubControl"]
+        SubControl = self.models["SubControl"]
+        data = {role: [] for role in self.ROLES}
+        for row in (
+            db.session.query(
+                ProjectSubControl.id,
+                SubControl.ref_code,
+                SubControl.name,
+                self.status().label("status"),
+                ProjectSubControl.owner_id,
+                ProjectSubControl.operator_id,
+            )
+            .join(SubControl, SubControl.id == ProjectSubControl.subcontrol_id)
+            .filter(ProjectSubControl.project_id == self.project.id)
+            .filter(self.assigned_to(user_id))
+            .order_by(SubControl.ref_code, ProjectSubControl.id)
+            .all()
+        ):
+            record = {
+                "id": row.id,
+                "ref_code": row.ref_code,
+                "name": row.name,
+                "status": row.status,
+            }
+            for role in self.ROLES:
+                if getattr(row, f"{role}_id") == user_id:
+                    data[role].append(record)
+        return data
+
+    def get_expanded_assignments(self, user_id):
+        ProjectSubControl = self.models["ProjectSubControl"]
+        ProjectControl = self.models["ProjectControl"]
+        SubControl = self.models["SubControl"]
+        Control = self.models["Control"]
+
+        subcontrols = (
+            ProjectSubControl.query.join(
+                SubControl, SubControl.id == ProjectSubControl.subcontrol_id
+            )
+            .options(
+                contains_eager(ProjectSubControl.subcontrol),
+                joinedload(ProjectSubControl.p_control)
+                .joinedload(ProjectControl.control)
+                .joinedload(Control.framework),
+            )
+            .filter(ProjectSubControl.project_id == self.project.id)
+            .filter(self.assigned_to(user_id))
+            .order_by(SubControl.ref_code, ProjectSubControl.id)
+            .all()
+        )
+        data = {role: [] for role in self.ROLES}
+        if not subcontrols:
+            return data
+
+        stats = ControlStats(self.project)
+        evidence = stats.query_evidence()
+        user_ids = set()
+        for sub in subcontrols:
+            user_ids.update([sub.owner_id, sub.operator_id])
+        users = stats.query_users(user_ids)
+
+        for sub in subcontrols:
+            record = sub.serialize(
+                evidence=evidence.get(sub.id, []),
+                owner=users.get(sub.owner_id),
+                operator=users.get(sub.operator_id),
+                framework=sub.framework().name,
+                project=self.project.name,
+            )
+            for role in self.ROLES:
+                if getattr(sub, f"{role}_id") == user_id:
+                    data[role].append(record)
+        return data
+
+    def assigned_to(self, user_id):
+        ProjectSubControl = self.models["ProjectSubControl"]
+        if user_id is None:
+            return or_(
+                ProjectSubControl.owner_id.is_(None),
+                ProjectSubControl.operator_id.is_(None),
+            )
+        return or_(
+            ProjectSubControl.owner_id == user_id,
+            ProjectSubControl.operator_id == user_id,
+        )
@@ -0,0 +1,577 @@
+from app import db
+from flask import current_app
+from sqlalchemy import func, select, literal, null, and_, or_
+from sqlalchemy.dialects.postgresql import insert
+from functools import reduce
+import threading
+import math
+import re
+
+TOKENS = re.compile(r"\w+")
+TAGS = re.compile(r"<[^>]+>")
+# the most common words of the english text search configuration
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have if in into is it its "
+    "no not of on or such that the their then there these they this to "
+    "was were will with".split()
+)
+
+
+def concat(*columns):
+    """
+    the columns joined with spaces, NULL is skipped (works on every dialect)
+    """
+    return reduce(
+        lambda text, column: text.op("||")(literal(" ")).op("||")(
+            func.coalesce(column, "")
+        ),
+        columns[1:],
+        func.coalesce(columns[0], ""),
+    )
+
+
+def tokenize(text):
+    return [
+        token
+        for token in TOKENS.findall(TAGS.sub(" ", text or "").lower())
+        if token not in STOPWORDS
+    ]
+
+
+class InvertedIndex:
+    """
+    In-process inverted index over the search documents of a tenant, used
+    when the database has no full-text search (SQLite). It is built from
+    search_documents on first use and again when the documents of the
+    tenant changed (row count or last update, or a write in this process)
+
+    Usage:
+        InvertedIndex.for_tenant(session, table, tenant_id).search(text)
+    """
+
+    # ts_rank weights of the title (A) and the body (B)
+    WEIGHTS = {"title": 1.0, "body": 0.4}
+    _tenants = {}
+    _lock = threading.Lock()
+
+    def __init__(self, signature, rows):
+        self.signature = signature
+        self.documents = {}
+        self.postings = {}
+        for row in rows:
+            key = (row.kind, row.object_id)
+            self.documents[key] = row
+            for field, weight in self.WEIGHTS.items():
+                for token in tokenize(getattr(row, field)):
+                    postings = self.postings.setdefault(token, {})
+                    postings[key] = postings.get(key, 0) + weight
+
+    @classmethod
+    def for_tenant(cls, session, table, tenant_id):
+        signature = tuple(
+            session.execute(
+                select([func.count(), func.max(table.c.date_updated)]).where(
+                    table.c.tenant_id == tenant_id
+                )
+            ).first()
+        )
+        with cls._lock:
+            index = cls._tenants.get(tenant_id)
+        if index is None or index.signature != signature:
+            rows = session.execute(
+                select(
+                    [
+                        table.c.kind,
+                        table.c.object_id,
+                        table.c.project_id,
+                        table.c.title,
+                        table.c.body,
+                    ]
+                ).where(table.c.tenant_id == tenant_id)
+            ).fetchall()
+            index = cls(signature, rows)
+            with cls._lock:
+                cls._tenants[tenant_id] = index
+        return index
+
+    @classmethod
+    def clear(cls):
+        with cls._lock:
+            cls._tenants.clear()
+
+    @staticmethod
+    def parse(text):
+        """
+        returns the (required, excluded) terms, "-term" excludes a term
+        """
+        required, excluded = [], []
+        for word in (text or "").split():
+            terms = excluded if word.startswith("-") else required
+            terms.extend(tokenize(word))
+        return required, excluded
+
+    def search(self, text, allowed=None):
+        """
+        returns [(row, rank)] of the documents with every required term,
+        best first. allowed(row) filters the documents
+        """
+        required, excluded = self.parse(text)
+        if not required:
+            return []
+        matches = None
+        for term in required:
+            keys = set(self.postings.get(term, {}))
+            matches = keys if matches is None else matches & keys
+        for term in excluded:
+            matches -= set(self.postings.get(term, {}))
+
+        total = len(self.documents)
+        results = []
+        for key in matches:
+            row = self.documents[key]
+            if allowed and not allowed(row):
+                continue
+            rank = sum(
+                self.postings[term][key]
+                * math.log(1 + total / len(self.postings[term]))
+                for term in set(required)
+            )
+            results.append((row, rank))
+        results.sort(
+            key=lambda result: (-result[1], result[0].kind, result[0].object_id)
+        )
+        return results
+
+    def headline(self, text, query, max_words=20):
+        """
+        ts_headline for the fallback: the words around the first match
+        with the matches in <b></b>
+        """
+        terms = set(self.parse(query)[0])
+        words = TAGS.sub(" ", text or "").split()
+        first = next(
+            (i for i, word in enumerate(words) if set(tokenize(word)) & terms), 0
+        )
+        start = max(first - max_words // 4, 0)
+        return " ".join(
+            f"<b>{word}</b>" if set(tokenize(word)) & terms else word
+            for word in words[start : start + max_words]
+        )
+
+
+class SearchIndex:
+    """
+    Tenant scoped full-text search over SearchDocument. Every indexed row
+    (see KINDS) has one document. Controls and subcontrols are indexed per
+    project (ProjectControl, ProjectSubControl), so shared catalog
+    controls get the tenant and project of the projects using them.
+    Documents are built in SQL with INSERT ... SELECT, so single rows (on
+    flush, see the session listener in app.models), new projects and
+    tenants use the same statements.
+
+    On Postgres the upsert stores a weighted tsvector (title A, body B)
+    with a GIN index and search() ranks with ts_rank_cd. Other databases
+    (SQLite in tests) search an InvertedIndex in the process instead
+
+    Usage:
+        SearchIndex().refresh({"evidence": {evidence_id}})
+        SearchIndex().reindex(tenant_id)
+        SearchIndex().search(tenant_id, "access review", scope)
+    """
+
+    # kind -> model of the indexed rows
+    KINDS = {
+        "control": "ProjectControl",
+        "subcontrol": "ProjectSubControl",
+        "evidence": "ProjectEvidence",
+        "policy": "ProjectPolicy",
+        "vendor": "Vendor",
+        "risk": "RiskRegister",
+    }
+    # kind -> model whose changes refresh the documents of the kind
+    SOURCES = {"control": "Control", "subcontrol": "SubControl"}
+    COLUMNS = ["tenant_id", "project_id", "kind", "object_id", "title", "body"]
+    MAX_LIMIT = 100
+
+    def __init__(self, session=None):
+        self.session = session or db.session
+        self.models = current_app.models
+        self.dialect = self.session.get_bind().dialect.name
+
+    @property
+    def table(self):
+        return self.models["SearchDocument"].__table__
+
+    @property
+    def has_fulltext(self):
+        return self.dialect == "postgresql"
+
+    @staticmethod
+    def get_refs(objects):
+        """
+        returns ({kind: {ids}} of the indexed objects, {kind: {ids}} of
+        the controls and subcontrols they are built from). A changed
+        policy version refreshes its policy
+        """
+        models = current_app.models
+        kinds = {models[name]: kind for kind, name in SearchIndex.KINDS.items()}
+        sources = {models[name]: kind for kind, name in SearchIndex.SOURCES.items()}
+        refs, source_refs = {}, {}
+        for obj in objects:
+            if kind := kinds.get(type(obj)):
+                refs.setdefault(kind, set()).add(obj.id)
+            elif kind := sources.get(type(obj)):
+                source_refs.setdefault(kind, set()).add(obj.id)
+            elif isinstance(obj, models["PolicyVersion"]) and obj.policy_id:
+                refs.setdefault("policy", set()).add(obj.policy_id)
+        return refs, source_refs
+
+    def strip_tags(self, column):
+        if self.has_fulltext:
+            return func.regexp_replace(column, "<[^>]+>", " ", "g")
+        # the InvertedIndex drops the tags while tokenizing
+        return column
+
+    def select_documents(self, kind, ids=None, tenant_id=None, source_ids=None):
+        """
+        select of (tenant_id, project_id, kind, object_id, title, body) for
+        the rows of kind. source_ids selects the controls (subcontrols) of
+        the projects that use the given Control (SubControl) ids
+        """
+        tables = {
+            name: self.models[name].__table__
+            for name in [
+                *self.KINDS.values(),
+                *self.SOURCES.values(),
+                "Project",
+                "PolicyVersion",
+            ]
+        }
+        projects = tables["Project"]
+
+        if kind == "control":
+            source = tables["ProjectControl"]
+            controls = tables["Control"]
+            from_ = source.join(controls, controls.c.id == source.c.control_id).join(
+                projects, projects.c.id == source.c.project_id
+            )
+            columns = [
+                projects.c.tenant_id,
+                source.c.project_id,
+                controls.c.name,
+                concat(
+                    controls.c.ref_code,
+                    controls.c.description,
+                    controls.c.guidance,
+                    controls.c.category,
+                    controls.c.subcategory,
+                    source.c.notes,
+                ),
+            ]
+            source_column = source.c.control_id
+        elif kind == "subcontrol":
+            source = tables["ProjectSubControl"]
+            subcontrols = tables["SubControl"]
+            from_ = source.join(
+                subcontrols, subcontrols.c.id == source.c.subcontrol_id
+            ).join(projects, projects.c.id == source.c.project_id)
+            columns = [
+                projects.c.tenant_id,
+                source.c.project_id,
+                subcontrols.c.name,
+                concat(
+                    subcontrols.c.ref_code,
+                    subcontrols.c.description,
+                    subcontrols.c.mitigation,
+                    subcontrols.c.guidance,
+                    source.c.context,
+                    source.c.notes,
+                ),
+            ]
+            source_column = source.c.subcontrol_id
+        elif kind == "evidence":
+            source = tables["ProjectEvidence"]
+            from_ = source.join(projects, projects.c.id == source.c.project_id)
+            columns = [
+                projects.c.tenant_id,
+                source.c.project_id,
+                source.c.name,
+                concat(
+                    source.c.description,
+                    source.c.group,
+                    source.c.file_name,
+                    source.c.content,
+                ),
+            ]
+        elif kind == "policy":
+            source = tables["ProjectPolicy"]
+            versions = tables["PolicyVersion"]
+            from_ = source.join(projects, projects.c.id == source.c.project_id)
+            content = (
+                select([self.strip_tags(versions.c.content)])
+                .where(versions.c.policy_id == source.c.id)
+                .order_by(versions.c.version.desc())
+                .limit(1)
+                .as_scalar()
+            )
+            columns = [
+                projects.c.tenant_id,
+                source.c.project_id,
+                source.c.name,
+                concat(source.c.ref_code, source.c.description, content),
+            ]
+        elif kind == "vendor":
+            source = from_ = tables["Vendor"]
+            columns = [
+                source.c.tenant_id,
+                null(),
+                source.c.name,
+                concat(
+                    source.c.description,
+                    source.c.location,
+                    source.c.contact_email,
+                    source.c.notes,
+                ),
+            ]
+        elif kind == "risk":
+            source = from_ = tables["RiskRegister"]
+            columns = [
+                source.c.tenant_id,
+                source.c.project_id,
+                source.c.title,
+                concat(source.c.description, source.c.remediation),
+            ]
+        else:
+            raise ValueError(f"Unknown search kind: {kind}")
+
+        tenant, project, title, body = columns
+        query = select(
+            [
+                tenant.label("tenant_id"),
+                project.label("project_id"),
+                literal(kind).label("kind"),
+                source.c.id.label("object_id"),
+                title.label("title"),
+                body.label("body"),
+            ]
+        ).select_from(from_)
+        if ids is not None:
+            query = query.where(source.c.id.in_(list(ids)))
+        if source_ids is not None:
+            query = query.where(source_column.in_(list(source_ids)))
+        if tenant_id:
+            query = query.where(tenant == tenant_id)
+        return query
+
+    def tsvector(self, title, body):
+        return func.setweight(
+            func.to_tsvector("english", func.coalesce(title, "")), "A"
+        ).op("||")(
+            func.setweight(func.to_tsvector("english", func.coalesce(body, "")), "B")
+        )
+
+    def upsert(self, query):
+        table = self.table
+        if not self.has_fulltext:
+            return self.replace(query)
+
+        documents = query.alias("documents")
+        statement = insert(table).from_select(
+            [*self.COLUMNS, "tsv"],
+            select(
+                [
+                    *[documents.c[column] for column in self.COLUMNS],
+                    self.tsvector(documents.c.title, documents.c.body),
+                ]
+            ),
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.kind, table.c.object_id],
+            set_={
+                "tenant_id": statement.excluded.tenant_id,
+                "project_id": statement.excluded.project_id,
+                "title": statement.excluded.title,
+                "body": statement.excluded.body,
+                "tsv": statement.excluded.tsv,
+                "date_updated": func.now(),
+            },
+        )
+        return self.session.execute(statement)
+
+    def replace(self, query):
+        """
+        upsert without ON CONFLICT: deletes the documents of the selected
+        rows and inserts them again
+        """
+        table = self.table
+        rows = [dict(row) for row in self.session.execute(query).fetchall()]
+        keys = {}
+        for row in rows:
+            keys.setdefault(row["kind"], set()).add(row["object_id"])
+        self.remove(keys)
+        if rows:
+            self.session.execute(table.insert(), rows)
+        InvertedIndex.clear()
+
+    def refresh(self, refs, source_refs=None):
+        """
+        rebuilds the documents of {kind: {ids}}. Rows that no longer exist
+        lose their document. source_refs rebuilds the documents built from
+        the given controls and subcontrols (see get_refs)
+        """
+        for kind, ids in refs.items():
+            if not ids:
+                continue
+            self.remove({kind: ids})
+            self.upsert(self.select_documents(kind, ids=ids))
+        for kind, ids in (source_refs or {}).items():
+            if ids:
+                self.upsert(self.select_documents(kind, source_ids=ids))
+
+    def remove(self, refs):
+        table = self.table
+        for kind, ids in refs.items():
+            if ids:
+                self.session.execute(
+                    table.delete().where(
+                        and_(table.c.kind == kind, table.c.object_id.in_(list(ids)))
+                    )
+                )
+        if not self.has_fulltext:
+            InvertedIndex.clear()
+
+    def reindex(self, tenant_id):
+        """
+        rebuilds every document of the tenant
+        """
+        table = self.table
+        self.session.execute(table.delete().where(table.c.tenant_id == tenant_id))
+        for kind in self.KINDS:
+            self.upsert(self.select_documents(kind, tenant_id=tenant_id))
+
+    def scope_filter(self, kinds, projects):
+        """
+        kinds: the kinds the user may find
+        projects: the project ids the user may read, None for all
+        """
+        table = self.table
+        clause = table.c.kind.in_(kinds or [None])
+        if projects is not None:
+            clause = and_(
+                clause,
+                or_(
+                    table.c.project_id.is_(None),
+                    table.c.project_id.in_(list(projects) or [None]),
+                ),
+            )
+        return clause
+
+    def search(self, tenant_id, text, scope, kinds=None, limit=20, offset=0):
+        """
+        returns {"results": [...], "next_offset": ...} best match first.
+        scope is the result of Authorizer.can_user_search_tenant
+        """
+        limit = max(1, min(int(limit or 20), self.MAX_LIMIT))
+        offset = max(0, int(offset or 0))
+        if self.has_fulltext:
+            rows = self.search_fulltext(tenant_id, text, scope, kinds, limit, offset)
+        else:
+            rows = self.search_fallback(tenant_id, text, scope, kinds, limit, offset)
+
+        results = [
+            {
+                "kind": row["kind"],
+                "id": row["object_id"],
+                "project_id": row["project_id"],
+                "title": row["title"],
+                "snippet": row["snippet"],
+                "rank": round(row["rank"], 4),
+            }
+            for row in rows[:limit]
+        ]
+        return {
+            "results": results,
+            "next_offset": offset + limit if len(rows) > limit else None,
+        }
+
+    def search_fulltext(self, tenant_id, text, scope, kinds, limit, offset):
+        """
+        returns up to limit + 1 rows, ranked by ts_rank_cd
+        """
+        table = self.table
+        query = func.websearch_to_tsquery("english", text)
+        rank = func.ts_rank_cd(table.c.tsv, query)
+
+        matches = (
+            select([table.c.kind, table.c.object_id, rank.label("rank")])
+            .where(table.c.tenant_id == tenant_id)
+            .where(table.c.tsv.op("@@")(query))
+            .where(self.scope_filter(scope["kinds"], scope["projects"]))
+        )
+        if kinds:
+            matches = matches.where(table.c.kind.in_(kinds))
+        matches = (
+            matches.order_by(rank.desc(), table.c.kind, table.c.object_id)
+            .limit(limit + 1)
+            .offset(offset)
+            .alias("matches")
+        )
+
+        # the snippets are only built for the rows of the page
+        return [
+            dict(row)
+            for row in self.session.execute(
+                select(
+                    [
+                        table.c.kind,
+                        table.c.object_id,
+                        table.c.project_id,
+                        table.c.title,
+                        matches.c.rank,
+                        func.ts_headline(
+                            "english",
+                            table.c.body,
+                            query,
+                            "MaxFragments=2, MaxWords=20, MinWords=5",
+                        ).label("snippet"),
+                    ]
+                )
+                .select_from(
+                    table.join(
+                        matches,
+                        and_(
+                            matches.c.kind == table.c.kind,
+                            matches.c.object_id == table.c.object_id,
+                        ),
+                    )
+                )
+                .order_by(matches.c.rank.desc(), table.c.kind, table.c.object_id)
+            ).fetchall()
+        ]
+
+    def search_fallback(self, tenant_id, text, scope, kinds, limit, offset):
+        """
+        search_fulltext with the InvertedIndex
+        """
+        projects = scope["projects"]
+        allowed_kinds = set(scope["kinds"])
+        if kinds:
+            allowed_kinds &= set(kinds)
+
+        def allowed(row):
+            if row.kind not in allowed_kinds:
+                return False
+            return projects is None or not row.project_id or row.project_id in projects
+
+        index = InvertedIndex.for_tenant(self.session, self.table, tenant_id)
+        return [
+            {
+                "kind": row.kind,
+                "object_id": row.object_id,
+                "project_id": row.project_id,
+                "title": row.title,
+                "snippet": index.headline(row.body, text),
+                "rank": rank,
+            }
+            for row, rank in index.search(text, allowed)[offset : offset + limit + 1]
+        ]
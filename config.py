@@ -50,6 +50,43 @@ class Config:
     LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
     ENABLE_GCP_LOGGING = os.environ.get("ENABLE_GCP_LOGGING", "false").lower() == "true"
 
+    # audit logs (Logs.add) are queued and inserted in batches by a
+    # background thread. Disabled (synchronous) when TESTING is set
+    AUDIT_LOG_ASYNC = os.environ.get("AUDIT_LOG_ASYNC", "true").lower() == "true"
+    AUDIT_LOG_BATCH_SIZE = int(os.environ.get("AUDIT_LOG_BATCH_SIZE", 100))
+    AUDIT_LOG_FLUSH_INTERVAL = float(os.environ.get("AUDIT_LOG_FLUSH_INTERVAL", 2))
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get("AUDIT_LOG_QUEUE_SIZE", 10000))
+    # verified API tokens are cached in-process for up to TTL seconds and
+    # login_count/last_seen of token requests are written in batches
+    API_TOKEN_CACHE_SIZE = int(os.environ.get("API_TOKEN_CACHE_SIZE", 10000))
+    API_TOKEN_CACHE_TTL = int(os.environ.get("API_TOKEN_CACHE_TTL", 60))
+    USER_ACTIVITY_FLUSH_INTERVAL = int(
+        os.environ.get("USER_ACTIVITY_FLUSH_INTERVAL", 30)
+    )
+    # project completion snapshots are taken in the background at most
+    # once per COMPLETION_HISTORY_INTERVAL seconds per project
+    COMPLETION_HISTORY_INTERVAL = int(
+        os.environ.get("COMPLETION_HISTORY_INTERVAL", 86400)
+    )
+    COMPLETION_HISTORY_FLUSH_INTERVAL = int(
+        os.environ.get("COMPLETION_HISTORY_FLUSH_INTERVAL", 30)
+    )
+    # snapshots older than COMPLETION_HISTORY_COMPACT_DAYS are compacted to
+    # one per project per day, see "python manage.py compact_history"
+    COMPLETION_HISTORY_COMPACT_DAYS = int(
+        os.environ.get("COMPLETION_HISTORY_COMPACT_DAYS", 90)
+    )
+    # rendered policy versions kept in memory per process
+    POLICY_RENDER_CACHE_SIZE = int(os.environ.get("POLICY_RENDER_CACHE_SIZE", 256))
+    # JSON responses are encoded with orjson when it is installed, "stdlib"
+    # switches to the json module. Dates are HTTP dates unless JSON_ISO_DATES
+    JSON_PROVIDER = os.environ.get("JSON_PROVIDER", "orjson")
+    JSON_ISO_DATES = os.environ.get("JSON_ISO_DATES", "false").lower() == "true"
+    # logs are archived per month once the month is older than the
+    # retention, see "python manage.py archive_logs"
+    LOG_RETENTION_DAYS = int(os.environ.get("LOG_RETENTION_DAYS", 365))
+    LOG_ARCHIVE_BATCH_SIZE = int(os.environ.get("LOG_ARCHIVE_BATCH_SIZE", 5000))
+
     SECRET_KEY = os.environ.get("SECRET_KEY", "change_secret_key")
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
     SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -89,6 +126,15 @@ class Config:
     FRAMEWORK_FOLDER = os.environ.get(
         "FRAMEWORK_FOLDER", os.path.join(basedir, "app/files/base_controls")
     )
+    FRAMEWORK_IMPORT_BATCH_SIZE = int(
+        os.environ.get("FRAMEWORK_IMPORT_BATCH_SIZE", 500)
+    )
+    FRAMEWORK_IMPORT_WORKERS = int(os.environ.get("FRAMEWORK_IMPORT_WORKERS", 4))
+    # tenants reference one shared copy of the bundled frameworks and only
+    # copy the controls they customize
+    SHARED_FRAMEWORK_CATALOG = (
+        os.environ.get("SHARED_FRAMEWORK_CATALOG", "true").lower() == "true"
+    )
     POLICY_FOLDER = os.environ.get(
         "POLICY_FOLDER", os.path.join(basedir, "app/files/base_policies")
     )
@@ -112,6 +158,18 @@ class Config:
     AWS_ACCESS_KEY = os.environ.get("AWS_ACCESS_KEY")
     AWS_SECRET_KEY = os.environ.get("AWS_SECRET_KEY")
     AWS_REGION = os.environ.get("AWS_REGION")
+    # S3 compatible endpoint, e.g. minio for local testing
+    AWS_ENDPOINT_URL = os.environ.get("AWS_ENDPOINT_URL")
+
+    # seconds a direct upload url is valid
+    UPLOAD_URL_EXPIRES = int(os.environ.get("UPLOAD_URL_EXPIRES", 3600))
+    # unreferenced evidence blobs are kept this long before they are deleted
+    BLOB_GC_GRACE_HOURS = int(os.environ.get("BLOB_GC_GRACE_HOURS", 24))
+
+    # connections kept alive per storage client (shared by all threads)
+    STORAGE_MAX_POOL_CONNECTIONS = int(
+        os.environ.get("STORAGE_MAX_POOL_CONNECTIONS", 50)
+    )
 
     # AI
     LLM_ENABLED = os.environ.get("LLM_ENABLED", "false").lower() == "true"
@@ -14,6 +14,13 @@ from app.commands import (
     MigrateDbCommand,
     DataImportCommand,
     ForceDropTablesCommand,
+    IndexLogsCommand,
+    ArchiveLogsCommand,
+    ReconcileStorageCommand,
+    CollectBlobsCommand,
+    CompactHistoryCommand,
+    IndexSearchCommand,
+    ReconcileProgressCommand,
 )
 
 # Setup Flask-Script with command line commands
@@ -24,6 +31,13 @@ manager.add_command("create_db", CreateDbCommand)
 manager.add_command("migrate_db", MigrateDbCommand)
 manager.add_command("import", DataImportCommand)
 manager.add_command("force_drop_db", ForceDropTablesCommand)
+manager.add_command("index_logs", IndexLogsCommand)
+manager.add_command("archive_logs", ArchiveLogsCommand)
+manager.add_command("reconcile_storage", ReconcileStorageCommand)
+manager.add_command("collect_blobs", CollectBlobsCommand)
+manager.add_command("compact_history", CompactHistoryCommand)
+manager.add_command("index_search", IndexSearchCommand)
+manager.add_command("reconcile_progress", ReconcileProgressCommand)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,113 @@
+"""
+Compares the JSON providers (stdlib and orjson) on payloads shaped like
+GET /projects/<pid>/controls, built from the bundled frameworks. Checks
+that both providers produce the same document and reports the encode time
+of jsonify and of a streamed array
+
+Usage:
+    python tools/benchmark_json.py [framework ...]
+"""
+
+import sys
+import os
+import json
+import time
+from datetime import datetime, timedelta
+
+# improve this hack
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.utils.framework_import import FrameworkCatalog
+from app.utils.json_provider import AppJSONProvider, OrjsonProvider, orjson
+
+app = create_app(os.getenv("FLASK_CONFIG") or "default")
+ROUNDS = int(os.getenv("ROUNDS", 5))
+
+
+def build_payload(name):
+    """
+    project controls with their subcontrols, as returned by
+    ControlStats.get_controls
+    """
+    now = datetime.utcnow()
+    payload = []
+    for index, (row, subcontrol_rows) in enumerate(FrameworkCatalog.get_controls(name)):
+        control = dict(
+            row,
+            id=f"c{index}",
+            framework=name,
+            date_added=now - timedelta(days=index),
+            date_updated=now,
+            review_status="infosec action",
+            notes=None,
+            tags=[],
+        )
+        control["subcontrols"] = [
+            dict(
+                sub,
+                id=f"c{index}s{position}",
+                implemented=position * 10 % 110,
+                is_applicable=True,
+                owner=None,
+                operator=None,
+                evidence=[],
+                date_added=now - timedelta(days=index),
+                date_updated=None,
+            )
+            for position, sub in enumerate(subcontrol_rows)
+        ]
+        payload.append(control)
+    return payload
+
+
+def measure(callback):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        size = callback()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+
+def encode(provider, payload):
+    return lambda: len(provider.response(payload).get_data())
+
+
+def stream(provider, payload):
+    return lambda: sum(len(chunk) for chunk in provider.stream(payload).response)
+
+
+def run(names):
+    providers = [AppJSONProvider(app)]
+    if orjson:
+        providers.append(OrjsonProvider(app))
+    else:
+        print("[WARNING] orjson is not installed, only the stdlib provider is measured")
+
+    with app.test_request_context():
+        print(
+            f"{'framework':<20}{'provider':<10}{'controls':>10}{'size (kb)':>12}"
+            f"{'jsonify (ms)':>15}{'stream (ms)':>14}"
+        )
+        for name in names:
+            payload = build_payload(name)
+            documents = [json.loads(p.response(payload).get_data()) for p in providers]
+            if any(document != documents[0] for document in documents):
+                print(f"[ERROR] The providers disagree on: {name}")
+            for provider in providers:
+                seconds, size = measure(encode(provider, payload))
+                streamed, _ = measure(stream(provider, payload))
+                print(
+                    f"{name:<20}{provider.name:<10}{len(payload):>10}"
+                    f"{size / 1024:>12.1f}{seconds * 1000:>15.2f}{streamed * 1000:>14.2f}"
+                )
+
+
+if __name__ == "__main__":
+    folder = app.config["FRAMEWORK_FOLDER"]
+    run(
+        sys.argv[1:]
+        or sorted(f[: -len(".json")] for f in os.listdir(folder) if f.endswith(".json"))
+    )
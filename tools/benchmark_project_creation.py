@@ -0,0 +1,97 @@
+"""
+Compares the per-row project instantiation (ORM objects for every control,
+subcontrol and task) with the set-based Project.add_controls on the bundled
+frameworks. Runs against the configured database inside a throwaway tenant
+that is deleted afterwards
+
+Usage:
+    python tools/benchmark_project_creation.py [framework ...]
+"""
+
+import sys
+import os
+import time
+
+# improve this hack
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from app.models import *
+
+app = create_app(os.getenv("FLASK_CONFIG") or "default")
+
+
+def legacy_add_controls(project, controls):
+    """the previous Tenant.create_project loop"""
+    for control in controls:
+        if project.has_control(control.id):
+            continue
+        project_control = ProjectControl(control_id=control.id)
+        for sub in control.subcontrols.all():
+            control_sub = ProjectSubControl(subcontrol_id=sub.id, project_id=project.id)
+            project_control.subcontrols.append(control_sub)
+            for task in sub.tasks or []:
+                project_control.feedback.append(
+                    AuditorFeedback(
+                        title=task.get("title"),
+                        description=task.get("description"),
+                        owner_id=project.owner_id,
+                    )
+                )
+        project.controls.append(project_control)
+
+
+def create_project(tenant, owner, name, controls, legacy=False):
+    start = time.perf_counter()
+    project = Project(name=name, description=name, owner_id=owner.id)
+    tenant.projects.append(project)
+    db.session.flush()
+    if legacy:
+        legacy_add_controls(project, controls)
+    else:
+        project.add_controls(controls, commit=False)
+    db.session.commit()
+    return time.perf_counter() - start
+
+
+def run(names):
+    with app.app_context():
+        owner = User.query.filter(User.super == True).first()
+        if not owner:
+            print("[ERROR] A super user is required, run: python manage.py init_db")
+            exit(1)
+        tenant = Tenant(
+            name=f"benchmark-{int(time.time())}", owner_id=owner.id, project_cap=1000
+        )
+        db.session.add(tenant)
+        db.session.commit()
+        try:
+            tenant.create_base_frameworks()
+            print(
+                f"{'framework':<20}{'controls':>10}{'legacy (s)':>14}{'bulk (s)':>12}"
+            )
+            for name in names:
+                framework = Framework.find_by_name(name, tenant.id)
+                if not framework:
+                    print(f"[WARNING] Framework not found: {name}")
+                    continue
+                if not framework.has_controls():
+                    framework.init_controls()
+                controls = framework.get_controls()
+                legacy = create_project(
+                    tenant, owner, f"{name}-legacy", controls, legacy=True
+                )
+                bulk = create_project(tenant, owner, f"{name}-bulk", controls)
+                print(f"{name:<20}{len(controls):>10}{legacy:>14.3f}{bulk:>12.3f}")
+        finally:
+            db.session.rollback()
+            db.session.delete(tenant)
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    folder = app.config["FRAMEWORK_FOLDER"]
+    run(
+        sys.argv[1:]
+        or sorted(f[: -len(".json")] for f in os.listdir(folder) if f.endswith(".json"))
+    )